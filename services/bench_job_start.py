@@ -0,0 +1,94 @@
+# bench_job_start.py
+#
+# ジョブ開始までの待ち時間を、
+#   spawn  : ジョブごとに python を起動して ttl_merge を import する従来方式
+#   daemon : 常駐の ttl_worker_daemon に JSON-RPC で submit する方式
+# で比較します。daemon 側は submit 送信から status=running 通知を受け取るまでを計測し、
+# 計測後すぐ cancel します（列挙のネットワーク通信は計測に含まれません）。
+#
+#   python bench_job_start.py --repeat 10
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DUMMY_URL = "https://www.youtube.com/watch?v=dROnSxQnrVU"
+
+def _spawn_once():
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import ttl_merge; print('ready', flush=True)"],
+        cwd=HERE, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+def _send(proc, message):
+    proc.stdin.write(json.dumps(message) + "\n")
+    proc.stdin.flush()
+
+def _daemon_samples(repeat, download_dir):
+    proc = subprocess.Popen(
+        [sys.executable, "ttl_worker_daemon.py"], cwd=HERE, text=True, encoding="utf-8",
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # 起動完了（import 済み）を ping で確認してから計測
+        _send(proc, {"jsonrpc": "2.0", "id": 0, "method": "ping"})
+        for line in proc.stdout:
+            if json.loads(line).get("id") == 0:
+                break
+
+        samples = []
+        for i in range(1, repeat + 1):
+            start = time.perf_counter()
+            _send(proc, {"jsonrpc": "2.0", "id": i, "method": "submit",
+                         "params": {"url": DUMMY_URL, "download_dir": download_dir}})
+            # submit の応答と job 通知は順不同で届くので、状態を集めながら待つ
+            job_id, started, finished, cancel_sent = None, False, False, False
+            statuses = {}
+            for line in proc.stdout:
+                message = json.loads(line)
+                if message.get("id") == i:
+                    job_id = message["result"]["job_id"]
+                elif message.get("method") == "job":
+                    statuses.setdefault(message["params"]["job_id"], []).append(message["params"]["status"])
+                seen = statuses.get(job_id, [])
+                if job_id and not started and any(s != "queued" for s in seen):
+                    samples.append(time.perf_counter() - start)
+                    started = True
+                if started and not cancel_sent:
+                    _send(proc, {"jsonrpc": "2.0", "id": f"c{i}", "method": "cancel", "params": {"job_id": job_id}})
+                    cancel_sent = True
+                finished = any(s in ("done", "failed", "cancelled") for s in seen)
+                if started and finished:
+                    break
+            else:
+                raise RuntimeError("daemon が終了しました")
+        return samples
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=60)
+
+def _row(name, samples):
+    return f"{name:>8} {len(samples):>4} {statistics.mean(samples) * 1000:>10.1f} {statistics.median(samples) * 1000:>10.1f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="ジョブ開始までの待ち時間を比較")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--download-dir", default="dl_bench")
+    args = parser.parse_args()
+
+    spawn = [_spawn_once() for _ in range(args.repeat)]
+    daemon = _daemon_samples(args.repeat, args.download_dir)
+
+    print(f"\n{'mode':>8} {'n':>4} {'mean(ms)':>10} {'p50(ms)':>10}")
+    print(_row("spawn", spawn))
+    print(_row("daemon", daemon))
+
+if __name__ == "__main__":
+    main()
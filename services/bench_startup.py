@@ -0,0 +1,122 @@
+# bench_startup.py
+#
+# services のよく使う入口の起動時間を計測し、bench_startup_budget.json の予算と比べます。
+# 予算超過、または読み込んではいけない重い依存（yt_dlp / requests）が読み込まれていたら
+# 終了コード 1 で終わります。
+#
+#   python bench_startup.py             # 計測して予算と比較
+#   python bench_startup.py --record    # 現在の計測値 × margin を予算として保存（環境を変えたとき）
+#   python bench_startup.py --importtime "import ttl_merge"   # -X importtime の内訳（上位）を表示
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGET_PATH = os.path.join(HERE, "bench_startup_budget.json")
+
+# 計測するコマンド（python -c に渡す）。重い依存が不要な操作だけを並べる
+COMMANDS = {
+    "import ttl_merge": "import ttl_merge",
+    "import ttl_refresh": "import ttl_refresh",
+    "title file": (
+        "import tempfile; from utl5_title_file_creator import create_title_file;"
+        " create_title_file('bench', tempfile.mkdtemp())"
+    ),
+    "library query": (
+        "from utl1_1_known_video_ids import load_known_video_ids;"
+        " load_known_video_ids('dl/metadata.sqlite3', 'dl')"
+    ),
+}
+HEAVY_MODULES = ("yt_dlp", "requests")
+DEFAULT_MARGIN = 1.5
+
+def _run(code):
+    # 計測後に読み込まれていた重い依存を stdout の最終行で受け取る
+    probe = (f"{code}\nimport sys, json\n"
+             f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", probe], cwd=HERE, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+    elapsed = time.perf_counter() - start
+    loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    return elapsed, loaded
+
+def measure(repeat):
+    # python 自体の起動時間も併記する（予算はこれを含んだ値）
+    results = {}
+    for name, code in {"python (empty)": "pass", **COMMANDS}.items():
+        _run(code)  # ディスクキャッシュを温める
+        samples, loaded = [], []
+        for _ in range(repeat):
+            elapsed, loaded = _run(code)
+            samples.append(elapsed * 1000)
+        results[name] = {"median_ms": statistics.median(samples), "loaded_heavy": loaded}
+    return results
+
+def importtime(code, top):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=HERE, check=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding="utf-8")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    print(f"\n-X importtime: {code}")
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>9}  module")
+    for cumulative_us, self_us, name in rows[:top]:
+        print(f"{cumulative_us / 1000:>15.1f} {self_us / 1000:>9.1f}  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間の計測と予算チェック")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--record", action="store_true", help="計測値 × margin を予算として保存")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN)
+    parser.add_argument("--importtime", metavar="CODE", help="-X importtime の内訳を表示するコード")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.importtime:
+        importtime(args.importtime, args.top)
+        return
+
+    results = measure(args.repeat)
+
+    if args.record:
+        budget = {"margin": args.margin,
+                  "commands": {name: {"max_ms": round(r["median_ms"] * args.margin, 1)}
+                               for name, r in results.items() if name in COMMANDS}}
+        with open(BUDGET_PATH, "w", encoding="utf-8") as f:
+            json.dump(budget, f, ensure_ascii=False, indent=4)
+            f.write("\n")
+        print(f"予算を保存しました: {BUDGET_PATH}")
+
+    with open(BUDGET_PATH, encoding="utf-8") as f:
+        budget = json.load(f)["commands"]
+
+    failed = False
+    print(f"\n{'command':<22} {'median(ms)':>11} {'budget(ms)':>11}  result")
+    for name, r in results.items():
+        limit = budget.get(name, {}).get("max_ms")
+        problems = []
+        if limit is not None and r["median_ms"] > limit:
+            problems.append("予算超過")
+        if name in COMMANDS and r["loaded_heavy"]:
+            problems.append(f"重い依存を読み込み: {', '.join(r['loaded_heavy'])}")
+        failed = failed or bool(problems)
+        limit_text = f"{limit:.1f}" if limit is not None else "-"
+        print(f"{name:<22} {r['median_ms']:>11.1f} {limit_text:>11}  {'NG: ' + ' / '.join(problems) if problems else 'OK'}")
+
+    if failed:
+        print("\n起動時間が予算を超えました。-X importtime で内訳を確認してください:"
+              "\n  python bench_startup.py --importtime \"import ttl_merge\"")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
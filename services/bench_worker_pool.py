@@ -0,0 +1,66 @@
+# bench_worker_pool.py
+#
+# utl6_worker_pool.run_ordered の並列数ごとの実時間（wall-clock）を計測します。
+#
+#   python bench_worker_pool.py                      # 疑似ジョブ（待ち時間のみ）で計測
+#   python bench_worker_pool.py --url <channel/playlist URL> --limit 16
+#                                                    # 実ダウンロードで計測（dl_bench/ に保存）
+
+import argparse
+import os
+import shutil
+import time
+from functools import partial
+
+from utl6_worker_pool import run_ordered
+
+DEFAULT_WORKERS = (1, 2, 4, 8)
+
+# 疑似ジョブ: ネットワーク待ち相当の sleep と、少量の CPU 処理
+def _synthetic_job(item, latency):
+    time.sleep(latency)
+    return sum(i * i for i in range(2000)) + item
+
+def _measure(job, items, workers, mode):
+    start = time.perf_counter()
+    reported = [item for item, _ in run_ordered(job, items, workers=workers, mode=mode)]
+    elapsed = time.perf_counter() - start
+    assert reported == list(items), "報告順が入力順と一致しません"
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="worker pool の並列数ごとの実時間を計測")
+    parser.add_argument("--workers", type=int, nargs="+", default=list(DEFAULT_WORKERS))
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--jobs", type=int, default=32, help="疑似ジョブ数")
+    parser.add_argument("--latency", type=float, default=0.25, help="疑似ジョブ 1 件の待ち時間(秒)")
+    parser.add_argument("--url", help="指定時は実際に extract → download を行う")
+    parser.add_argument("--limit", type=int, default=8, help="--url 指定時に使う動画数")
+    parser.add_argument("--format-code", default="a")
+    parser.add_argument("--download-dir", default="dl_bench")
+    args = parser.parse_args()
+
+    if args.url:
+        from ttl_merge import process_video
+        from utl1_video_urls_extractor import extract_video_urls
+        items = extract_video_urls(args.url)[:args.limit]
+        job = partial(process_video, download_dir=args.download_dir, format_code=args.format_code)
+    else:
+        items = list(range(args.jobs))
+        job = partial(_synthetic_job, latency=args.latency)
+
+    rows = []
+    for workers in args.workers:
+        if args.url and os.path.isdir(args.download_dir):
+            # 毎回まっさらな状態から計測する
+            shutil.rmtree(args.download_dir)
+        rows.append((workers, _measure(job, items, workers, args.mode)))
+
+    base = rows[0][1]
+    print(f"\nmode={args.mode} items={len(items)}")
+    print(f"{'workers':>8} {'wall(s)':>10} {'speedup':>8}")
+    for workers, elapsed in rows:
+        print(f"{workers:>8} {elapsed:>10.2f} {base / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
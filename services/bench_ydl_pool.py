@@ -0,0 +1,72 @@
+# bench_ydl_pool.py
+#
+# YoutubeDL を毎回生成する場合と、utl2_2_ydl_pool で使い回す場合の 1 本あたりのオーバーヘッドを計測します。
+#
+#   python bench_ydl_pool.py                         # 生成コストのみ（ネットワーク無し）
+#   python bench_ydl_pool.py --url <動画URL> [<動画URL> ...] --repeat 3
+#                                                    # 情報抽出（download=False）込みで計測
+
+import argparse
+import statistics
+import time
+
+import yt_dlp
+
+from utl2_2_ydl_pool import YdlPool
+
+YDL_OPTS = {
+    'quiet': True,
+    'skip_download': True,
+    'noplaylist': True,
+    'ignoreerrors': True,
+    'extractor_args': {'youtube': {'player_client': ['tv']}},
+}
+
+def _fresh(urls, repeat):
+    samples = []
+    for _ in range(repeat):
+        for url in urls:
+            start = time.perf_counter()
+            with yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
+                if url:
+                    ydl.extract_info(url, download=False)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def _pooled(urls, repeat):
+    pool = YdlPool()
+    samples = []
+    for _ in range(repeat):
+        for url in urls:
+            start = time.perf_counter()
+            with pool.checkout(YDL_OPTS) as ydl:
+                if url:
+                    ydl.extract_info(url, download=False)
+            samples.append(time.perf_counter() - start)
+    pool.close_all()
+    return samples
+
+def _row(name, samples):
+    return (f"{name:>8} {len(samples):>6} {statistics.mean(samples) * 1000:>10.1f}"
+            f" {statistics.median(samples) * 1000:>10.1f} {sum(samples):>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="YoutubeDL 使い回しの効果を計測")
+    parser.add_argument("--url", nargs="*", default=[], help="情報抽出に使う動画URL（省略時は生成コストのみ）")
+    parser.add_argument("--repeat", type=int, default=50, help="URL 一覧を繰り返す回数")
+    args = parser.parse_args()
+
+    urls = args.url or [None]
+    # 初回 import/extractor ロードの影響を揃えるため、1 回捨てる
+    _fresh([None], 1)
+
+    fresh = _fresh(urls, args.repeat)
+    pooled = _pooled(urls, args.repeat)
+
+    print(f"\n{'mode':>8} {'n':>6} {'mean(ms)':>10} {'p50(ms)':>10} {'total(s)':>9}")
+    print(_row("fresh", fresh))
+    print(_row("pooled", pooled))
+    print(f"1 本あたりの短縮: {(statistics.mean(fresh) - statistics.mean(pooled)) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
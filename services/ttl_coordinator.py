@@ -0,0 +1,99 @@
+# ttl_coordinator.py
+#
+# 複数マシンで 1 つのダウンロード待ち行列を消化するときの、中央側のプロセス。
+# input_url を列挙して待ち行列（dl/jobs.sqlite3）に積み、ttl_remote_worker.py からの
+# 貸し出し要求に応え、返ってきたメタデータを中央の索引（dl/metadata.sqlite3）に取り込みます。
+#
+#   python ttl_coordinator.py https://www.youtube.com/@xxx --host 0.0.0.0 --port 8765
+#
+# 1 台で試す場合（コーディネーターは 127.0.0.1 で待ち受け、ワーカーは別ディレクトリに保存）:
+#   python ttl_coordinator.py https://www.youtube.com/@xxx
+#   python ttl_remote_worker.py --download-dir dl_w1
+#   python ttl_remote_worker.py --download-dir dl_w2
+
+import argparse
+import os
+import sys
+import time
+
+from utl1_1_known_video_ids import SkippedVideoStore, load_known_video_ids
+from utl1_video_urls_extractor import iter_video_urls
+from utl3_info_sqlite_writer import upsert_info_sqlite
+from utl8_1_work_leases import WorkLeaseQueue
+from utl8_2_remote_queue import DEFAULT_HOST, DEFAULT_PORT, MAX_BATCH, Coordinator
+
+# 文字化け防止のため、標準出力と標準エラー出力をUTF-8に設定
+sys.stdout.reconfigure(encoding='utf-8')
+sys.stderr.reconfigure(encoding='utf-8')
+
+# 完了後、ワーカーが「もう作業は無い」と受け取れるように待ち受けを続ける秒数
+SHUTDOWN_GRACE_SEC = 10
+# 進捗を表示する間隔（秒）
+STATUS_INTERVAL_SEC = 10
+
+# メイン関数: 待ち行列を作ってリモートワーカーに配り、全件が終わるまで待ちます。
+def main():
+    parser = argparse.ArgumentParser(description="リモートワーカーに動画を配るコーディネーター")
+    parser.add_argument("input_url")
+    parser.add_argument("--download-dir", default="dl", help="中央の索引（metadata.sqlite3 / jobs.sqlite3）の場所")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="1 ワーカーに同時に貸し出す動画数の上限")
+    parser.add_argument("--full", action="store_true", help="差分同期をせず、ライブラリにある動画も配る")
+    args = parser.parse_args()
+
+    try:
+        # ---------------------------
+        # 1. 初期設定
+        # ---------------------------
+        db_path = os.path.join(args.download_dir, 'metadata.sqlite3')
+        queue = WorkLeaseQueue(os.path.join(args.download_dir, 'jobs.sqlite3'))
+        queue.open_source(args.input_url)
+        coordinator = Coordinator(queue, args.input_url,
+                                  on_complete=lambda info: upsert_info_sqlite(info, db_path),
+                                  max_batch=args.max_batch)
+        # 列挙の完了を待たずに配り始める
+        coordinator.serve_in_background(args.host, args.port)
+        print(f"待ち受けを開始しました: {args.host}:{args.port}")
+
+
+        # ---------------------------
+        # 2. 列挙 → 待ち行列へ
+        # ---------------------------
+        if args.full:
+            video_urls = iter_video_urls(args.input_url)
+        else:
+            video_urls = iter_video_urls(
+                args.input_url,
+                known_ids=load_known_video_ids(db_path, args.download_dir),
+                stop_after_known=30,
+                skipped=SkippedVideoStore(db_path),
+            )
+        total = 0
+        for video_url in video_urls:
+            if queue.add(args.input_url, total, video_url):
+                total += 1
+        queue.close_source(args.input_url)
+        print(f"待ち行列に積んだ動画: {total} 件")
+
+
+        # ---------------------------
+        # 3. 全件が終わるまで待つ
+        # ---------------------------
+        while not queue.finished(args.input_url):
+            time.sleep(STATUS_INTERVAL_SEC)
+            print(f"進捗: {coordinator.status()['counts']}")
+        time.sleep(SHUTDOWN_GRACE_SEC)
+        coordinator.shutdown()
+
+        counts = queue.counts(args.input_url)
+        print("\nすべての動画の処理が完了しました。")
+        print(f"完了: {counts.get('done', 0)} 件 / 失敗: {counts.get('failed', 0)} 件")
+
+
+    except KeyboardInterrupt:
+        print("\n ctrl+cで処理が中断されました")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
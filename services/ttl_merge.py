@@ -1,95 +1,649 @@
 # ttl_merge.py
 
-import io
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 
-from utl1_video_urls_extractor import extract_video_urls
-from utl2_video_downloader import download_video
+from utl1_1_known_video_ids import SkippedVideoStore, load_known_video_ids
+from utl1_video_urls_extractor import iter_video_urls, skip_reason
+from utl2_video_downloader import download_video, extract_video_info, select_formats
+from utl2_3_progress_emitter import default_emitter
+from utl2_4_fragment_tuner import configure_fragments, default_fragment_tuner
+from utl2_5_single_flight import default_single_flight
+from utl2_6_player_clients import configure_client_strategy, default_client_strategy
+from utl2_7_stall_watchdog import configure_stall_watchdog, default_stall_watchdog
+from utl2_9_staging import configure_staging, default_staging
 from utl3_info_json_creator import create_info_json
+from utl3_info_sqlite_writer import upsert_info_sqlite
 from utl4_thumbnail_downloader import download_thumbnail
 from utl5_title_file_creator import create_title_file
+from utl6_worker_pool import run_ordered
+from utl6_1_priority_scheduler import BULK, with_slot
+from utl6_2_retry_queue import RetryQueue, default_circuit_breaker, failure_of, isolated, run_isolated
+from utl7_stage_pipeline import Pipeline, Stage
+from utl8_job_ledger import (
+    STAGE_DOWNLOADED, STAGE_INFO_JSON, STAGE_THUMBNAIL, STAGE_TITLE_FILE,
+    JobLedger, video_id_from_url,
+)
+from utl8_1_work_leases import DONE, FAILED, WorkLeaseQueue, iter_lease_results, run_lease_worker
+from utl9_network_governor import default_governor
+from utl9_1_disk_space import configure_disk_guard
 
 # 文字化け防止のため、標準出力と標準エラー出力をUTF-8に設定
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+# （import されても差し替えずに済むよう reconfigure を使う。常駐プロセスからも import するため）
+sys.stdout.reconfigure(encoding='utf-8')
+sys.stderr.reconfigure(encoding='utf-8')
 
-# メイン関数: YouTube動画をダウンロードし、メタデータ、サムネイル、タイトルファイルを生成します。
-def main():
+# メディアの転送と並行して作る小さい成果物（メタデータ/サムネイル/タイトル）用のスレッド
+_ARTEFACT_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="artefact")
+
+class _SharedArtefacts(dict):
+    """同じ動画の処理に相乗りした呼び出しが受け取る、リーダーの成果物 {段: Future}（待つだけで何も書かない）。"""
+
+# ------------------------------------------------------------------
+# 1 本分の処理: 情報抽出 → (メディアDL ‖ メタデータ ‖ サムネイル ‖ タイトルファイル)
+# メタデータ類は抽出直後に手元でフォーマットを選んだ情報から作り始めるため、
+# メディアの大きさに関係なく、DL完了とほぼ同時に揃います。
+# 並列実行（プロセスモード含む）から呼ばれるため、結果は pickle 可能な dict で返します。
+# ledger を渡すと各段の完了を記録し、完了済みの段は飛ばします。
+# info_dict に列挙時に取得済みの情報を渡すと、再抽出せずにダウンロードします。
+# 抽出した完全な情報でメンバー限定・非公開などと分かった動画は、DLせずに None を返します（SKIP）。
+# progress（ProgressEmitter）を渡すと、この動画の進捗と段の完了をそこへ出します（省略時は既定の emitter）。
+# ------------------------------------------------------------------
+def process_video(video_url, download_dir, format_code, ledger=None, info_dict=None, progress=None):
+    # ---------------------------
+    # 1. メディアのダウンロード（メタデータ類はその間に並行して作る）
+    # ---------------------------
+    # DL済みでも後続の段には info_dict が要るため呼び出す（既存の media は yt-dlp が再DLしない）
+    info_dict, artefacts = download_with_artefacts(video_url, download_dir, format_code, ledger, info_dict, progress)
+    if info_dict is None:
+        return None  # SKIP（理由は表示済み）
+
+    # ---------------------------
+    # 2. メタデータ・サムネイル・タイトルファイルの完了を待つ
+    # ---------------------------
+    return finish_artefacts(info_dict, download_dir, ledger, artefacts, progress)
+
+# 列挙結果 (video_url, info_dict) 1 件分を処理します（ワーカープール用）。
+def process_entry(entry, download_dir, format_code, ledger=None, progress=None):
+    video_url, info_dict = entry
+    return process_video(video_url, download_dir, format_code, ledger, info_dict=info_dict, progress=progress)
+
+# 台帳で完了済みの段なら (記録済みのパス, True) を返し、未完了なら step() を実行して (パス, False) を返します。
+# 完了の記録は _commit_stage で行います（メディアのDLが終わるまで記録を保留できるように）。
+def _prepare_stage(ledger, video_id, stage, step, progress=None):
+    if ledger and ledger.is_done(video_id, stage):
+        print(f"【SKIP】ID={video_id} ({stage} は完了済み)")
+        progress = progress or default_emitter()
+        if progress:
+            progress.emit(video_id, stage, 'skipped')
+        return ledger.stage_path(video_id, stage), True
+    return step(), False
+
+# 段の完了を台帳に記録し、進捗チャネルがあれば UI へ通知します。
+def _commit_stage(ledger, video_id, stage, path, progress=None):
+    if ledger and path:
+        ledger.mark_done(video_id, stage, path)
+    progress = progress or default_emitter()
+    if progress:
+        progress.emit(video_id, stage, 'finished' if path else 'error', path=path)
+
+# 台帳で完了済みの段なら記録済みのパスを返し、未完了なら step() を実行して記録します。
+def _run_stage(ledger, video_id, stage, step, progress=None):
+    path, done = _prepare_stage(ledger, video_id, stage, step, progress)
+    if not done:
+        _commit_stage(ledger, video_id, stage, path, progress)
+    return path
+
+# ------------------------------------------------------------------
+# メディアをダウンロードし、その間にメタデータ/サムネイル/タイトルファイルを並行して作ります。
+# Returns:
+#     tuple: (DL後の info_dict, 並行中の成果物 {段: Future})。
+#            抽出やフォーマット選択に失敗した場合、成果物は None（DL後に finalize_video で作る）。
+#            抽出した完全な情報で SKIP と分かった場合は (None, None)。
+# メディアのDLに失敗した場合は、先に書いた info.json を消してから例外を送出します。
+# （落ちた/止めた場合に残った info.json は、完成したメディアが無いので差分同期では未取得のまま扱われる）
+#
+# 同じ動画が同時に来た場合（列挙の重複・常駐プロセスの別ジョブ・別プロセス）、成果物（info.json・サムネイル・
+# タイトルファイル・索引・台帳）を書くのは single-flight のリーダーだけです。プロセス内で相乗りした呼び出しは
+# リーダーのDLと成果物を待ち、成果物は _SharedArtefacts で受け取ります（finish_artefacts も何も書かない）。
+# 別プロセスはリーダーのファイルが書き終わるまで待ってから処理します。
+# ------------------------------------------------------------------
+def download_with_artefacts(video_url, download_dir, format_code, ledger=None, info_dict=None, progress=None):
+    if info_dict is None:
+        info_dict = extract_video_info(video_url)
+        # 一覧の簡易情報では分からなかったメンバー限定などを、ここで完全な情報から判定
+        if _skipped(video_url, info_dict, download_dir):
+            return None, None
+    video_id = (info_dict or {}).get('id') or video_id_from_url(video_url or '')
+    if not video_id:
+        return _download_with_artefacts(video_url, download_dir, format_code, ledger, info_dict, progress)
+    return default_single_flight().do(
+        ('artefacts', video_id, format_code, os.path.abspath(download_dir)),
+        lambda: _download_with_artefacts(video_url, download_dir, format_code, ledger, info_dict, progress),
+        lock_path=os.path.join(download_dir, 'jobs.sqlite3'),
+        shared=lambda result: (result[0], _SharedArtefacts(result[1] or {})),
+    )
+
+def _download_with_artefacts(video_url, download_dir, format_code, ledger=None, info_dict=None, progress=None):
+    resolved = select_formats(info_dict, format_code)
+    artefacts = start_artefacts(resolved, download_dir, ledger, progress) if resolved else None
     try:
-        # ---------------------------
-        # 1. 初期設定
-        # ---------------------------
-        format_code = 'a'
-        download_dir = 'dl'  # ダウンロードディレクトリ
-        input_url = 'https://www.youtube.com/watch?v=dROnSxQnrVU'  # 640pが480pでサムネdlされる不具合テストURL 
-        # input_url = 'https://www.youtube.com/watch?v=F9Ay74LfKd4'
+        # 抽出に失敗していた場合は download_video 側で URL から再抽出する
+        info_dict = download_video(video_url, download_dir, format_code, info_dict=info_dict, progress=progress)
+    except BaseException:
+        if artefacts:
+            abort_artefacts(artefacts, download_dir, resolved.get('id'))
+        raise
+    if ledger:
+        ledger.mark_done(info_dict.get('id'), STAGE_DOWNLOADED)
+        ledger.record_download_stats(info_dict.get('_download_stats'))
+        ledger.record_stall_events(info_dict.get('id'), info_dict.get('_stall_events'))
+    if artefacts:
+        wait(artefacts.values())  # ファイルを書き終えてから、別プロセスの同じ動画に順番を渡す
+    return info_dict, artefacts
 
+# 完全な info_dict から SKIP する動画（非公開・メンバー限定・公開前など）なら、理由を表示して True を返します。
+# 列挙時と同じく metadata.sqlite3 の SkippedVideoStore に記録し、猶予期間内は次の同期で再評価しません。
+def _skipped(video_url, info_dict, download_dir):
+    reason = skip_reason(info_dict) if info_dict else None
+    if reason:
+        print(f"【SKIP】URL={video_url} ({reason[0]})")
+        SkippedVideoStore(os.path.join(download_dir, 'metadata.sqlite3')).add(
+            info_dict.get('id'), reason[1], reason[2])
+    return bool(reason)
 
-        # ---------------------------
-        # 2. 動画URLリストの取得
-        # ---------------------------
-        video_urls = extract_video_urls(input_url)
-                
+# フォーマット選択済み（DL前）の info_dict から、メタデータ類の作成を別スレッドで始めます。
+def start_artefacts(info_dict, download_dir, ledger=None, progress=None):
+    video_id = info_dict.get('id')
+    each_video_folder_path = os.path.join(download_dir, video_id)    # download_dir + video_id
+    # yt-dlp がフォルダを作るより先に書き始めるため、ここで作っておく
+    os.makedirs(each_video_folder_path, exist_ok=True)
+    steps = {
+        STAGE_INFO_JSON: lambda: create_info_json(info_dict, each_video_folder_path),
+        STAGE_THUMBNAIL: lambda: download_thumbnail(info_dict, each_video_folder_path),
+        STAGE_TITLE_FILE: lambda: create_title_file(info_dict.get('title', '無題'), each_video_folder_path),
+    }
+    return {stage: _ARTEFACT_EXECUTOR.submit(_prepare_stage, ledger, video_id, stage, step, progress)
+            for stage, step in steps.items()}
 
-        # ---------------------------
-        # 3. 各動画を順次処理
-        # ---------------------------
-        for index, video_url in enumerate(video_urls, start=1):
-            print(f"\n===== 動画 {index} / {len(video_urls)} =====")
-            print(f"URL: {video_url}")
+# メディアのDLに失敗したとき: 並行中の成果物を待ち、今回書いた info.json を消します。
+def abort_artefacts(artefacts, download_dir, video_id):
+    for stage, future in artefacts.items():
+        try:
+            path, done = future.result()
+        except Exception:
+            continue
+        if stage == STAGE_INFO_JSON and path and not done and os.path.isfile(path):
+            os.remove(path)
+
+# DL後の info_dict で索引を更新し、並行して作った成果物の完了を待って記録します。
+# artefacts が None なら従来どおり finalize_video で順に作ります。
+# 相乗りした呼び出し（_SharedArtefacts）はリーダーの成果物のパスを返すだけで、索引も台帳も書きません
+# （リーダーが DL 後に順に作る場合はパスが分からないので None）。
+def finish_artefacts(info_dict, download_dir, ledger=None, artefacts=None, progress=None):
+    if artefacts is None:
+        return finalize_video(info_dict, download_dir, ledger, progress)
+    video_id = info_dict.get('id')
+    shared = isinstance(artefacts, _SharedArtefacts)
+    if not shared:
+        # ライブラリ索引（dl/metadata.sqlite3 の videos テーブル）はメディアが揃ってから反映する
+        upsert_info_sqlite(info_dict, os.path.join(download_dir, 'metadata.sqlite3'))
+    paths = dict.fromkeys((STAGE_INFO_JSON, STAGE_THUMBNAIL, STAGE_TITLE_FILE))
+    for stage, future in artefacts.items():
+        paths[stage], done = future.result()
+        if not done and not shared:
+            _commit_stage(ledger, video_id, stage, paths[stage], progress)
+
+    each_video_folder_path = os.path.join(download_dir, video_id)
+    return {
+        'video_id': video_id,
+        'video_title': info_dict.get('title', '無題'),
+        'info_json_file_path': paths[STAGE_INFO_JSON],
+        'media_file_path': os.path.join(each_video_folder_path, 'media.mp4'),
+        'thumbnail_file_path': paths[STAGE_THUMBNAIL],
+        'title_file_path': paths[STAGE_TITLE_FILE],
+    }
+
+# ダウンロード済みの info_dict から、メタデータ・サムネイル・タイトルファイルを順に作成します。
+def finalize_video(info_dict, download_dir, ledger=None, progress=None):
+    # ---------------------------
+    # 1. 動画IDの取得とフォルダパスの作成
+    # ---------------------------
+    video_id = info_dict.get('id')
+    each_video_folder_path = os.path.join(download_dir, video_id)    # download_dir + video_id
+
+
+    # ---------------------------
+    # 2. メタデータの抽出と保存
+    # ---------------------------
+    info_json_file_path = _run_stage(ledger, video_id, STAGE_INFO_JSON,
+                                     lambda: create_info_json(info_dict, each_video_folder_path), progress)
+    # ライブラリ索引（dl/metadata.sqlite3 の videos テーブル）にも反映。差分同期の既知ID判定に使う
+    upsert_info_sqlite(info_dict, os.path.join(download_dir, 'metadata.sqlite3'))
+
+
+    # ---------------------------
+    # 3. サムネイルのダウンロード
+    # ---------------------------
+    # 一番高解像度のサムネイルを自動選択して保存
+    thumbnail_file_path = _run_stage(ledger, video_id, STAGE_THUMBNAIL,
+                                     lambda: download_thumbnail(info_dict, each_video_folder_path), progress)
+
+
+    # ---------------------------
+    # 4. タイトルファイルの作成
+    # ---------------------------
+    video_title = info_dict.get('title', '無題')
+    title_file_path = _run_stage(ledger, video_id, STAGE_TITLE_FILE,
+                                 lambda: create_title_file(video_title, each_video_folder_path), progress)
+
+    return {
+        'video_id': video_id,
+        'video_title': video_title,
+        'info_json_file_path': info_json_file_path,
+        'media_file_path': os.path.join(each_video_folder_path, 'media.mp4'),
+        'thumbnail_file_path': thumbnail_file_path,
+        'title_file_path': title_file_path,
+    }
+
+# ------------------------------------------------------------------
+# 段ごとに分けたパイプライン: 列挙 → 情報抽出 → メディアDL（‖ メタデータ/サムネ/タイトル）→ 完了待ち
+# stage_workers で段ごとの同時実行数、stage_queue_size で段間キューの上限を指定します。
+# 列挙（source）は専用スレッドで進み、情報抽出も先行するため、
+# 動画 k のDL中に k+1..k+N の抽出が重なって動きます。
+# run() の入力は (video_url, info_dict) で、結果は {'video_url', 'result'}
+# （result は finish_artefacts の戻り値）。抽出段・DL段で SKIP した動画は結果が None。
+# DL・完了待ちの段で失敗した動画は {'video_url', 'failure'} になり、パイプラインは止まりません。
+# ------------------------------------------------------------------
+def build_video_pipeline(download_dir, format_code, stage_workers, stage_queue_size=4, ledger=None,
+                         scheduler=None, priority=BULK, progress=None):
+    def extract(entry):
+        video_url, info_dict = entry
+        # 列挙時に取得済みなら再抽出しない（1 本あたり webpage+player の取得は 1 回）
+        if info_dict is None:
+            info_dict = extract_video_info(video_url)
+            # 一覧の簡易情報では分からなかったメンバー限定などを、ここで完全な情報から判定
+            if _skipped(video_url, info_dict, download_dir):
+                return None
+        return {'video_url': video_url, 'info_dict': info_dict}
+
+    def download_one(job):
+        # メタデータ類はDL中に並行して作り始め、finalize 段で完了を待つ
+        job['info_dict'], job['artefacts'] = download_with_artefacts(
+            job['video_url'], download_dir, format_code, ledger, job['info_dict'], progress)
+        return job if job['info_dict'] is not None else None  # 抽出し直した情報で SKIP
+
+    def download(job):
+        return run_isolated(download_one, job)
+
+    def finalize_one(job):
+        result = finish_artefacts(job['info_dict'], download_dir, ledger, job['artefacts'], progress)
+        return {'video_url': job['video_url'], 'result': result}
+
+    def finalize(job):
+        if job is None or failure_of(job):
+            return job  # DL段で SKIP / 失敗済み
+        return run_isolated(finalize_one, job)
+
+    # 優先度つきの枠は一番重いメディアDL段でだけ使う
+    if scheduler is not None:
+        download = with_slot(download, scheduler, priority)
 
+    return Pipeline([
+        Stage('extract', extract, stage_workers.get('extract', 1), stage_queue_size),
+        Stage('download', download, stage_workers.get('download', 1), stage_queue_size),
+        Stage('finalize', finalize, stage_workers.get('finalize', 1), stage_queue_size),
+    ])
 
-            # ---------------------------
-            # 3.1. 動画のダウンロード
-            # ---------------------------
-            info_dict = download_video(video_url, download_dir, format_code)
+# 処理完了の報告（並列時も入力順に呼ばれる）。列挙中で総数が未確定なら total は None
+def report_video(index, total, video_url, result):
+    print(f"\n===== 動画 {index} / {total} =====" if total else f"\n===== 動画 {index} =====")
+    print(f"URL: {video_url}")
+    print("\nすべての処理が完了しました。")
+    print(f"動画のＩＤ　　　　: {result['video_id']}")
+    print(f"タイトル名　　　　: {result['video_title']}")
+    print(f"メタデータ　　　　: {result['info_json_file_path']}")
+    print(f"動画データ　　　　: {result['media_file_path']}")
+    print(f"サムネ画像　　　　: {result['thumbnail_file_path']}" if result['thumbnail_file_path'] else "サムネイル画像: なし")  # サムネイル画像あるなし三項演算子
+    print(f"タイトルファイル名: {result['title_file_path']}" if result['title_file_path'] else "タイトルファイル: なし") # タイトルファイルあるなし三項演算子
 
+# 1 本の失敗の報告（バッチは止めずに続ける）。queued なら本処理の後で再試行する
+def report_failure(index, video_url, failure, queued):
+    retry = "後で再試行します" if queued else "再試行しません"
+    print(f"\n【FAILED】動画 {index}: URL={video_url}")
+    print(f"  段: {failure['stage']} / 種類: {failure['error_class']} / {retry}")
+    print(f"  {failure['message']}")
 
-            # ---------------------------
-            # 3.2. 動画IDの取得とフォルダパスの作成
-            # ---------------------------
-            video_id = info_dict.get('id')
-            each_video_folder_path = os.path.join(download_dir, video_id)    # download_dir + video_id
+# 列挙されたURLを台帳に記録しながらそのまま流します。最後まで列挙できたら完了を記録。
+def _record_enumeration(ledger, source_url, entries):
+    ledger.begin_enumeration(source_url)
+    for seq, entry in enumerate(entries):
+        ledger.add_enumerated(source_url, seq, entry[0])
+        yield entry
+    ledger.complete_enumeration(source_url)
 
+# ------------------------------------------------------------------
+# ダウンロードの設定（main の初期設定）をこのプロセスの既定に反映します。
+# shard モードの子プロセスは spawn で起動し直すため、同じ設定を子でも反映します（download_settings）。
+# 帯域・接続数の上限（utl9_network_governor）はプロセスごとの値なので、ここでは扱いません。
+# ------------------------------------------------------------------
+def configure_downloads(concurrent_fragments='adaptive', player_clients=None, client_strategy='sequential',
+                        client_deadline=15, stall_sec=20, min_speed=64 * 1024,
+                        staging_dir=None, staging_cap=8 * 1024 ** 3, min_free=1024 ** 3, recover_staging=True):
+    configure_fragments(concurrent_fragments)
+    configure_client_strategy(player_clients, client_strategy, client_deadline)
+    configure_stall_watchdog(stall_sec=stall_sec, min_speed=min_speed)
+    configure_staging(staging_dir, staging_cap, recover=recover_staging)
+    configure_disk_guard(min_free)
 
-            # ---------------------------
-            # 3.3. メタデータの抽出と保存
-            # ---------------------------
-            info_json_file_path = create_info_json(info_dict, each_video_folder_path)
+# shard モードの子プロセスの入口: 親と同じ設定を反映してから作業表を処理し、ステージングの移動を待って抜けます。
+def _run_shard_worker(queue, input_url, job, download_settings):
+    if download_settings:
+        # ステージングの回収は親で済んでいる（子どうしでDL中のメディアを取り合わないように）
+        configure_downloads(**download_settings, recover_staging=False)
+    try:
+        return run_lease_worker(queue, input_url, job)
+    finally:
+        staging = default_staging()
+        if staging is not None:
+            staging.flush()
+
+# pool の process モードの子プロセスの初期化: 親と同じ設定を反映します（spawn では引き継がれないため）。
+def _init_pool_process(download_settings):
+    if download_settings:
+        configure_downloads(**download_settings, recover_staging=False)
+
+# pool の process モードで 1 本を処理し、戻る前にステージングからの移動を待ちます
+# （子の移動スレッドの分は親の flush() では待てず、子が次の動画を待つ間に止まるため）。
+def _run_in_pool_process(func, item):
+    try:
+        return func(item)
+    finally:
+        staging = default_staging()
+        if staging is not None:
+            staging.flush()
+
+# ------------------------------------------------------------------
+# 1 つのジョブを複数のワーカープロセスで分担します（execution_mode='shard'）。
+# 親プロセスが列挙して dl/jobs.sqlite3 の作業表に積み、子プロセスはリースで 1 本ずつ借りて処理する。
+# 子がクラッシュしても、その動画はリース切れ後に他の子が引き取る。報告は親で入力順に行う。
+# 列挙時に取得済みの info_dict は子へ渡さない（子で再抽出する）。
+# download_settings（configure_downloads の引数）は子で反映する。None なら子は既定値で動く。
+# ------------------------------------------------------------------
+def _sync_sharded(input_url, entries, download_dir, format_code, workers, ledger, on_result, cancel_event,
+                  download_settings=None):
+    import multiprocessing
+
+    queue = WorkLeaseQueue(os.path.join(download_dir, 'jobs.sqlite3'))
+    queue.open_source(input_url)
+    job = partial(process_video, download_dir=download_dir, format_code=format_code, ledger=ledger)
+    context = multiprocessing.get_context('spawn')
+    procs = [context.Process(target=_run_shard_worker, args=(queue, input_url, job, download_settings),
+                             name=f"shard-{i}")
+             for i in range(max(1, workers))]
+    for proc in procs:
+        proc.start()
+
+    def all_exited():
+        if cancel_event is not None and cancel_event.is_set():
+            queue.cancel_pending(input_url)
+        return not any(proc.is_alive() for proc in procs)
+
+    try:
+        total = 0
+        for video_url, _ in entries:
+            if queue.add(input_url, total, video_url):
+                total += 1
+        queue.close_source(input_url)
+
+        count = 0
+        for seq, state, video_url, result, error in iter_lease_results(queue, input_url, all_exited):
+            if state == DONE and result is None:
+                continue  # 子で抽出した完全な情報から SKIP（理由は子で表示済み）
+            if state == DONE:
+                count += 1
+                on_result(seq + 1, total, video_url, result)
+            elif state == FAILED:
+                print(f"【FAILED】URL={video_url} ({error})")
+        return count
+    finally:
+        if (cancel_event is not None and cancel_event.is_set()) or any(proc.is_alive() for proc in procs):
+            queue.cancel_pending(input_url)  # 中断時: 子は処理中の動画を終えたら抜ける
+        for proc in procs:
+            proc.join()
+
+# ------------------------------------------------------------------
+# input_url（単一動画/再生リスト/チャンネル）を同期します。main と常駐プロセスの共通処理。
+#
+# Parameters:
+#     on_result (callable): 1 本完了ごとに (index, total, video_url, result) で呼ばれる。既定は report_video。
+#     cancel_event (threading.Event): セットされたら新しい動画の投入をやめる（処理中の動画は最後まで）。
+#     scheduler (PriorityScheduler): 複数ジョブで共有する動画の処理枠。priority（interactive/bulk）の
+#         クラスで 1 本ごとに枠をもらう。スレッドで動くモード（pool の thread / pipeline）でのみ使う。
+#     on_failure (callable): 1 本失敗するごとに (index, video_url, failure, queued) で呼ばれる。既定は report_failure。
+#     progress (ProgressEmitter): このジョブの進捗と段の完了の出力先（省略時は既定の emitter）。
+#         スレッドで動くモード（pool の thread / pipeline）でのみ使う。
+#     download_settings (dict): shard モード・pool の process モードで子プロセスに反映する
+#         configure_downloads の引数（main の初期設定）。
+#
+# 1 本の失敗でバッチは止めません（pool / pipeline）。再試行で直る見込みのある失敗は、本処理の後で
+# 周回ごとに待ち時間を倍にしながら再試行します。HTTP 429/403 が続いた場合は、新しい動画の投入を
+# しばらく止めます（utl6_2_retry_queue のサーキットブレーカー。プロセス内の全ジョブで共有）。
+# shard モードの失敗は作業表に FAILED として残ります。
+# Returns:
+#     int: 処理した動画数
+# ------------------------------------------------------------------
+def sync_videos(input_url, download_dir='dl', format_code='a',
+                execution_mode='pool', workers=1, worker_mode='thread', stage_workers=None,
+                resume=True, incremental=True, stop_after_known=30,
+                on_result=None, cancel_event=None, scheduler=None, priority=BULK, on_failure=None,
+                download_settings=None, progress=None):
+    on_result = on_result or report_video
+    on_failure = on_failure or report_failure
+    stage_workers = stage_workers or {'extract': 4, 'download': 2, 'finalize': 2}
+
+    # ---------------------------
+    # 1. 動画URLの列挙（列挙しながら後段へ流す）
+    # ---------------------------
+    # entries は (video_url, 列挙時に取得済みの info_dict or None)
+    ledger = JobLedger(os.path.join(download_dir, 'jobs.sqlite3')) if resume else None
+    video_urls = ledger.enumerated_urls(input_url) if ledger else None
+    if video_urls is not None:
+        print(f"前回の列挙結果を再利用します: {len(video_urls)} 件")
+        entries = [(video_url, None) for video_url in video_urls]
+        total = len(entries)
+    else:
+        if incremental:
+            db_path = os.path.join(download_dir, 'metadata.sqlite3')
+            entries = iter_video_urls(
+                input_url,
+                known_ids=load_known_video_ids(db_path, download_dir),
+                stop_after_known=stop_after_known,
+                skipped=SkippedVideoStore(db_path),
+                with_info=True,
+            )
+        else:
+            entries = iter_video_urls(input_url, with_info=True)
+        if ledger:
+            entries = _record_enumeration(ledger, input_url, entries)
+        total = None  # 列挙が終わるまで総数は不明
+
+    # 全段完了済みの動画は台帳だけで判定して飛ばす
+    if ledger:
+        entries = (e for e in entries if not ledger.is_complete(video_id_from_url(e[0])))
+    if cancel_event is not None:
+        entries = _until_cancelled(entries, cancel_event)
+    # 429/403 が続いている間は新しい動画を投入しない
+    breaker = default_circuit_breaker()
+    entries = breaker.admit(entries, cancel_event)
+
+
+    # ---------------------------
+    # 2. 各動画を処理（報告は入力順）
+    # ---------------------------
+    count = 0
+    retries = RetryQueue()
+    stall_counts = default_stall_watchdog().counts()  # 常駐プロセスでは前のジョブの分を報告から除く
+    positions = {}  # video_url -> 報告に使う番号（再試行で成功したときも元の番号で報告する）
+
+    def handle(index, video_url, result):
+        nonlocal count
+        positions[video_url] = index
+        if result is None:
+            return  # 抽出した完全な情報から SKIP（理由は表示済み）
+        failure = failure_of(result)
+        breaker.record(failure)
+        if failure:
+            # 再試行では列挙時の情報を使わず、取り直す（URL の期限切れ等に備えて）
+            on_failure(index, video_url, failure, retries.add((video_url, None), failure))
+            return
+        count += 1
+        on_result(index, total, video_url, result)
+
+    if execution_mode == 'shard':
+        count = _sync_sharded(input_url, entries, download_dir, format_code, workers, ledger, on_result, cancel_event,
+                              download_settings)
+    elif execution_mode == 'pipeline':
+        pipeline = build_video_pipeline(download_dir, format_code, stage_workers, ledger=ledger,
+                                        scheduler=scheduler, priority=priority, progress=progress)
+        for seq, packet in pipeline.run(entries, ordered=True):
+            if packet is None:
+                continue  # 抽出段・DL段で SKIP 済み（理由は表示済み）
+            handle(seq + 1, packet['video_url'], packet if failure_of(packet) else packet['result'])
+    else:
+        job = isolated(partial(process_entry, download_dir=download_dir, format_code=format_code, ledger=ledger,
+                               progress=progress if workers <= 1 or worker_mode == 'thread' else None))
+        if scheduler is not None and (workers <= 1 or worker_mode == 'thread'):
+            job = with_slot(job, scheduler, priority)
+        initializer, initargs = None, ()
+        if workers > 1 and worker_mode == 'process':
+            job = partial(_run_in_pool_process, job)
+            initializer, initargs = _init_pool_process, (download_settings,)
+        results = run_ordered(job, entries, workers=workers, mode=worker_mode,
+                              initializer=initializer, initargs=initargs)
+        for index, ((video_url, _), result) in enumerate(results, start=1):
+            handle(index, video_url, result)
+
+
+    # ---------------------------
+    # 3. 失敗した動画の再試行（呼び出し元スレッドで 1 本ずつ）
+    # ---------------------------
+    if len(retries):
+        job = partial(process_entry, download_dir=download_dir, format_code=format_code, ledger=ledger,
+                      progress=progress)
+        if scheduler is not None:
+            job = with_slot(job, scheduler, priority)
+        for (video_url, _), result in retries.replay(job, breaker, cancel_event):
+            if result is None:
+                continue  # SKIP（理由は表示済み）
+            count += 1
+            on_result(positions[video_url], total, video_url, result)
+    for failure in retries.given_up:
+        print(f"【FAILED】URL={failure['video_url']} ({failure['error_class']}, 試行 {failure['attempts']} 回)")
 
+    # ステージングから dl/<id>/ への移動が終わるまで待つ
+    staging = default_staging()
+    if staging is not None:
+        staging.flush()
 
-            # ---------------------------
-            # 3.4. サムネイルのダウンロード
-            # ---------------------------
-            # 一番高解像度のサムネイルを自動選択して保存
-            thumbnail_file_path = download_thumbnail(info_dict, each_video_folder_path)
+    # 断片の同時ダウンロード数と平均スループット（動画ごとの値は jobs.sqlite3 の download_stats）
+    tuning = default_fragment_tuner().summary()
+    if tuning['videos']:
+        speed = f"{tuning['bytes_per_sec'] / 1024 / 1024:.1f} MiB/s" if tuning['bytes_per_sec'] else "不明"
+        print(f"\n断片の同時ダウンロード数: {tuning['concurrent_fragments']}"
+              f"{' (adaptive)' if tuning['adaptive'] else ''} / 平均スループット: {speed}")
 
+    # player_client ごとの成績（次回以降の試す順番に使う）
+    for client, stat in default_client_strategy().stats.snapshot().items():
+        latency = f"{stat['latency']:.1f}s" if stat['latency'] is not None else "-"
+        print(f"player_client={client}: 成功 {stat['ok']} / 失敗 {stat['failed']} / 平均 {latency}")
 
-            # ---------------------------
-            # 3.5. タイトルファイルの作成
-            # ---------------------------
-            video_title = info_dict.get('title', '無題')
-            title_file_path = create_title_file(video_title, each_video_folder_path)
+    # 今回の同期で、転送の停止/絞り込みにより URL を取り直した回数（player_client × フォーマットごと）
+    for (client, format_id, reason), restarts in sorted(default_stall_watchdog().counts(since=stall_counts).items()):
+        print(f"URLの取り直し: player_client={client} format={format_id} "
+              f"{'停止' if reason == 'stalled' else '低速'} {restarts} 回")
 
+    # 最後まで終わったら列挙結果は破棄し、次回は新着を拾うため列挙し直す
+    if ledger and not (cancel_event is not None and cancel_event.is_set()):
+        ledger.forget_enumeration(input_url)
+    return count
 
-            # ---------------------------
-            # 3.6. 処理完了の報告
-            # ---------------------------
-            print("\nすべての処理が完了しました。")
-            print(f"動画のＩＤ　　　　: {video_id}")
-            print(f"タイトル名　　　　: {video_title}")
-            print(f"メタデータ　　　　: {info_json_file_path}")
-            print(f"動画データ　　　　: {os.path.join(each_video_folder_path, 'media.mp4')}")
-            print(f"サムネ画像　　　　: {thumbnail_file_path}" if thumbnail_file_path else "サムネイル画像: なし")  # サムネイル画像あるなし三項演算子
-            print(f"タイトルファイル名: {title_file_path}" if title_file_path else "タイトルファイル: なし") # タイトルファイルあるなし三項演算子
+def _until_cancelled(entries, cancel_event):
+    for entry in entries:
+        if cancel_event.is_set():
+            print("キャンセルされたため、新しい動画の投入を止めます。")
+            return
+        yield entry
+
+# メイン関数: YouTube動画をダウンロードし、メタデータ、サムネイル、タイトルファイルを生成します。
+def main():
+    try:
+        # ---------------------------
+        # 1. 初期設定
+        # ---------------------------
+        format_code = 'a'
+        download_dir = 'dl'  # ダウンロードディレクトリ
+        input_url = 'https://www.youtube.com/watch?v=dROnSxQnrVU'  # 640pが480pでサムネdlされる不具合テストURL
+        # input_url = 'https://www.youtube.com/watch?v=F9Ay74LfKd4'
+        execution_mode = 'pool'  # 'pool'（動画単位で並列）/ 'pipeline'（段ごとに並列）/ 'shard'（複数プロセスで分担）
+        workers = 1          # pool: 同時に処理する動画数（1 なら従来どおり順次処理） / shard: ワーカープロセス数
+        worker_mode = 'thread'  # pool: 'thread' または 'process'
+        stage_workers = {'extract': 4, 'download': 2, 'finalize': 2}  # pipeline: 段ごとの同時実行数
+        resume = True        # 中断と再開: 前回の列挙結果と完了済みの段を dl/jobs.sqlite3 から引き継ぐ
+        incremental = True   # 差分同期: ライブラリにある動画は列挙時点で除外する
+        stop_after_known = 30  # 差分同期: 既知の動画がこの本数連続したら列挙を打ち切る（None で最後まで）
+        bandwidth_limit = None  # 全ワーカー合計の帯域上限（バイト/秒, 例: 5 * 1024 * 1024）。None で無制限
+        host_limits = {}        # ホストごとの同時接続数（例: {'googlevideo.com': 2}）。省略分は既定値
+        concurrent_fragments = 'adaptive'  # DASH/HLS の断片の同時ダウンロード数（整数で固定、'adaptive' で自動調整）
+        player_clients = ['tv', 'web', 'ios', 'android']  # 情報抽出で試す player_client（成績の良い順に並べ替えて使う）
+        client_strategy = 'sequential'  # 'sequential'（順に試す。期限超過で次も並行）/ 'race'（上位を同時に試す）
+        client_deadline = 15            # sequential: この秒数で応答が無ければ次の client も始める
+        stall_sec = 20                  # この秒数 転送が進まなければ URL を取り直して続きから再開
+        min_speed = 64 * 1024           # 直近 30 秒の平均がこれ（バイト/秒）を下回っても同様（None で判定しない。帯域制限中は判定しない）
+        staging_dir = None              # 転送・結合を行う速いディスク（例: '/dev/shm/music-app', 'C:/staging'）。None で dl に直接
+        staging_cap = 8 * 1024 ** 3     # ステージングの使用量の上限（バイト）。超えている間は新しいDLを待たせる
+        min_free = 1024 ** 3            # DL中の動画の見積もりを足しても残す空き容量（バイト）。足りない間は新しいDLを待たせる（None で確認しない）
+
+
+        # ネットワークの上限（スレッドモード/パイプラインの全ワーカーで共有。process / shard モードの子プロセスには効かない）
+        governor = default_governor()
+        governor.set_bandwidth(bandwidth_limit)
+        for host, limit in host_limits.items():
+            governor.set_host_limit(host, limit)
+        # 断片・player_client・転送の見張り・ステージング・空き容量（shard モードでは子プロセスにも同じ設定を渡す）
+        download_settings = {
+            'concurrent_fragments': concurrent_fragments,
+            'player_clients': player_clients,
+            'client_strategy': client_strategy,
+            'client_deadline': client_deadline,
+            'stall_sec': stall_sec,
+            'min_speed': min_speed,
+            'staging_dir': staging_dir,
+            'staging_cap': staging_cap,
+            'min_free': min_free,
+        }
+        configure_downloads(**download_settings)
+
+
+        # ---------------------------
+        # 2. 列挙 → 各動画の処理
+        # ---------------------------
+        sync_videos(
+            input_url, download_dir, format_code,
+            execution_mode=execution_mode, workers=workers, worker_mode=worker_mode,
+            stage_workers=stage_workers, resume=resume, incremental=incremental,
+            stop_after_known=stop_after_known, download_settings=download_settings,
+        )
 
         print("\nすべての動画のダウンロードが完了しました。")
-        
-        
+
+
     except KeyboardInterrupt:
         print("\n ctrl+cで処理が中断されました")
+        print(" (resume=True なら、次回は完了済みの段を飛ばして続きから再開します)")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
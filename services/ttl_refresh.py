@@ -0,0 +1,117 @@
+# ttl_refresh.py
+
+import os
+import sqlite3
+import sys
+from functools import partial
+
+from utl2_video_downloader import extract_video_info
+from utl3_info_sqlite_writer import update_columns_sqlite
+from utl6_worker_pool import run_ordered
+from utl9_network_governor import TokenBucket
+
+# 文字化け防止のため、標準出力と標準エラー出力をUTF-8に設定
+sys.stdout.reconfigure(encoding='utf-8')
+sys.stderr.reconfigure(encoding='utf-8')
+
+# 再取得で更新する列（videos テーブルの列名）と、info_dict 側のキー
+REFRESH_COLUMNS = {
+    'title': 'title',
+    'view_count': 'view_count',
+    'like_count': 'like_count',
+    'dislike_count': 'dislike_count',
+    'age_limit': 'age_limit',
+}
+
+# ------------------------------------------------------------------
+# videos テーブルの video_id を、キー順に page_size 件ずつ読み出します。
+# 一度に全件を持たないので、1 万件規模でもメモリは page_size 分で済みます。
+# ------------------------------------------------------------------
+def iter_library_video_ids(db_path, page_size=500):
+    last_id = ''
+    conn = sqlite3.connect(db_path)
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT video_id FROM videos WHERE video_id > ? ORDER BY video_id LIMIT ?",
+                (last_id, page_size),
+            ).fetchall()
+            if not rows:
+                return
+            for (video_id,) in rows:
+                yield video_id
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+# ------------------------------------------------------------------
+# 1 本分のメタデータを再取得し、更新対象の列だけを返します（ダウンロードはしない）。
+# info_dict 全体は返さず捨てるので、並列数ぶんしかメモリに残りません。
+# 取得できなかった場合は None。
+# ------------------------------------------------------------------
+def fetch_refresh_columns(video_id, limiter=None):
+    if limiter:
+        limiter.acquire()
+    info_dict = extract_video_info(f"https://www.youtube.com/watch?v={video_id}")
+    if not info_dict:
+        return None
+    row = {'video_id': video_id}
+    for column, key in REFRESH_COLUMNS.items():
+        # 取れなかった値（近年の dislike_count など）で既存の値を潰さない
+        if info_dict.get(key) is not None:
+            row[column] = info_dict[key]
+    return row
+
+# メイン関数: ライブラリ全体の再生数・高評価数などをメディアを再DLせずに更新します。
+def main():
+    try:
+        # ---------------------------
+        # 1. 初期設定
+        # ---------------------------
+        download_dir = 'dl'  # ダウンロードディレクトリ
+        db_path = os.path.join(download_dir, 'metadata.sqlite3')
+        workers = 8             # 同時に再取得する動画数
+        requests_per_sec = 2.0  # 再取得の開始ペース（1 秒あたり）。None で無制限
+        batch_size = 200        # この件数ごとに DB へまとめて書き込む
+
+        if not os.path.isfile(db_path):
+            print(f"ライブラリが見つかりません: {db_path}")
+            sys.exit(1)
+
+
+        # ---------------------------
+        # 2. 並列で再取得しながら、バッチ単位で更新
+        # ---------------------------
+        limiter = TokenBucket(requests_per_sec, burst=workers)
+        job = partial(fetch_refresh_columns, limiter=limiter)
+        checked, failed, changed = 0, 0, 0
+        batch = []
+        for video_id, row in run_ordered(job, iter_library_video_ids(db_path), workers=workers):
+            checked += 1
+            if row is None:
+                failed += 1
+                print(f"【SKIP】ID={video_id} (情報を取得できませんでした)")
+            else:
+                batch.append(row)
+            if len(batch) >= batch_size:
+                changed += update_columns_sqlite(batch, db_path)
+                batch.clear()
+                print(f"確認 {checked} 件 / 更新 {changed} 件 / 失敗 {failed} 件")
+        changed += update_columns_sqlite(batch, db_path)
+
+
+        # ---------------------------
+        # 3. 完了報告
+        # ---------------------------
+        print("\nメタデータの再取得が完了しました。")
+        print(f"確認した動画: {checked} 件")
+        print(f"更新した動画: {changed} 件")
+        print(f"取得できなかった動画: {failed} 件")
+
+
+    except KeyboardInterrupt:
+        print("\n ctrl+cで処理が中断されました")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# ttl_remote_worker.py
+#
+# ttl_coordinator.py から動画をまとめて借りてダウンロードするワーカー。
+# 自分の download_dir（dl/<video_id>/...）に保存し、メタデータをコーディネーターへ返します。
+# 借りている間は定期的にハートビートを送り、落ちた場合はリース切れ後に他のワーカーへ回ります。
+#
+#   python ttl_remote_worker.py --coordinator 192.168.0.10:8765 --download-dir dl
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+from ttl_merge import finalize_video
+from utl2_video_downloader import download_video
+from utl2_8_download_failures import classify_failure
+from utl8_2_remote_queue import DEFAULT_HOST, DEFAULT_PORT, CoordinatorClient
+
+# 文字化け防止のため、標準出力と標準エラー出力をUTF-8に設定
+sys.stdout.reconfigure(encoding='utf-8')
+sys.stderr.reconfigure(encoding='utf-8')
+
+# 貸し出しが空だったときの待ち間隔（秒）
+IDLE_POLL_SEC = 2.0
+# コーディネーターに繋がらないとき、諦めるまでの再試行回数
+MAX_CONNECT_RETRIES = 5
+
+def _sanitize(info_dict):
+    import yt_dlp  # 重い依存なので使う時に読み込む（起動時間対策）
+
+    # JSON で送れる形に（関数やファイルオブジェクト、内部用のキーを落とす）
+    info = yt_dlp.YoutubeDL.sanitize_info(info_dict, remove_private_keys=True)
+    # requested_formats は内部用として落とされるが、コーディネーター側の索引（実際の画質・解像度）に要る
+    if info_dict.get("requested_formats"):
+        info["requested_formats"] = yt_dlp.YoutubeDL.sanitize_info(
+            {"requested_formats": info_dict["requested_formats"]})["requested_formats"]
+    return info
+
+def _heartbeat(client, worker_id, interval, stop):
+    while not stop.wait(interval):
+        try:
+            client.call("heartbeat", worker_id=worker_id)
+        except OSError:
+            pass  # 次の回で繋ぎ直す。繋がらないままならリースが切れて他へ回るだけ
+
+# 1 本分: ダウンロード → 手元のメタデータ類 → コーディネーターへ報告
+def _process(client, worker_id, video, download_dir, format_code):
+    try:
+        info_dict = download_video(video["video_url"], download_dir, format_code)
+        result = finalize_video(info_dict, download_dir)
+    except Exception as e:
+        failure = classify_failure(e, video["video_url"])
+        client.call("fail", worker_id=worker_id, video_id=video["video_id"],
+                    error=f"[{failure.stage}/{failure.error_class}] {failure}")
+        return False
+    response = client.call("complete", worker_id=worker_id, video_id=video["video_id"],
+                           info=_sanitize(info_dict), result=result)
+    if not response["accepted"]:
+        print(f"リースが切れていたため、この動画は他のワーカーの結果が使われます: ID={video['video_id']}")
+    return response["accepted"]
+
+# メイン関数: コーディネーターの待ち行列が空になるまで、借りてはダウンロードを繰り返します。
+def main():
+    parser = argparse.ArgumentParser(description="コーディネーターから動画を借りてダウンロードするワーカー")
+    parser.add_argument("--coordinator", default=f"{DEFAULT_HOST}:{DEFAULT_PORT}", help="host:port")
+    parser.add_argument("--download-dir", default="dl")
+    parser.add_argument("--format-code", default="a")
+    parser.add_argument("--batch", type=int, default=4, help="1 回に借りる動画数")
+    args = parser.parse_args()
+
+    try:
+        # ---------------------------
+        # 1. 初期設定
+        # ---------------------------
+        host, port = args.coordinator.rsplit(":", 1)
+        client = CoordinatorClient(host, int(port))
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        stop = threading.Event()
+        done, failed, retries = 0, 0, 0
+
+
+        # ---------------------------
+        # 2. 借りる → 処理、を作業が尽きるまで
+        # ---------------------------
+        beater = None
+        while True:
+            try:
+                claimed = client.call("claim", worker_id=worker_id, limit=args.batch)
+                retries = 0
+            except OSError as e:
+                retries += 1
+                if retries > MAX_CONNECT_RETRIES:
+                    print(f"コーディネーターに繋がらないため終了します: {e}")
+                    break
+                time.sleep(IDLE_POLL_SEC * retries)
+                continue
+            if beater is None:
+                beater = threading.Thread(target=_heartbeat, name="heartbeat", daemon=True,
+                                          args=(client, worker_id, claimed["lease_sec"] / 3, stop))
+                beater.start()
+            if claimed["finished"]:
+                break
+            if not claimed["videos"]:
+                time.sleep(IDLE_POLL_SEC)  # 列挙待ち、または他のワーカーのリース切れ待ち
+                continue
+            for video in claimed["videos"]:
+                try:
+                    ok = _process(client, worker_id, video, args.download_dir, args.format_code)
+                except OSError as e:
+                    # 報告できなかった動画はリース切れ後にやり直される
+                    print(f"コーディネーターへの報告に失敗しました: ID={video['video_id']} ({e})")
+                    ok = False
+                if ok:
+                    done += 1
+                else:
+                    failed += 1
+        stop.set()
+        client.close()
+
+
+        # ---------------------------
+        # 3. 完了報告
+        # ---------------------------
+        print(f"\nワーカー {worker_id} を終了します。完了: {done} 件 / 失敗・取り消し: {failed} 件")
+
+
+    except KeyboardInterrupt:
+        print("\n ctrl+cで処理が中断されました（借りていた動画はリース切れ後に他のワーカーへ回ります）")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
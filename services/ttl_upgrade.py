@@ -0,0 +1,235 @@
+# ttl_upgrade.py
+#
+# 後から高画質（1440p/2160p など）が追加された動画だけを取り直します。
+# 候補（最近の投稿、または実際の画質がプリセットの上限より低いもの）のフォーマット一覧を取り直し、
+# プリセットで今選ぶと手元より真に良くなる動画だけをダウンロードし直します（全件の再同期はしない）。
+
+import glob
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from functools import partial
+
+from ttl_merge import process_video
+from utl2_1_format_map import FORMAT_MAP, PRESET_HEIGHTS
+from utl2_video_downloader import extract_video_info, select_formats
+from utl6_worker_pool import run_ordered
+from utl6_2_retry_queue import failure_of, run_isolated
+from utl9_network_governor import TokenBucket
+
+# 文字化け防止のため、標準出力と標準エラー出力をUTF-8に設定
+sys.stdout.reconfigure(encoding='utf-8')
+sys.stderr.reconfigure(encoding='utf-8')
+
+# '1080p' → 1080 / '128kbps' → 128.0。'不明' などは None
+def _parse_quality(text, suffix):
+    if not text or not str(text).endswith(suffix):
+        return None
+    try:
+        return float(str(text)[:-len(suffix)])
+    except ValueError:
+        return None
+
+# 比べる値: 映像のプリセットは高さ、音声のみ（'a'）はビットレート
+def _quality_of(format_code, video_quality, audio_quality):
+    if format_code in PRESET_HEIGHTS:
+        return _parse_quality(video_quality, 'p')
+    return _parse_quality(audio_quality, 'kbps')
+
+# フォーマット選択済みの info から、実際に落とすことになる映像/音声の画質を '1080p' / '128kbps' で返します。
+def _selected_quality(resolved):
+    # 映像+音声を結合する場合は requested_formats、一体型（progressive）なら info 自身
+    requested = resolved.get('requested_formats') or [resolved]
+    video = next((f for f in requested if f.get('vcodec') != 'none' and f.get('height')), None)
+    audio = next((f for f in requested if f.get('acodec') != 'none' and f.get('abr')), None)
+    return (f"{video['height']}p" if video else '不明', f"{audio['abr']}kbps" if audio else '不明')
+
+# ------------------------------------------------------------------
+# 取り直しの候補を videos テーブルからキー順に page_size 件ずつ読み出します。
+# 候補: upload_date が recent_days 日以内、または実際の画質がプリセットの上限より低い動画。
+# Yields:
+#     dict: video_id, video_url, actual_video_quality, actual_audio_quality
+# ------------------------------------------------------------------
+def iter_upgrade_candidates(db_path, format_code, recent_days=7, page_size=500):
+    cutoff = (datetime.now() - timedelta(days=recent_days)).strftime('%Y%m%d') if recent_days else None
+    cap = PRESET_HEIGHTS.get(format_code)
+    last_id = ''
+    conn = sqlite3.connect(db_path)
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT video_id, target_url, upload_date, actual_video_quality, actual_audio_quality"
+                " FROM videos WHERE video_id > ? ORDER BY video_id LIMIT ?",
+                (last_id, page_size),
+            ).fetchall()
+            if not rows:
+                return
+            for video_id, target_url, upload_date, actual_v, actual_a in rows:
+                recent = cutoff is not None and (upload_date or '') >= cutoff and upload_date != '不明'
+                height = _parse_quality(actual_v, 'p')
+                below_cap = cap is not None and height is not None and height < cap
+                if recent or below_cap:
+                    yield {
+                        'video_id': video_id,
+                        'video_url': target_url if target_url and target_url != '不明'
+                                     else f"https://www.youtube.com/watch?v={video_id}",
+                        'actual_video_quality': actual_v,
+                        'actual_audio_quality': actual_a,
+                    }
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+# ------------------------------------------------------------------
+# 1 本分のフォーマット一覧を取り直し、プリセットで今選ぶと手元より良くなるかを判定します（DLはしない）。
+# Returns:
+#     dict: 良くなる場合は {'video_url', 'info_dict', 'current', 'available'}（info_dict はそのままDLに使う）
+#     None: 良くならない/手元にメディアが無い/取得できなかった場合
+# ------------------------------------------------------------------
+def check_upgrade(candidate, download_dir, format_code, limiter=None):
+    if not _media_files(download_dir, candidate['video_id']):
+        return None  # 手元に無い動画は通常の同期に任せる
+    if limiter:
+        limiter.acquire()
+    info_dict = extract_video_info(candidate['video_url'])
+    resolved = select_formats(info_dict, format_code)
+    if not resolved:
+        return None
+    new_v, new_a = _selected_quality(resolved)
+    current = _quality_of(format_code, candidate['actual_video_quality'], candidate['actual_audio_quality'])
+    available = _quality_of(format_code, new_v, new_a)
+    # 手元の画質が分からない行は比べられないので取り直さない（毎回取り直すのを避ける）
+    if available is None or current is None or available <= current:
+        return None
+    return {
+        'video_url': candidate['video_url'],
+        'info_dict': info_dict,
+        'current': candidate['actual_video_quality'] if format_code in PRESET_HEIGHTS else candidate['actual_audio_quality'],
+        'available': new_v if format_code in PRESET_HEIGHTS else new_a,
+    }
+
+def _media_files(download_dir, video_id):
+    return [path for path in glob.glob(os.path.join(download_dir, video_id, 'media.*'))
+            if not path.endswith(_TEMP_SUFFIXES)]
+
+# 作業中のファイル（DLの途中・退避したもの）
+_TEMP_SUFFIXES = ('.part', '.ytdl', '.prev')
+
+# dl/<id>/ の完成したファイル（メディア・info.json・サムネイル・タイトルファイル）
+def _library_files(folder):
+    return [path for path in glob.glob(os.path.join(folder, '*'))
+            if os.path.isfile(path) and not path.endswith(_TEMP_SUFFIXES)]
+
+# ------------------------------------------------------------------
+# 手元のファイル一式（メディア・info.json・サムネイル・タイトルファイル）を退避してから取り直します
+# （同じ名前のメディアがあると yt-dlp が DL を飛ばし、メタデータ類は DL 中に新しい内容で書き始めるため）。
+# 成功したら退避したファイルを消し、失敗したら今回書いたファイルを消して元に戻します。
+# メタデータ・サムネイル・タイトルファイル・索引（metadata.sqlite3）も新しい情報で作り直されます。
+# ------------------------------------------------------------------
+def upgrade_video(upgrade, download_dir, format_code):
+    video_id = upgrade['info_dict'].get('id')
+    folder = os.path.join(download_dir, video_id)
+    moved = []
+    for path in _library_files(folder):
+        os.replace(path, path + '.prev')
+        moved.append(path)
+    try:
+        result = process_video(upgrade['video_url'], download_dir, format_code, info_dict=upgrade['info_dict'])
+    except BaseException:
+        for path in _library_files(folder):
+            os.remove(path)  # 今回書いた途中の成果物（新しいタイトルファイル等）
+        for path in moved:
+            os.replace(path + '.prev', path)
+        raise
+    for path in moved:
+        if os.path.exists(path + '.prev'):
+            os.remove(path + '.prev')
+    return result
+
+# ------------------------------------------------------------------
+# 1 本分: 判定し、良くなるならその場で取り直します（フォーマット一覧の URL が新しいうちに DL するため）。
+# 同時に取り直す本数は download_slots（Semaphore）で抑えます。info_dict は戻り値に残しません。
+# Returns:
+#     dict: 良くなる場合は {'video_url', 'current', 'available', 'result'}
+#           （result は取り直した結果。dry_run なら None、失敗なら {'video_url', 'failure'}）
+#     None: 良くならない場合
+# ------------------------------------------------------------------
+def check_and_upgrade(candidate, download_dir, format_code, limiter=None, download_slots=None, dry_run=False):
+    upgrade = check_upgrade(candidate, download_dir, format_code, limiter)
+    if upgrade is None:
+        return None
+    print(f"【UPGRADE】ID={candidate['video_id']} ({upgrade['current']} → {upgrade['available']})")
+    result = None
+    if not dry_run:
+        job = partial(upgrade_video, download_dir=download_dir, format_code=format_code)
+        with download_slots or nullcontext():
+            result = run_isolated(job, upgrade)
+    return {'video_url': upgrade['video_url'], 'current': upgrade['current'], 'available': upgrade['available'],
+            'result': result}
+
+# メイン関数: 後から高画質が追加された動画を探し、その動画だけを取り直します。
+def main():
+    try:
+        # ---------------------------
+        # 1. 初期設定
+        # ---------------------------
+        format_code = 'd'       # ライブラリの取得に使ったプリセット（FORMAT_MAP のキー）
+        download_dir = 'dl'     # ダウンロードディレクトリ
+        db_path = os.path.join(download_dir, 'metadata.sqlite3')
+        recent_days = 7         # この日数以内の投稿は、上限に達していても候補にする（None で上限未満だけ）
+        workers = 4             # 同時にフォーマット一覧を取り直す動画数
+        requests_per_sec = 2.0  # 取り直しの開始ペース（1 秒あたり）。None で無制限
+        download_workers = 1    # 同時に取り直すダウンロード数（判定と並行して、見つかった動画から取り直す）
+        dry_run = False         # True なら判定結果を表示するだけでダウンロードしない
+
+        if not os.path.isfile(db_path):
+            print(f"ライブラリが見つかりません: {db_path}")
+            sys.exit(1)
+        if format_code not in FORMAT_MAP:
+            print(f"無効なフォーマットコードです: {format_code}")
+            sys.exit(1)
+
+
+        # ---------------------------
+        # 2. 候補のフォーマット一覧を取り直して判定し、良くなる動画はその場で取り直す
+        # ---------------------------
+        limiter = TokenBucket(requests_per_sec, burst=workers)
+        download_slots = threading.BoundedSemaphore(max(1, download_workers))
+        job = partial(check_and_upgrade, download_dir=download_dir, format_code=format_code, limiter=limiter,
+                      download_slots=download_slots, dry_run=dry_run)
+        checked, found, done, failed = 0, 0, 0, 0
+        candidates = iter_upgrade_candidates(db_path, format_code, recent_days)
+        for candidate, upgrade in run_ordered(job, candidates, workers=workers):
+            checked += 1
+            if not upgrade:
+                continue
+            found += 1
+            if dry_run:
+                continue
+            failure = failure_of(upgrade['result'])
+            if failure:
+                failed += 1
+                print(f"【FAILED】URL={upgrade['video_url']} ({failure['error_class']}: {failure['message']})")
+            else:
+                done += 1
+                print(f"取り直し完了: {upgrade['result']['video_id']} ({upgrade['current']} → {upgrade['available']})")
+
+
+        # ---------------------------
+        # 3. 完了報告
+        # ---------------------------
+        print(f"\n確認した動画: {checked} 件 / 取り直す動画: {found} 件")
+        print("画質の取り直しが完了しました。")
+        print(f"取り直した動画: {done} 件")
+        print(f"失敗した動画: {failed} 件")
+
+
+    except KeyboardInterrupt:
+        print("\n ctrl+cで処理が中断されました")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# ttl_worker_daemon.py
+#
+# Electron のメインプロセスから 1 度だけ起動して常駐させる Python ワーカー。
+# stdin/stdout で 1 行 1 メッセージの JSON-RPC 2.0 を話します。
+#
+#   → {"jsonrpc":"2.0","id":1,"method":"submit","params":{"url":"https://www.youtube.com/@xxx","priority":"bulk"}}
+#   ← {"jsonrpc":"2.0","id":1,"result":{"job_id":"job-1"}}
+#   ← {"jsonrpc":"2.0","method":"job","params":{"job_id":"job-1","status":"running",...}}      (通知)
+#   ← {"jsonrpc":"2.0","method":"progress","params":{"job_id":"job-1","video_id":"...","stage":"download",...}} (通知)
+#   ← {"jsonrpc":"2.0","method":"video_failed","params":{"job_id":"job-1","failure":{"error_class":"http_429",...},"will_retry":true}} (通知)
+#
+# メソッド: ping / submit / cancel / status / query / network / scheduler / shutdown
+#
+# 動画の処理枠は全ジョブで共有し、interactive（単一動画。UI で貼られた URL）のジョブは
+# 実行中の bulk（チャンネル/再生リスト）の次の 1 本より先に枠をもらう。priority 省略時は URL から判定。
+# stdout は JSON-RPC 専用。ライブラリ側の print は stderr へ流します。
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# JSON-RPC の出力先を確保してから、以降の print（utl 各モジュール/yt-dlp）を stderr へ向ける
+_RPC_OUT = sys.stdout
+_RPC_OUT.reconfigure(encoding='utf-8')
+sys.stdout = sys.stderr
+
+import yt_dlp  # noqa: E402  常駐中は import 済みのまま使い回す
+
+from ttl_merge import sync_videos  # noqa: E402
+from utl2_3_progress_emitter import ProgressEmitter, set_default_emitter  # noqa: E402
+from utl6_1_priority_scheduler import BULK, INTERACTIVE, PRIORITIES, PriorityScheduler  # noqa: E402
+from utl8_job_ledger import video_id_from_url  # noqa: E402
+from utl9_network_governor import default_governor  # noqa: E402
+
+# JSON-RPC のエラーコード
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# 同時に走らせるジョブ数の上限（列挙などを並行させる数。実際の DL 数は VIDEO_SLOTS で絞る）
+MAX_CONCURRENT_JOBS = 8
+# 全ジョブで共有する、同時に処理する動画数
+VIDEO_SLOTS = 2
+
+# 問い合わせで返す videos テーブルの列
+QUERY_COLUMNS = (
+    "video_id", "title", "channel", "channel_id", "upload_date", "duration",
+    "view_count", "like_count", "actual_video_quality", "actual_audio_quality", "updated_at",
+)
+
+_write_lock = threading.Lock()
+
+def _send(message):
+    line = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+    with _write_lock:
+        _RPC_OUT.write(line + "\n")
+        _RPC_OUT.flush()
+
+def _notify(method, params):
+    _send({"jsonrpc": "2.0", "method": method, "params": params})
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class _RpcProgressEmitter(ProgressEmitter):
+    """
+    進捗を progress 通知（job_id 付き）として送り、キャンセルされたジョブの転送はフックから打ち切る。
+    ジョブごとに作って sync_videos の progress に渡す（job=None は既定の emitter 用）。
+    yt-dlp は断片を別スレッドで落とし、フックもそのスレッドから呼ぶため、ジョブは呼ばれたスレッドではなく
+    この emitter から引く。
+    """
+
+    def __init__(self, job=None):
+        super().__init__(stream=None)
+        self.job = job
+
+    def _write(self, event):
+        if self.job is not None:
+            event = dict(event, job_id=self.job.job_id)
+        _notify("progress", event)
+
+    def progress_hook(self, d):
+        if self.job is not None and self.job.cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled(f"job {self.job.job_id} がキャンセルされました")
+        super().progress_hook(d)
+
+class _Job:
+    def __init__(self, job_id, params):
+        self.job_id = job_id
+        self.url = params["url"]
+        self.format_code = params.get("format_code", "a")
+        self.download_dir = params.get("download_dir", "dl")
+        self.priority = params["priority"]
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done_videos = 0
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id, "url": self.url, "format_code": self.format_code,
+            "download_dir": self.download_dir, "priority": self.priority, "status": self.status,
+            "submitted_at": self.submitted_at, "started_at": self.started_at,
+            "finished_at": self.finished_at, "done_videos": self.done_videos, "error": self.error,
+        }
+
+class WorkerDaemon:
+    def __init__(self, max_jobs=MAX_CONCURRENT_JOBS):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="job")
+        self._scheduler = PriorityScheduler(capacity=VIDEO_SLOTS)
+        self._db = {}  # download_dir -> 常駐の sqlite 接続（query 用）
+        self._running = True
+        set_default_emitter(_RpcProgressEmitter())
+
+    # ---- ジョブ ----------------------------------------------------------
+    def _set_status(self, job, status, **fields):
+        job.status = status
+        for key, value in fields.items():
+            setattr(job, key, value)
+        _notify("job", job.to_dict())
+
+    def _run_job(self, job):
+        if job.cancel_event.is_set():
+            self._set_status(job, "cancelled", finished_at=time.time())
+            return
+        self._set_status(job, "running", started_at=time.time())
+
+        def on_result(index, total, video_url, result):
+            job.done_videos += 1
+            _notify("video", {"job_id": job.job_id, "index": index, "total": total,
+                              "video_url": video_url, "result": result})
+
+        def on_failure(index, video_url, failure, queued):
+            _notify("video_failed", {"job_id": job.job_id, "index": index, "video_url": video_url,
+                                     "failure": failure, "will_retry": queued})
+
+        try:
+            sync_videos(job.url, job.download_dir, job.format_code,
+                        on_result=on_result, on_failure=on_failure, cancel_event=job.cancel_event,
+                        scheduler=self._scheduler, priority=job.priority, progress=_RpcProgressEmitter(job))
+            status = "cancelled" if job.cancel_event.is_set() else "done"
+            self._set_status(job, status, finished_at=time.time())
+        except yt_dlp.utils.DownloadCancelled:
+            self._set_status(job, "cancelled", finished_at=time.time())
+        except BaseException as e:  # 列挙の失敗など、動画単位に閉じない失敗はジョブの失敗として扱う
+            self._set_status(job, "failed", finished_at=time.time(), error=f"{type(e).__name__}: {e}")
+
+    def submit(self, url=None, format_code="a", download_dir="dl", priority=None):
+        if not url:
+            raise RpcError(INVALID_PARAMS, "url は必須です")
+        if priority is None:
+            priority = INTERACTIVE if video_id_from_url(url) else BULK
+        if priority not in PRIORITIES:
+            raise RpcError(INVALID_PARAMS, f"priority は {' / '.join(PRIORITIES)} のいずれかです")
+        with self._lock:
+            self._seq += 1
+            job = _Job(f"job-{self._seq}", {"url": url, "format_code": format_code,
+                                            "download_dir": download_dir, "priority": priority})
+            self._jobs[job.job_id] = job
+        _notify("job", job.to_dict())
+        self._executor.submit(self._run_job, job)
+        return {"job_id": job.job_id}
+
+    def cancel(self, job_id=None):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise RpcError(INVALID_PARAMS, f"job が見つかりません: {job_id}")
+        if job.status in ("done", "failed", "cancelled"):
+            return {"cancelled": False, "status": job.status}
+        job.cancel_event.set()
+        return {"cancelled": True, "status": job.status}
+
+    def status(self, job_id=None):
+        if job_id is None:
+            return [job.to_dict() for job in self._jobs.values()]
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise RpcError(INVALID_PARAMS, f"job が見つかりません: {job_id}")
+        return job.to_dict()
+
+    # ---- ライブラリ問い合わせ ----------------------------------------------
+    def _conn(self, download_dir):
+        conn = self._db.get(download_dir)
+        if conn is None:
+            db_path = os.path.join(download_dir, "metadata.sqlite3")
+            if not os.path.isfile(db_path):
+                return None
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._db[download_dir] = conn
+        return conn
+
+    def query(self, video_id=None, channel_id=None, title=None, limit=50, offset=0, download_dir="dl"):
+        conn = self._conn(download_dir)
+        if conn is None:
+            return []
+        where, args = [], []
+        if video_id:
+            where.append("video_id = ?")
+            args.append(video_id)
+        if channel_id:
+            where.append("channel_id = ?")
+            args.append(channel_id)
+        if title:
+            where.append("title LIKE ?")
+            args.append(f"%{title}%")
+        sql = f"SELECT {', '.join(QUERY_COLUMNS)} FROM videos"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY upload_date DESC LIMIT ? OFFSET ?"
+        args += [int(limit), int(offset)]
+        return [dict(row) for row in conn.execute(sql, args)]
+
+    # ---- ネットワーク ---------------------------------------------------
+    def network(self, bandwidth=False, hosts=None):
+        """
+        帯域（バイト/秒, null で無制限）とホストごとの同時接続数を実行中のジョブごと変更する。
+        引数なしなら現在の設定と使用中の接続数を返すだけ。
+        """
+        governor = default_governor()
+        if bandwidth is not False:
+            governor.set_bandwidth(bandwidth)
+        for host, limit in (hosts or {}).items():
+            governor.set_host_limit(host, limit)
+        return governor.limits()
+
+    def scheduler(self, capacity=None, bulk_reserved=None, interactive_burst=None):
+        """動画の処理枠の設定を変更する（引数なしなら現在の状態を返すだけ）。"""
+        self._scheduler.configure(capacity, bulk_reserved, interactive_burst)
+        return self._scheduler.stats()
+
+    def ping(self):
+        return "pong"
+
+    def shutdown(self):
+        self._running = False
+        for job in self._jobs.values():
+            job.cancel_event.set()
+        return {"shutting_down": True}
+
+    # ---- 受信ループ -----------------------------------------------------
+    def _dispatch(self, request):
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or "method" not in request:
+            raise RpcError(INVALID_REQUEST, "JSON-RPC 2.0 のリクエストではありません")
+        method = request["method"]
+        if method.startswith("_") or method not in ("ping", "submit", "cancel", "status", "query", "network", "scheduler", "shutdown"):
+            raise RpcError(METHOD_NOT_FOUND, f"未知のメソッドです: {method}")
+        params = request.get("params") or {}
+        try:
+            if isinstance(params, list):
+                return getattr(self, method)(*params)
+            return getattr(self, method)(**params)
+        except TypeError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+    def serve(self, stream=sys.stdin):
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id") if isinstance(request, dict) else None
+                result = self._dispatch(request)
+                if request_id is not None:
+                    _send({"jsonrpc": "2.0", "id": request_id, "result": result})
+            except json.JSONDecodeError as e:
+                _send({"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": str(e)}})
+            except RpcError as e:
+                _send({"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}})
+            except Exception as e:
+                _send({"jsonrpc": "2.0", "id": request_id,
+                       "error": {"code": INTERNAL_ERROR, "message": f"{type(e).__name__}: {e}"}})
+            if not self._running:
+                break
+        # stdin が閉じられた（親プロセス終了）か shutdown: 実行中の動画を区切りまで進めて終わる
+        for job in self._jobs.values():
+            job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+# メイン関数: 常駐して JSON-RPC リクエストを処理します。
+def main():
+    sys.stdin.reconfigure(encoding='utf-8')
+    WorkerDaemon().serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# utl1_1_known_video_ids.py
+import os
+import sqlite3
+import time
+from typing import Optional, Set
+
+from utl2_9_staging import finished_media
+from utl3_info_sqlite_writer import DEFAULT_DB_PATH
+
+# SKIP した動画を再評価するまでの猶予（秒）
+# private / メンバー限定はほぼ変わらないので長め、公開予定は公開時刻を過ぎたら再評価
+SKIP_RECHECK_SEC = {
+    "private": 30 * 24 * 3600,
+    "needs_auth": 30 * 24 * 3600,
+    "subscriber_only": 30 * 24 * 3600,
+    "premium_only": 30 * 24 * 3600,
+    "scheduled": 24 * 3600,
+}
+DEFAULT_SKIP_RECHECK_SEC = 24 * 3600
+
+def load_known_video_ids(db_path: str = DEFAULT_DB_PATH, download_dir: Optional[str] = "dl") -> Set[str]:
+    """
+    ライブラリに既にある video_id の集合を返す。
+      1) videos テーブル（db_path が無ければ飛ばす）
+      2) download_dir/<video_id>/ に info.json と完成したメディア（media.*）の両方があるフォルダ
+         （info.json はメディアのDL中に先に書くため、落ちた/止めたときに info.json だけ残ることがある）
+    """
+    known: Set[str] = set()
+    if db_path and os.path.isfile(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            known.update(row[0] for row in conn.execute("SELECT video_id FROM videos"))
+        except sqlite3.OperationalError:
+            pass  # videos テーブル未作成
+        finally:
+            conn.close()
+
+    if download_dir and os.path.isdir(download_dir):
+        with os.scandir(download_dir) as it:
+            for entry in it:
+                if (entry.is_dir() and os.path.isfile(os.path.join(entry.path, "info.json"))
+                        and finished_media(entry.path)):
+                    known.add(entry.name)
+    return known
+
+class SkippedVideoStore:
+    """
+    private / メンバー限定 / 公開予定 で SKIP した video_id を metadata.sqlite3 に記録し、
+    猶予期間内は再評価しないための集合。
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS skipped_videos (
+                video_id      TEXT PRIMARY KEY,
+                reason        TEXT,
+                recheck_after REAL,
+                updated_at    TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now'))
+            );
+            """)
+            conn.commit()
+            now = time.time()
+            self._active: Set[str] = {
+                row[0] for row in conn.execute(
+                    "SELECT video_id FROM skipped_videos WHERE recheck_after > ?", (now,))
+            }
+        finally:
+            conn.close()
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self._active
+
+    def add(self, video_id: Optional[str], reason: str, recheck_at: Optional[float] = None) -> None:
+        if not video_id:
+            return
+        if recheck_at is None:
+            recheck_at = time.time() + SKIP_RECHECK_SEC.get(reason, DEFAULT_SKIP_RECHECK_SEC)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("""
+                INSERT INTO skipped_videos (video_id, reason, recheck_after) VALUES (?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET reason=excluded.reason,
+                    recheck_after=excluded.recheck_after,
+                    updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            """, (video_id, reason, recheck_at))
+            conn.commit()
+        finally:
+            conn.close()
+        self._active.add(video_id)
@@ -3,7 +3,8 @@
 import os
 import time
 from pathlib import Path
-import yt_dlp
+from utl2_2_ydl_pool import checkout_ydl
+from utl2_6_player_clients import default_client_strategy
 
 # ---- ffmpeg のローカル検出（共通ユーティリティ） -------------------------
 REQUIRE_LOCAL_FFMPEG = False  # ← True にすると「ローカルが無い場合は即エラー」
@@ -34,90 +35,129 @@ def apply_ffmpeg_location_to_env(ffmpeg_dir: str | None):
     # Windows なら PATH 前置（他OSでも悪さはしない）
     os.environ["PATH"] = ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
 
+# ----------------------------------------------------
+# SKIP 判定（private/メンバー限定/公開予定/プレミア前）
+# SKIP すべきなら (表示用の理由, 記録用の理由, 再評価する時刻 or None) を返す。
+# ----------------------------------------------------
+def skip_reason(entry):
+    availability = entry.get('availability', 'unknown')
+    if availability in ('private', 'needs_auth', 'scheduled', 'subscriber_only', 'premium_only'):
+        return f"availability={availability}", availability, None
+    live_status = entry.get('live_status', 'none')
+    if live_status in ('not_started', 'is_upcoming'):
+        return f"live_status={live_status}", 'scheduled', entry.get('release_timestamp')
+    premiere_ts = entry.get('premiere_timestamp')
+    if premiere_ts and premiere_ts > time.time():
+        return "premiere in future", 'scheduled', premiere_ts
+    return None
+
 # ----------------------------------------------------
 # 指定されたURLが単一動画、チャンネル、または再生リストの場合、
-# それぞれの動画URLリストを返します。
+# それぞれの動画URLを 1 件ずつ返すジェネレータです。
+# 一覧はページ単位で遅延取得し、SKIP 判定を通った URL からすぐ返すため、
+# 呼び出し側（ワーカープール/パイプライン）は列挙の完了を待たずに処理を始められます。
+#
+# 差分同期（known_ids を渡した場合）:
+#   一覧を新しい順に 1 ページずつ遅延取得し、known_ids に含まれる動画は飛ばす。
+#   既知の動画が stop_after_known 本連続したら、それ以降は取得済みとみなして列挙を打ち切る。
+#   skipped（SkippedVideoStore）を渡すと、SKIP した動画を記録し、猶予期間内は再評価しない。
+#
+# with_info=True なら (video_url, info) を返す。単一動画では判定のために取得済みの
+# 未処理 info（process=False）を渡すので、download_video(info_dict=info) は再抽出しない。
+# 再生リスト/チャンネルの各動画は一覧の簡易情報しか無いため info は None。
 # ----------------------------------------------------
-def extract_video_urls(input_url):
+def iter_video_urls(input_url, known_ids=None, stop_after_known=None, skipped=None, with_info=False):
+    import yt_dlp  # 重い依存なので使う時に読み込む（起動時間対策）
+
     # 先に ffmpeg の場所を適用（警告の抑制 & 後続統一）
     ffmpeg_dir = get_local_ffmpeg_dir()
     apply_ffmpeg_location_to_env(ffmpeg_dir)
 
-    def get_info(url):
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'extract_flat': True,
-            'ignoreerrors': True,
-            'extractor_args': {
-                'youtube': {
-                    # tvを優先 web/ios/androidは任意
-                    'player_client': ['tv'],
-                    # 'player_client': ['tv', 'web', 'ios', 'android'],
-                }
-            },
-        }
-        # 見つかった場合のみ ffmpeg_location を渡す
-        if ffmpeg_dir:
-            ydl_opts['ffmpeg_location'] = ffmpeg_dir
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False)
+    ydl_opts = {
+        'quiet': True,
+        'skip_download': True,
+        'extract_flat': True,
+        'ignoreerrors': True,
+        'extractor_args': {
+            'youtube': {
+                # 一覧には動画ごとの勝者が無いので、ClientStrategy の統計で最も良い client を使う
+                'player_client': default_client_strategy().ranked()[:1],
+            }
+        },
+    }
+    # 見つかった場合のみ ffmpeg_location を渡す
+    if ffmpeg_dir:
+        ydl_opts['ffmpeg_location'] = ffmpeg_dir
 
     # @を含むチャンネルハンドルURLの場合、自動的に/videosを付与
     if '@' in input_url and not input_url.endswith('/videos'):
         input_url = input_url.rstrip('/') + '/videos'
 
-    try:
-        info = get_info(input_url)
-    except yt_dlp.utils.DownloadError as e:
-        print(f"情報の取得中にエラーが発生しました: {e}")
-        return []
-
-    # 'entries' があれば複数動画 (チャンネル/再生リスト)
-    if 'entries' in info and info['entries']:
-        valid_urls = []
-        for entry in info['entries'] or []:
-            if not entry:
-                continue
-            availability = entry.get('availability', 'unknown')
-            if availability in ('private', 'needs_auth', 'scheduled'):
-                print(f"【SKIP】ID={entry.get('id')} (availability={availability})")
-                continue
-            live_status = entry.get('live_status', 'none')
-            if live_status in ('not_started', 'is_upcoming'):
-                print(f"【SKIP】ID={entry.get('id')} (live_status={live_status})")
-                continue
-            premiere_ts = entry.get('premiere_timestamp')
-            if premiere_ts and premiere_ts > time.time():
-                print(f"【SKIP】ID={entry.get('id')} (premiere in future)")
-                continue
-
-            url_candidate = entry.get('url') or entry.get('webpage_url')
-            if url_candidate and 'watch?v=' in url_candidate:
-                valid_urls.append(url_candidate)
-
-        print(f"対象の動画数: {len(valid_urls)}")
-        return valid_urls
+    with checkout_ydl(ydl_opts) as ydl:
+        try:
+            # process=False: entries をページ単位の遅延ジェネレータのまま受け取る
+            info = ydl.extract_info(input_url, download=False, process=False)
+            # process=False ではリダイレクト（url 型）が解決されないので辿る
+            while info and info.get('_type') in ('url', 'url_transparent') and info.get('url'):
+                info = ydl.extract_info(info['url'], download=False, process=False)
+        except yt_dlp.utils.DownloadError as e:
+            print(f"情報の取得中にエラーが発生しました: {e}")
+            return
+
+        if not info:
+            print("動画URLの取得に失敗しました。")
+            return
+
+        # 'entries' があれば複数動画 (チャンネル/再生リスト)
+        if info.get('_type') == 'playlist' or 'entries' in info:
+            count = 0
+            known_run = 0
+            for entry in info.get('entries') or []:
+                if not entry:
+                    continue
+                video_id = entry.get('id')
+
+                # 猶予期間内の SKIP 済みも、取得済みと同じく連続数に数える（途中の非公開動画で打ち切りが遅れないように）
+                if ((known_ids is not None and video_id in known_ids)
+                        or (skipped is not None and video_id in skipped)):
+                    known_run += 1
+                    if stop_after_known and known_run >= stop_after_known:
+                        print(f"既知の動画が {known_run} 本連続したため列挙を打ち切ります。")
+                        break
+                    continue
+                known_run = 0
+
+                reason = skip_reason(entry)
+                if reason:
+                    print(f"【SKIP】ID={video_id} ({reason[0]})")
+                    if skipped is not None:
+                        skipped.add(video_id, reason[1], reason[2])
+                    continue
+
+                url_candidate = entry.get('url') or entry.get('webpage_url')
+                if url_candidate and 'watch?v=' in url_candidate:
+                    count += 1
+                    yield (url_candidate, None) if with_info else url_candidate
+
+            print(f"列挙が完了しました。対象の動画数: {count}")
+            return
 
     # 単一動画
     video_url = info.get('webpage_url')
-    availability = info.get('availability', 'unknown')
-    if availability in ('private', 'needs_auth', 'scheduled'):
-        print(f"【SKIP】単一動画 (availability={availability}) → URL={video_url}")
-        return []
-    live_status = info.get('live_status', 'none')
-    if live_status in ('not_started', 'is_upcoming'):
-        print(f"【SKIP】単一動画 (live_status={live_status}) → URL={video_url}")
-        return []
-    premiere_ts = info.get('premiere_timestamp')
-    if premiere_ts and premiere_ts > time.time():
-        print(f"【SKIP】単一動画 (premiere in future) → URL={video_url}")
-        return []
+    reason = skip_reason(info)
+    if reason:
+        print(f"【SKIP】単一動画 ({reason[0]}) → URL={video_url}")
+        return
 
     if video_url and 'watch?v=' in video_url:
         print("単一動画が指定されました。")
-        return [video_url]
+        yield (video_url, info) if with_info else video_url
+        return
 
     print("動画URLの取得に失敗しました。")
-    return []
+
+# ----------------------------------------------------
+# iter_video_urls を最後まで列挙し、動画URLリストとして返します。
+# ----------------------------------------------------
+def extract_video_urls(input_url, known_ids=None, stop_after_known=None, skipped=None):
+    return list(iter_video_urls(input_url, known_ids, stop_after_known, skipped))
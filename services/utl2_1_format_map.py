@@ -16,3 +16,31 @@ FORMAT_MAP = {
     '2160': 'bestvideo[ext=mp4][height<=2160]+bestaudio[ext=m4a]/best[ext=mp4]',
     '4320': 'bestvideo[ext=mp4][height<=4320]+bestaudio[ext=m4a]/best[ext=mp4]',
 }
+
+# プリセットごとの画質の上限（'d' はデフォルトの 1080p）。音声のみ（'a'）は含まない
+PRESET_HEIGHTS = {'d': 1080, '144': 144, '240': 240, '360': 360, '480': 480, '720': 720,
+                  '1080': 1080, '1440': 1440, '2160': 2160, '4320': 4320}
+
+# ------------------------------------------------------------------
+# プリセットが手元の formats に合わなかったときに、順に試す代わりのフォーマット。
+# formats は抽出済みの info_dict['formats']（実際にある高さから「一番近い上」を決める）。
+# Returns:
+#     list: [(ラベル, フォーマット指定), ...]。先頭はプリセットそのもの（ラベル 'preset'）。
+#     音声のみ（'a'）はプリセット自体が最後まで代わりを持つため、プリセットだけ。
+#       lower       : 上限以下で一番高い映像（拡張子は問わない）
+#       higher      : 上限を超える中で一番低い映像
+#       progressive : 映像と音声が一体の mp4（無ければ一体の最良）
+#       audio       : 音声のみ
+# ------------------------------------------------------------------
+def fallback_chain(format_code, formats=None):
+    chain = [('preset', FORMAT_MAP[format_code])]
+    height = PRESET_HEIGHTS.get(format_code)
+    if height is not None:
+        chain.append(('lower', f'bestvideo[height<={height}]+bestaudio/best[height<={height}]'))
+        higher = sorted({f['height'] for f in formats or []
+                         if f.get('vcodec') != 'none' and (f.get('height') or 0) > height})
+        if higher:
+            chain.append(('higher', f'bestvideo[height={higher[0]}]+bestaudio/best[height={higher[0]}]'))
+        chain.append(('progressive', 'best[ext=mp4]/best'))
+        chain.append(('audio', 'bestaudio/best'))
+    return chain
@@ -0,0 +1,85 @@
+# utl2_2_ydl_pool.py
+
+import atexit
+import json
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+# 1 つのオプション組あたりに保持しておく待機インスタンスの上限
+MAX_IDLE_PER_KEY = 8
+
+def _opts_key(ydl_opts: Dict[str, Any]) -> str:
+    # 関数やオブジェクト（hooks 等）は repr で区別する
+    return json.dumps(ydl_opts, sort_keys=True, default=repr)
+
+class YdlPool:
+    """
+    オプション組（フォーマット/ffmpeg の場所/player_client/出力先 等）ごとに、
+    温まった yt_dlp.YoutubeDL を使い回すためのプール。
+
+    YoutubeDL はスレッドセーフではないため、checkout 中の 1 インスタンスは 1 スレッド専有。
+    extractor の初期化・オプション解析・HTTP opener・player JS/署名キャッシュが
+    動画ごとに作り直されなくなる。
+    """
+
+    def __init__(self, max_idle_per_key: int = MAX_IDLE_PER_KEY):
+        self.max_idle_per_key = max_idle_per_key
+        self._idle: Dict[str, List["yt_dlp.YoutubeDL"]] = {}
+        self._lock = threading.Lock()
+        self.created = 0  # 計測用: 生成したインスタンス数
+        self.reused = 0   # 計測用: 使い回した回数
+
+    @contextmanager
+    def checkout(self, ydl_opts: Dict[str, Any]) -> Iterator["yt_dlp.YoutubeDL"]:
+        import yt_dlp  # 初回の checkout まで読み込まない（起動時間対策）
+
+        key = _opts_key(ydl_opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+            if ydl is not None:
+                self.reused += 1
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+            with self._lock:
+                self.created += 1
+
+        healthy = False
+        try:
+            yield ydl
+            healthy = True
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError):
+            # 動画側の問題（非公開/フォーマット無し等）はインスタンスの問題ではない
+            healthy = True
+            raise
+        finally:
+            if healthy:
+                with self._lock:
+                    idle = self._idle.setdefault(key, [])
+                    if len(idle) < self.max_idle_per_key:
+                        idle.append(ydl)
+                        ydl = None
+            if ydl is not None:
+                ydl.__exit__(None, None, None)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle_lists, self._idle = list(self._idle.values()), {}
+        for idle in idle_lists:
+            for ydl in idle:
+                ydl.__exit__(None, None, None)  # cookie の保存などの後始末
+
+# プロセス内で共有する既定のプール（プロセスモードでは子プロセスごとに 1 つ）
+_DEFAULT_POOL = YdlPool()
+atexit.register(_DEFAULT_POOL.close_all)
+
+def checkout_ydl(ydl_opts: Dict[str, Any]):
+    """既定のプールから YoutubeDL を借りる。with 文で使い、抜けると返却される。"""
+    return _DEFAULT_POOL.checkout(ydl_opts)
+
+def default_pool() -> YdlPool:
+    return _DEFAULT_POOL
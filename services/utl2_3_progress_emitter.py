@@ -0,0 +1,113 @@
+# utl2_3_progress_emitter.py
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, TextIO
+
+# 進捗の出力先（UI 側が用意する専用チャネル）。どちらも無ければ出力しない。
+#   MUSIC_APP_PROGRESS_FD   : 書き込み用のファイルディスクリプタ番号（Electron の stdio 4 本目 = 3 など）
+#   MUSIC_APP_PROGRESS_PATH : JSON Lines を追記するファイルパス
+PROGRESS_FD_ENV = "MUSIC_APP_PROGRESS_FD"
+PROGRESS_PATH_ENV = "MUSIC_APP_PROGRESS_PATH"
+
+# 同じ動画の downloading イベントを出す最短間隔（秒）
+DEFAULT_MIN_INTERVAL = 0.5
+
+class ProgressEmitter:
+    """
+    yt-dlp の progress_hooks / postprocessor_hooks を受けて、
+    1 行 1 イベントの JSON（JSON Lines）を専用チャネルへ書き出す。
+
+    フラグメント単位で毎秒数千回呼ばれても、同じ動画の downloading は
+    min_interval 秒に 1 回へ間引く（最新の値だけを出す）。
+    finished / error と段の切り替わりは間引かずに必ず出す。
+    """
+
+    def __init__(self, stream: TextIO, min_interval: float = DEFAULT_MIN_INTERVAL):
+        self.stream = stream
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_emit: Dict[str, float] = {}
+
+    def set_min_interval(self, min_interval: float) -> None:
+        self.min_interval = min_interval
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            try:
+                self.stream.write(line + "\n")
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass  # UI 側が閉じていてもダウンロードは止めない
+
+    def emit(self, video_id: Optional[str], stage: str, status: str, **fields: Any) -> None:
+        """段の開始/完了など、間引かずに出すイベント。"""
+        event = {"ts": round(time.time(), 3), "video_id": video_id, "stage": stage, "status": status}
+        event.update({k: v for k, v in fields.items() if v is not None})
+        self._write(event)
+
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        info = d.get("info_dict") or {}
+        video_id = info.get("id")
+        status = d.get("status")
+        key = f"{video_id}:{info.get('format_id')}"
+        if status == "downloading":
+            now = time.monotonic()
+            with self._lock:
+                if now - self._last_emit.get(key, 0.0) < self.min_interval:
+                    return
+                self._last_emit[key] = now
+        else:
+            with self._lock:
+                self._last_emit.pop(key, None)
+
+        self.emit(
+            video_id, "download", status,
+            format_id=info.get("format_id"),
+            bytes=d.get("downloaded_bytes"),
+            total=d.get("total_bytes") or d.get("total_bytes_estimate"),
+            speed=round(d["speed"], 1) if d.get("speed") else None,
+            eta=d.get("eta"),
+            fragment=d.get("fragment_index"),
+            fragments=d.get("fragment_count"),
+        )
+
+    def postprocessor_hook(self, d: Dict[str, Any]) -> None:
+        info = d.get("info_dict") or {}
+        self.emit(info.get("id"), "postprocess", d.get("status"), postprocessor=d.get("postprocessor"))
+
+    def ydl_opts(self) -> Dict[str, Any]:
+        """ydl_opts に足すフック設定。"""
+        return {
+            "progress_hooks": [self.progress_hook],
+            "postprocessor_hooks": [self.postprocessor_hook],
+        }
+
+_DEFAULT_EMITTER: Optional[ProgressEmitter] = None
+_DEFAULT_LOCK = threading.Lock()
+
+def default_emitter() -> Optional[ProgressEmitter]:
+    """
+    環境変数で指定された専用チャネルへの emitter（プロセス内で 1 つ）。
+    チャネルが指定されていなければ None。
+    """
+    global _DEFAULT_EMITTER
+    with _DEFAULT_LOCK:
+        if _DEFAULT_EMITTER is None:
+            stream = None
+            if os.getenv(PROGRESS_FD_ENV):
+                stream = os.fdopen(int(os.environ[PROGRESS_FD_ENV]), "w", encoding="utf-8", buffering=1)
+            elif os.getenv(PROGRESS_PATH_ENV):
+                stream = open(os.environ[PROGRESS_PATH_ENV], "a", encoding="utf-8", buffering=1)
+            if stream is not None:
+                _DEFAULT_EMITTER = ProgressEmitter(stream)
+        return _DEFAULT_EMITTER
+
+def set_default_emitter(emitter: Optional[ProgressEmitter]) -> None:
+    """常駐プロセスなど、環境変数以外のチャネルを使う場合に差し替える。"""
+    global _DEFAULT_EMITTER
+    with _DEFAULT_LOCK:
+        _DEFAULT_EMITTER = emitter
@@ -0,0 +1,156 @@
+# utl2_4_fragment_tuner.py
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+# 断片（DASH/HLS のフラグメント）の同時ダウンロード数の範囲
+MIN_FRAGMENTS = 1
+MAX_FRAGMENTS = 16
+
+# これより小さい転送はスループットの判断に使わない（立ち上がりの遅延が支配的で誤差が大きい）
+MIN_SAMPLE_BYTES = 4 * 1024 * 1024
+MIN_SAMPLE_SEC = 1.0
+
+# 保持しておく計測結果の件数（常駐プロセスでも増え続けないように）
+HISTORY_LIMIT = 1000
+
+class FragmentTuner:
+    """
+    yt-dlp の concurrent_fragment_downloads を動画と動画の間で調整する（AIMD）。
+
+    progress_hooks で動画ごとの転送バイト数と所要時間を測り、1 本終わるごとに
+      - 基準より gain 以上速くなった   → 1 段増やす（加算的増加）
+      - 基準より gain 以上遅くなった   → decrease 倍に減らす（乗算的減少）
+      - どちらでもない（頭打ち）       → そのまま
+    とする。基準は直前に段数を変えたときのスループット（据え置き中は移動平均）。
+    adaptive=False なら段数は固定のまま、計測だけ行う。
+
+    フラグメント分割されていない形式（通常の https 直リンク）には段数が効かないため、
+    計測はしても判断には使わない。複数スレッドから共有できる。
+    """
+
+    def __init__(self, fragments: int = MIN_FRAGMENTS, adaptive: bool = False,
+                 min_fragments: int = MIN_FRAGMENTS, max_fragments: int = MAX_FRAGMENTS,
+                 gain: float = 0.1, decrease: float = 0.5, smoothing: float = 0.3):
+        self.adaptive = adaptive
+        self.min_fragments = min_fragments
+        self.max_fragments = max_fragments
+        self.gain = gain
+        self.decrease = decrease
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._fragments = max(min_fragments, min(max_fragments, fragments))
+        self._reference: Optional[float] = None
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=HISTORY_LIMIT)  # 計測結果（1 本 1 件）
+
+    def current(self) -> int:
+        """次に始める動画に使う同時ダウンロード数。"""
+        return self._fragments
+
+    # ---- 計測 -----------------------------------------------------------
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        info = d.get("info_dict") or {}
+        video_id = info.get("id")
+        if not video_id or d.get("status") not in ("downloading", "finished"):
+            return
+        now = time.monotonic()
+        with self._lock:
+            run = self._running.setdefault(video_id, {"start": now, "end": now, "bytes": {}, "fragmented": False})
+            run["end"] = now
+            run["bytes"][info.get("format_id")] = d.get("downloaded_bytes") or d.get("total_bytes") or 0
+            if d.get("fragment_count"):
+                run["fragmented"] = True
+
+    def ydl_opts(self) -> Dict[str, Any]:
+        """ydl_opts に足す設定（同時ダウンロード数と計測フック）。"""
+        return {
+            "concurrent_fragment_downloads": self.current(),
+            "progress_hooks": [self.progress_hook],
+        }
+
+    def finish(self, video_id: str, fragments: int) -> Optional[Dict[str, Any]]:
+        """
+        1 本分の計測を締めて段数を見直す。fragments はその動画で使った段数。
+        転送が無かった（DL済みで飛ばした等）場合は None。
+        """
+        with self._lock:
+            run = self._running.pop(video_id, None)
+            if run is None:
+                return None
+            nbytes = sum(run["bytes"].values())
+            seconds = run["end"] - run["start"]
+            if nbytes <= 0 or seconds <= 0:
+                return None
+            sample = {
+                "video_id": video_id,
+                "concurrent_fragments": fragments,
+                "fragmented": run["fragmented"],
+                "bytes": nbytes,
+                "seconds": round(seconds, 3),
+                "bytes_per_sec": round(nbytes / seconds, 1),
+            }
+            if (self.adaptive and run["fragmented"]
+                    and nbytes >= MIN_SAMPLE_BYTES and seconds >= MIN_SAMPLE_SEC
+                    and fragments == self._fragments):
+                self._adjust(sample["bytes_per_sec"])
+            sample["next_fragments"] = self._fragments
+            self.history.append(sample)
+            return sample
+
+    def discard(self, video_id: Optional[str]) -> None:
+        """失敗した動画の計測途中の値を捨てる（再試行時に前回の開始時刻を引き継がない）。"""
+        with self._lock:
+            self._running.pop(video_id, None)
+
+    def _adjust(self, throughput: float) -> None:
+        reference = self._reference
+        if reference is None or throughput >= reference * (1 + self.gain):
+            fragments = min(self.max_fragments, self._fragments + 1)
+        elif throughput < reference * (1 - self.gain):
+            fragments = max(self.min_fragments, int(self._fragments * self.decrease))
+        else:
+            fragments = self._fragments
+        if fragments != self._fragments:
+            self._reference = throughput
+            print(f"断片の同時ダウンロード数を変更します: {self._fragments} → {fragments}"
+                  f" ({throughput / 1024 / 1024:.1f} MiB/s)")
+            self._fragments = fragments
+        else:
+            self._reference = reference + (throughput - reference) * self.smoothing
+
+    def summary(self) -> Dict[str, Any]:
+        """この実行の計測のまとめ（最終の段数と平均スループット）。"""
+        with self._lock:
+            total_bytes = sum(s["bytes"] for s in self.history)
+            total_sec = sum(s["seconds"] for s in self.history)
+            return {
+                "adaptive": self.adaptive,
+                "concurrent_fragments": self._fragments,
+                "videos": len(self.history),
+                "bytes": total_bytes,
+                "bytes_per_sec": round(total_bytes / total_sec, 1) if total_sec else None,
+            }
+
+# プロセス内で共有する既定の tuner（既定は yt-dlp と同じく 1 本ずつ、計測のみ）
+_DEFAULT_TUNER = FragmentTuner()
+
+def default_fragment_tuner() -> FragmentTuner:
+    return _DEFAULT_TUNER
+
+def configure_fragments(setting) -> FragmentTuner:
+    """
+    既定の tuner を差し替える。
+      setting が int   : その段数で固定
+      setting が 'adaptive' : 1 から始めて AIMD で調整
+    """
+    global _DEFAULT_TUNER
+    if setting == "adaptive":
+        _DEFAULT_TUNER = FragmentTuner(adaptive=True)
+    elif isinstance(setting, int) and setting >= 1:
+        _DEFAULT_TUNER = FragmentTuner(setting)
+    else:
+        raise ValueError(f"無効な断片の同時ダウンロード数です: {setting} (1 以上の整数 または 'adaptive')")
+    return _DEFAULT_TUNER
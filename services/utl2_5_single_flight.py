@@ -0,0 +1,183 @@
+# utl2_5_single_flight.py
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+# プロセス間のロックの有効期限（秒）。保持している間は lease_sec / 3 ごとに延長する
+DEFAULT_LEASE_SEC = 60
+# 他プロセスの完了待ちで DB を確認する間隔（秒）
+POLL_SEC = 0.5
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class Lease:
+    """
+    プロセス間ロック 1 件。持っている間は lease_sec / 3 ごとに期限を延ばす。
+    release() は別スレッドからでも、何度呼んでもよい（detach_lease で手放した後の解放に使う）。
+    """
+
+    def __init__(self, lock_path: str, name: str, owner: str, lease_sec: float):
+        self.lock_path = lock_path
+        self.name = name
+        self.owner = owner
+        self.lease_sec = lease_sec
+        self.detached = False
+        self._stop = threading.Event()
+        self._beater = threading.Thread(target=self._extend, name="single-flight-lease", daemon=True)
+        self._beater.start()
+
+    def _extend(self) -> None:
+        beat = SingleFlight._connect(self.lock_path)
+        try:
+            while not self._stop.wait(self.lease_sec / 3):
+                beat.execute("UPDATE inflight SET lease_until=? WHERE key=? AND owner=?",
+                             (time.time() + self.lease_sec, self.name, self.owner))
+        finally:
+            beat.close()
+
+    def release(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._beater is not threading.current_thread():
+            self._beater.join()
+        conn = SingleFlight._connect(self.lock_path)
+        try:
+            conn.execute("DELETE FROM inflight WHERE key=? AND owner=?", (self.name, self.owner))
+        finally:
+            conn.close()
+
+class SingleFlight:
+    """
+    同じキー（video_id とフォーマット等）の処理を 1 回にまとめる。
+
+    プロセス内: 実行中の呼び出しがあれば、後から来た呼び出しはそれに相乗りし、同じ結果（または例外）を受け取る。
+    プロセス間: lock_path の SQLite にキーを期限付きで登録し、他のプロセスが実行中なら終わるまで待ってから
+    自分で func を呼ぶ（結果のオブジェクトはプロセスをまたいで渡せないため。ダウンロード済みのファイルは
+    yt-dlp が再転送しないので、実際に流れるのは情報の再取得だけになる）。
+    ロックを持ったプロセスが落ちても、期限切れ後に他のプロセスが引き継ぐ。
+
+    func の中で detach_lease() を呼ぶと、プロセス間ロックは func が戻っても解放されず、受け取った
+    Lease の release() まで持ち続ける（ステージングからの移動が終わるまで他のプロセスを待たせる場合など）。
+    shared を渡すと、相乗りした呼び出しには shared(結果) を返す（リーダーと区別したい場合）。
+    """
+
+    def __init__(self, lease_sec: float = DEFAULT_LEASE_SEC):
+        self.lease_sec = lease_sec
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._local = threading.local()
+        self.shared = 0  # 計測用: 相乗りした呼び出しの数
+
+    def do(self, key: Hashable, func: Callable[[], Any], lock_path: Optional[str] = None,
+           shared: Optional[Callable[[Any], Any]] = None) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            print(f"同じ動画を処理中のため、その結果を待ちます: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return shared(call.result) if shared else call.result
+
+        try:
+            if lock_path:
+                with self._cross_process(key, lock_path) as lease:
+                    outer = getattr(self._local, "lease", None)
+                    self._local.lease = lease
+                    try:
+                        call.result = func()
+                    finally:
+                        self._local.lease = outer
+            else:
+                call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def detach_lease(self) -> Optional[Lease]:
+        """
+        実行中の func（このスレッド）が持つプロセス間ロックを手放して返す。以後の解放は呼び出し側の
+        release() で行う。プロセス間ロックを使っていなければ None。
+        """
+        lease = getattr(self._local, "lease", None)
+        if lease is not None:
+            lease.detached = True
+            self._local.lease = None
+        return lease
+
+    # ---- プロセス間 -------------------------------------------------------
+    @staticmethod
+    def _connect(lock_path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(lock_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS inflight (
+            key          TEXT PRIMARY KEY,
+            owner        TEXT NOT NULL,
+            lease_until  REAL NOT NULL
+        );
+        """)
+        return conn
+
+    def _try_acquire(self, conn: sqlite3.Connection, key: str, owner: str) -> bool:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM inflight WHERE key=? AND lease_until < ?", (key, now))
+            cur = conn.execute("INSERT OR IGNORE INTO inflight (key, owner, lease_until) VALUES (?, ?, ?)",
+                               (key, owner, now + self.lease_sec))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    @contextmanager
+    def _cross_process(self, key: Hashable, lock_path: str) -> Iterator[Lease]:
+        name = "|".join(map(str, key)) if isinstance(key, tuple) else str(key)
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        conn = self._connect(lock_path)
+        try:
+            waited = False
+            while not self._try_acquire(conn, name, owner):
+                if not waited:
+                    print(f"別のプロセスが同じ動画を処理中のため、終わるまで待ちます: {name}")
+                    waited = True
+                time.sleep(POLL_SEC)
+        finally:
+            conn.close()
+
+        lease = Lease(lock_path, name, owner, self.lease_sec)
+        try:
+            yield lease
+        finally:
+            if not lease.detached:
+                lease.release()
+
+# プロセス内で共有する既定の single-flight
+_DEFAULT_SINGLE_FLIGHT = SingleFlight()
+
+def default_single_flight() -> SingleFlight:
+    return _DEFAULT_SINGLE_FLIGHT
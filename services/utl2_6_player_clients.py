@@ -0,0 +1,137 @@
+# utl2_6_player_clients.py
+
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# 試す player_client の既定の順位（統計が貯まるまではこの順）
+DEFAULT_CLIENTS = ["tv", "web", "ios", "android"]
+# 抽出の方式
+#   sequential : 上位から順に試す。deadline 秒で応答が無ければ次の client も並行して始める
+#   race       : 上位 race_width 個を同時に始め、最初に成功したものを使う
+STRATEGIES = ("sequential", "race")
+DEFAULT_DEADLINE_SEC = 15.0
+DEFAULT_RACE_WIDTH = 2
+
+# レイテンシの移動平均の重み
+_SMOOTHING = 0.3
+
+class ClientStats:
+    """player_client ごとの成功/失敗の回数と、成功時のレイテンシ（移動平均）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, client: str, ok: bool, latency: float) -> None:
+        with self._lock:
+            s = self._stats.setdefault(client, {"ok": 0, "failed": 0, "latency": None})
+            if ok:
+                s["ok"] += 1
+                s["latency"] = latency if s["latency"] is None else s["latency"] + (latency - s["latency"]) * _SMOOTHING
+            else:
+                s["failed"] += 1
+
+    def score(self, client: str) -> float:
+        """
+        成功率（ラプラス平滑化）÷ レイテンシ。未計測の client は成功率 1/2・レイテンシ DEFAULT_DEADLINE_SEC とみなす
+        （失敗が続く client は未計測の client より後ろに下がる）。
+        """
+        with self._lock:
+            s = self._stats.get(client)
+            if not s:
+                return 0.5 / DEFAULT_DEADLINE_SEC
+            success_rate = (s["ok"] + 1) / (s["ok"] + s["failed"] + 2)
+            return success_rate / max(s["latency"] or DEFAULT_DEADLINE_SEC, 0.1)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {client: dict(s) for client, s in self._stats.items()}
+
+class ClientStrategy:
+    """
+    複数の player_client で情報抽出を試し、成功した最初の結果を返す。
+    結果は client ごとに ClientStats へ記録し、以後の動画では統計の良い client から試す。
+
+    yt-dlp の抽出は途中で止められないため、負けた側の抽出はバックグラウンドで最後まで走り、
+    結果は捨てる（統計には記録する）。
+    """
+
+    def __init__(self, clients: Optional[List[str]] = None, strategy: str = "sequential",
+                 deadline: float = DEFAULT_DEADLINE_SEC, race_width: int = DEFAULT_RACE_WIDTH):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"無効な抽出方式です: {strategy} (sequential / race のいずれか)")
+        self.clients = list(clients or DEFAULT_CLIENTS)
+        self.strategy = strategy
+        self.deadline = deadline
+        self.race_width = race_width
+        self.stats = ClientStats()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(4, len(self.clients) * 2), thread_name_prefix="player-client")
+
+    def ranked(self) -> List[str]:
+        """統計の良い順（同点なら既定の順位）。"""
+        return sorted(self.clients, key=lambda c: (-self.stats.score(c), self.clients.index(c)))
+
+    def _attempt(self, extract: Callable[[str], Any], client: str) -> Any:
+        start = time.monotonic()
+        try:
+            info = extract(client)
+        except Exception:
+            info = None
+        ok = bool(info) and bool(info.get("formats"))
+        self.stats.record(client, ok, time.monotonic() - start)
+        return info if ok else None
+
+    def extract(self, extract: Callable[[str], Any]) -> Optional[Dict[str, Any]]:
+        """
+        extract(client) を順位に従って呼び、最初に成功した info を返す（'_player_client' に client を入れる）。
+        全て失敗したら None。
+        """
+        order = self.ranked()
+        width = self.race_width if self.strategy == "race" else 1
+        pending: Dict[concurrent.futures.Future, str] = {}
+        queue = list(order)
+
+        def launch(n):
+            for _ in range(n):
+                if queue:
+                    client = queue.pop(0)
+                    pending[self._executor.submit(self._attempt, extract, client)] = client
+
+        launch(width)
+        while pending:
+            # sequential: 次に試す client が残っている間だけ期限を設ける
+            timeout = self.deadline if self.strategy == "sequential" and queue else None
+            done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                # 期限内に応答が無い: 今の試行は続けたまま、次の client も始める
+                print(f"player_client={', '.join(pending.values())} の応答が遅いため、{queue[0]} も試します。")
+                launch(1)
+                continue
+            for future in done:
+                client = pending.pop(future)
+                info = future.result()
+                if info:
+                    info["_player_client"] = client
+                    return info
+            launch(len(done))
+        return None
+
+# プロセス内で共有する既定の抽出方式
+_DEFAULT_STRATEGY = ClientStrategy()
+
+def default_client_strategy() -> ClientStrategy:
+    return _DEFAULT_STRATEGY
+
+def configure_client_strategy(clients: Optional[List[str]] = None, strategy: str = "sequential",
+                              deadline: float = DEFAULT_DEADLINE_SEC,
+                              race_width: int = DEFAULT_RACE_WIDTH) -> ClientStrategy:
+    """既定の抽出方式を差し替える（それまでの統計は引き継ぐ）。"""
+    global _DEFAULT_STRATEGY
+    stats = _DEFAULT_STRATEGY.stats
+    _DEFAULT_STRATEGY = ClientStrategy(clients, strategy, deadline, race_width)
+    _DEFAULT_STRATEGY.stats = stats
+    return _DEFAULT_STRATEGY
@@ -0,0 +1,195 @@
+# utl2_7_stall_watchdog.py
+
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 既定のしきい値
+#   stall_sec 秒のあいだ 1 バイトも進まなければ「停止」
+#   slow_sec 秒の平均が min_speed (bytes/sec) を下回れば「低速」（YouTube の URL 単位の絞り込み）
+DEFAULT_STALL_SEC = 20.0
+DEFAULT_SLOW_SEC = 30.0
+DEFAULT_MIN_SPEED = 64 * 1024
+# 1 本あたり URL を取り直して再開する回数の上限（使い切った後の試行は遅くても最後まで待つ）
+DEFAULT_MAX_RESTARTS = 3
+
+# 保持しておく発生記録の件数（常駐プロセスでも増え続けないように）
+EVENT_LIMIT = 1000
+
+REASON_STALLED = "stalled"
+REASON_THROTTLED = "throttled"
+
+class StallDetected(Exception):
+    """転送の停止/低速を検知して、その試行を打ち切るときに progress_hook から送出する。"""
+
+    def __init__(self, video_id: str, reason: str, detail: str):
+        super().__init__(f"{video_id}: {detail}")
+        self.video_id = video_id
+        self.reason = reason
+
+class StallWatchdog:
+    """
+    progress_hooks で動画ごとの転送量を見張り、止まった/絞られた試行を打ち切る。
+
+    arm(video_id) した動画だけが対象。条件を満たすと StallDetected を送出して転送を止め、
+    理由を覚えておく。ダウンロード側は take(video_id) で理由を受け取り、URL を取り直して
+    同じ出力先に再開する（yt-dlp が .part / .ytdl から続きを取る）。
+
+    hook は転送が進んだときにしか呼ばれないため、完全に無応答のソケットは hook では検知できない。
+    ydl_opts() の socket_timeout を stall_sec にしておき、yt-dlp が再試行を使い切ってタイムアウトの
+    DownloadError を返したら、ダウンロード側が trip_on_timeout() で停止として扱う（URL を取り直して再開）。
+
+    発生回数は player_client × format_id ごとに数える。複数スレッドから共有できる。
+    """
+
+    def __init__(self, stall_sec: float = DEFAULT_STALL_SEC, slow_sec: float = DEFAULT_SLOW_SEC,
+                 min_speed: Optional[float] = DEFAULT_MIN_SPEED, max_restarts: int = DEFAULT_MAX_RESTARTS):
+        self.stall_sec = stall_sec
+        self.slow_sec = slow_sec
+        self.min_speed = min_speed
+        self.max_restarts = max_restarts
+        self._lock = threading.Lock()
+        self._watching: Dict[str, Dict[str, Any]] = {}
+        self._tripped: Dict[str, Tuple[str, str]] = {}
+        self._counts: Dict[Tuple[str, str, str], int] = {}
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=EVENT_LIMIT)  # 発生記録（1 回 1 件）
+
+    # ---- 試行ごと -------------------------------------------------------
+    def arm(self, video_id: str, player_client: Optional[str] = None, check_speed: bool = True) -> None:
+        """
+        video_id の次の試行を見張る。check_speed=False なら停止だけを判定する
+        （帯域制限中など、意図して遅くしている場合）。
+        """
+        with self._lock:
+            self._tripped.pop(video_id, None)
+            self._watching[video_id] = {
+                "client": player_client or "-",
+                "min_speed": self.min_speed if check_speed else None,
+                "samples": deque(),
+                "bytes": {},
+                "progress_at": None,
+            }
+
+    def disarm(self, video_id: str) -> None:
+        with self._lock:
+            self._watching.pop(video_id, None)
+
+    def trip_on_timeout(self, video_id: str, error: BaseException) -> bool:
+        """
+        見張り中の video_id の試行がソケットのタイムアウトで失敗したなら、停止として記録して True を返す
+        （続けて take() で理由を受け取る）。見張っていない/タイムアウト以外の失敗なら False。
+        """
+        if not _is_timeout(error):
+            return False
+        with self._lock:
+            watch = self._watching.get(video_id)
+            if watch is None or video_id in self._tripped:
+                return False
+            format_id = "-"  # どの断片で止まったかは分からない
+            self._tripped[video_id] = (format_id, REASON_STALLED)
+            key = (watch["client"], format_id, REASON_STALLED)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.events.append({"video_id": video_id, "player_client": watch["client"], "format_id": format_id,
+                                "reason": REASON_STALLED, "detail": f"応答が無くタイムアウトしました: {error}",
+                                "at": time.time()})
+        return True
+
+    def take(self, video_id: str) -> Optional[str]:
+        """直前の試行を打ち切った理由（無ければ None）を受け取り、見張りを解く。"""
+        with self._lock:
+            self._watching.pop(video_id, None)
+            tripped = self._tripped.pop(video_id, None)
+        return tripped[1] if tripped else None
+
+    # ---- 計測 -----------------------------------------------------------
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        info = d.get("info_dict") or {}
+        video_id = info.get("id")
+        if d.get("status") != "downloading" or not video_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            watch = self._watching.get(video_id)
+            if watch is None or video_id in self._tripped:
+                return
+            format_id = info.get("format_id") or "-"
+            before = sum(watch["bytes"].values())
+            watch["bytes"][format_id] = d.get("downloaded_bytes") or 0
+            total = sum(watch["bytes"].values())
+            if watch["progress_at"] is None or total > before:
+                watch["progress_at"] = now
+            samples = watch["samples"]
+            samples.append((now, total))
+            while len(samples) > 2 and now - samples[1][0] >= self.slow_sec:
+                samples.popleft()
+
+            detail = None
+            if now - watch["progress_at"] >= self.stall_sec:
+                reason = REASON_STALLED
+                detail = f"{now - watch['progress_at']:.0f} 秒間 転送が進んでいません"
+            elif watch["min_speed"] and now - samples[0][0] >= self.slow_sec:
+                speed = (total - samples[0][1]) / (now - samples[0][0])
+                if speed < watch["min_speed"]:
+                    reason = REASON_THROTTLED
+                    detail = f"直近 {self.slow_sec:.0f} 秒の平均が {speed / 1024:.0f} KiB/s です"
+            if detail is None:
+                return
+            self._tripped[video_id] = (format_id, reason)
+            key = (watch["client"], format_id, reason)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.events.append({"video_id": video_id, "player_client": watch["client"], "format_id": format_id,
+                                "reason": reason, "detail": detail, "at": time.time()})
+        raise StallDetected(video_id, reason, detail)
+
+    def ydl_opts(self) -> Dict[str, Any]:
+        """ydl_opts に足す設定（無応答のソケットの打ち切りと見張りのフック）。"""
+        return {
+            "socket_timeout": self.stall_sec,
+            "progress_hooks": [self.progress_hook],
+        }
+
+    # ---- 集計 -----------------------------------------------------------
+    def events_for(self, video_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(e) for e in self.events if e["video_id"] == video_id]
+
+    def counts(self, since: Optional[Dict[Tuple[str, str, str], int]] = None) -> Dict[Tuple[str, str, str], int]:
+        """
+        (player_client, format_id, reason) → 発生回数（プロセス内の累計）。
+        since に以前の counts() を渡すと、それ以降に増えた分だけを返す（同時に動く他のジョブの分は含む）。
+        """
+        with self._lock:
+            counts = dict(self._counts)
+        if since:
+            counts = {key: n - since.get(key, 0) for key, n in counts.items() if n > since.get(key, 0)}
+        return counts
+
+def _is_timeout(error: BaseException) -> bool:
+    """DownloadError の元の例外（exc_info）や原因をたどり、ソケットのタイムアウトかを判定する。"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (socket.timeout, TimeoutError)) or "timed out" in str(error).lower():
+            return True
+        exc_info = getattr(error, "exc_info", None)
+        error = (exc_info[1] if exc_info else None) or error.__cause__ or error.__context__
+    return False
+
+# プロセス内で共有する既定の watchdog
+_DEFAULT_WATCHDOG = StallWatchdog()
+
+def default_stall_watchdog() -> StallWatchdog:
+    return _DEFAULT_WATCHDOG
+
+def configure_stall_watchdog(stall_sec: float = DEFAULT_STALL_SEC, slow_sec: float = DEFAULT_SLOW_SEC,
+                             min_speed: Optional[float] = DEFAULT_MIN_SPEED,
+                             max_restarts: int = DEFAULT_MAX_RESTARTS) -> StallWatchdog:
+    """既定の watchdog のしきい値を変える（発生回数は引き継ぐ）。"""
+    with _DEFAULT_WATCHDOG._lock:
+        _DEFAULT_WATCHDOG.stall_sec = stall_sec
+        _DEFAULT_WATCHDOG.slow_sec = slow_sec
+        _DEFAULT_WATCHDOG.min_speed = min_speed
+        _DEFAULT_WATCHDOG.max_restarts = max_restarts
+    return _DEFAULT_WATCHDOG
@@ -0,0 +1,69 @@
+# utl2_8_download_failures.py
+
+import errno
+import re
+from typing import Any, Dict, Optional
+
+# 失敗した段
+STAGE_SETUP = "setup"        # ffmpeg など実行環境
+STAGE_VALIDATE = "validate"  # URL の検査
+STAGE_FORMAT = "format"      # フォーマットコードの解決
+STAGE_DOWNLOAD = "download"  # 抽出を含むメディアのDL
+STAGE_PROCESS = "process"    # DL後の成果物作成など、上記以外
+
+# yt-dlp のエラーメッセージから失敗の種類を判定する（上から順に見る）
+#   (種類, 再試行して直る見込みがあるか, 正規表現)
+_DOWNLOAD_ERROR_RULES = (
+    ("http_429", True, re.compile(r"HTTP Error 429|Too Many Requests", re.I)),
+    ("http_403", True, re.compile(r"HTTP Error 403|Forbidden", re.I)),
+    ("format_unavailable", False, re.compile(r"Requested format is not available", re.I)),
+    ("unavailable", False, re.compile(
+        r"Private video|Video unavailable|has been removed|members[- ]only|Join this channel"
+        r"|Sign in to confirm your age|This live event will begin", re.I)),
+    ("network", True, re.compile(
+        r"timed out|Connection (?:reset|refused|aborted)|Temporary failure|Remote end closed"
+        r"|HTTP Error 5\d\d|IncompleteRead", re.I)),
+)
+
+class VideoFailure(Exception):
+    """
+    1 本の動画の失敗。バッチ全体を止めずに、その動画だけを失敗として扱うために送出する。
+
+    error_class は失敗の種類（'http_429' / 'unavailable' / 'network' など）、stage は失敗した段、
+    retryable は時間を置いて再試行すれば直る見込みがあるか。
+    """
+
+    def __init__(self, message: str, stage: str, error_class: str, retryable: bool,
+                 video_url: Optional[str] = None):
+        super().__init__(message)
+        self.stage = stage
+        self.error_class = error_class
+        self.retryable = retryable
+        self.video_url = video_url
+
+    def __reduce__(self):
+        # プロセスモードの子からも送れるように（既定の pickle は args しか復元しない）
+        return (VideoFailure, (str(self), self.stage, self.error_class, self.retryable, self.video_url))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"video_url": self.video_url, "stage": self.stage, "error_class": self.error_class,
+                "retryable": self.retryable, "message": str(self)}
+
+def classify_failure(e: BaseException, video_url: Optional[str] = None,
+                     stage: str = STAGE_PROCESS) -> VideoFailure:
+    """任意の例外を VideoFailure に変換する（VideoFailure ならそのまま。URL が無ければ補う）。"""
+    if isinstance(e, VideoFailure):
+        if e.video_url is None:
+            e.video_url = video_url
+        return e
+    message = f"{type(e).__name__}: {e}"
+    if type(e).__name__ in ("DownloadError", "ExtractorError"):
+        for error_class, retryable, pattern in _DOWNLOAD_ERROR_RULES:
+            if pattern.search(str(e)):
+                return VideoFailure(message, STAGE_DOWNLOAD, error_class, retryable, video_url)
+        return VideoFailure(message, STAGE_DOWNLOAD, "download_error", True, video_url)
+    if isinstance(e, OSError):
+        if e.errno == errno.ENOSPC:
+            return VideoFailure(message, stage, "disk_full", False, video_url)
+        return VideoFailure(message, stage, "os_error", True, video_url)
+    return VideoFailure(message, stage, "internal", False, video_url)
@@ -0,0 +1,207 @@
+# utl2_9_staging.py
+
+import glob
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+# ステージングの既定の上限（バイト）。転送中・移動待ちの合計がこれを超えている間は新しいDLを始めない
+DEFAULT_CAP_BYTES = 8 * 1024 * 1024 * 1024
+# 上限待ちで使用量を測り直す間隔（秒）
+POLL_SEC = 1.0
+# 別デバイスへ移すときのコピーの単位
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+# 移動先の dl/<id>/ を書いておくファイル（落ちた後に残ったものを移すため）
+TARGET_FILE = ".target"
+
+# 完成したメディア（media.mp4 など）。media.f137.mp4（結合前）や .part / .ytdl は含まない
+_FINISHED_MEDIA = re.compile(r"^media\.[A-Za-z0-9]+$")
+
+def finished_media(folder: str):
+    """folder 内の完成したメディアのパス（folder が無ければ空）。"""
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in os.listdir(folder) if _FINISHED_MEDIA.match(name)]
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass  # 移動・削除と行き違った
+    return total
+
+def _release(holds) -> None:
+    """移動を待っていた予約やロックを解放する（解放できなくても、どれも期限切れで外れる）。"""
+    for hold in holds:
+        try:
+            hold.release()
+        except Exception as e:
+            print(f"移動を待っていた予約/ロックを解放できませんでした（期限切れで外れます）: {e}")
+
+class StagingArea:
+    """
+    転送中のファイル（断片・.part・ffmpeg の結合）を速いディスク（tmpfs / ローカル NVMe 等）に置き、
+    完成したメディアだけをバックグラウンドのスレッドで dl/<id>/ へ移す。
+    fork した子プロセスでは移動スレッドが引き継がれないため、子で最初に使ったときに子の移動スレッドを始める
+    （子で積んだ移動は子の flush() で待つこと。親の flush() は子の分を待たない）。
+
+    移動は同じデバイスなら rename、別デバイスならストリームでコピーしてから元を消す。
+    ステージングの使用量（転送中 + 移動待ち）が cap_bytes 以上の間、admit() は新しいDLを待たせる
+    （始まった転送は止めないので、上限は目安。同時DL数ぶん超えることがある）。
+    複数スレッドから共有できる。
+    """
+
+    def __init__(self, root: str, cap_bytes: Optional[int] = DEFAULT_CAP_BYTES):
+        self.root = os.path.abspath(root)
+        self.cap_bytes = cap_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._pid = None
+        self._ensure_mover()
+
+    def _ensure_mover(self) -> None:
+        """このプロセスの移動スレッドを用意する（fork 直後の子では、親の状態を捨てて作り直す）。"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._moves: "queue.Queue[Tuple[str, str, Any]]" = queue.Queue()
+        self._pending = 0
+        self._mover = threading.Thread(target=self._run_mover, name="staging-mover", daemon=True)
+        self._mover.start()
+
+    # ---- DL側 -----------------------------------------------------------
+    def folder_for(self, video_id: str, target_folder: str) -> str:
+        """video_id の作業フォルダを用意し、移動先を書いておく。"""
+        self._ensure_mover()
+        folder = os.path.join(self.root, video_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, TARGET_FILE), "w", encoding="utf-8") as f:
+            f.write(os.path.abspath(target_folder))
+        return folder
+
+    def usage(self) -> int:
+        return _dir_size(self.root)
+
+    def admit(self) -> float:
+        """使用量が上限を下回るまで待つ。待った秒数を返す。"""
+        self._ensure_mover()
+        if not self.cap_bytes:
+            return 0.0
+        start = time.monotonic()
+        announced = False
+        with self._cond:
+            while self.usage() >= self.cap_bytes:
+                if not announced:
+                    print(f"ステージングが上限（{self.cap_bytes / 1024 ** 3:.1f} GiB）に達しているため、"
+                          "移動が進むまで新しいダウンロードを待ちます。")
+                    announced = True
+                self._cond.wait(POLL_SEC)
+        return time.monotonic() - start
+
+    def commit(self, video_id: str, *holds) -> int:
+        """
+        video_id の完成したメディアを移動待ちに積む。積んだファイル数を返す。
+        holds（utl9_1_disk_space の移動先ディスクの予約や、utl2_5_single_flight のプロセス間ロックなど
+        release() を持つもの。None は無視）は、移動し終えてから解放する。
+        """
+        holds = tuple(h for h in holds if h is not None)
+        files = []
+        try:
+            self._ensure_mover()
+            folder = os.path.join(self.root, video_id)
+            target_path = os.path.join(folder, TARGET_FILE)
+            if os.path.isfile(target_path):
+                with open(target_path, encoding="utf-8") as f:
+                    target_folder = f.read().strip()
+                files = finished_media(folder)
+        finally:
+            if not files:
+                _release(holds)
+        if not files:
+            return 0
+        with self._cond:
+            self._pending += len(files)
+        for n, path in enumerate(files):
+            # 移動は 1 本のスレッドで順に行うので、最後のファイルを移したら解放する
+            self._moves.put((path, os.path.join(target_folder, os.path.basename(path)),
+                             holds if n == len(files) - 1 else ()))
+        return len(files)
+
+    def recover(self) -> int:
+        """前回落ちたときに残った完成済みのメディアを移動待ちに積む。"""
+        count = 0
+        for folder in glob.glob(os.path.join(self.root, "*")):
+            if os.path.isdir(folder):
+                count += self.commit(os.path.basename(folder))
+        return count
+
+    def flush(self) -> None:
+        """移動待ちが無くなるまで待つ。"""
+        self._ensure_mover()
+        with self._cond:
+            while self._pending:
+                self._cond.wait()
+
+    # ---- 移動 -----------------------------------------------------------
+    def _run_mover(self) -> None:
+        while True:
+            src, dst, holds = self._moves.get()
+            try:
+                self._move(src, dst)
+            except OSError as e:
+                print(f"ステージングからの移動に失敗しました: {src} -> {dst} ({e})")
+            finally:
+                _release(holds)
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _move(src: str, dst: str) -> None:
+        if not os.path.exists(src):
+            return  # 同じファイルが 2 度積まれた（前回分の回収と重なった等）
+        folder = os.path.dirname(dst)
+        os.makedirs(folder, exist_ok=True)
+        if os.stat(src).st_dev == os.stat(folder).st_dev:
+            os.replace(src, dst)
+        else:
+            # 別デバイス: 一時名でコピーし終えてから差し替える（途中のファイルを完成品と見なさないように）
+            tmp = dst + ".moving"
+            with open(src, "rb") as fin, open(tmp, "wb") as fout:
+                shutil.copyfileobj(fin, fout, COPY_CHUNK_BYTES)
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dst)
+            os.remove(src)
+        staging_folder = os.path.dirname(src)
+        if not glob.glob(os.path.join(staging_folder, "media.*")):
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
+# プロセス内で共有する既定のステージング（None ならステージングを使わず dl/<id>/ に直接書く）
+_DEFAULT_STAGING: Optional[StagingArea] = None
+
+def default_staging() -> Optional[StagingArea]:
+    return _DEFAULT_STAGING
+
+def configure_staging(root: Optional[str], cap_bytes: Optional[int] = DEFAULT_CAP_BYTES,
+                      recover: bool = True) -> Optional[StagingArea]:
+    """
+    既定のステージングを設定する（root=None で使わない）。前回残ったメディアがあれば移し始める。
+    同じ root を複数のプロセスで使う場合、回収は 1 つ（親）だけで行い、他は recover=False にする
+    （他のプロセスがDL中・移動中のメディアを二重に移さないため）。
+    """
+    global _DEFAULT_STAGING
+    if _DEFAULT_STAGING is not None:
+        _DEFAULT_STAGING.flush()
+    _DEFAULT_STAGING = StagingArea(root, cap_bytes) if root else None
+    if _DEFAULT_STAGING is not None and recover:
+        recovered = _DEFAULT_STAGING.recover()
+        if recovered:
+            print(f"前回ステージングに残ったメディアを移動します: {recovered} 件")
+    return _DEFAULT_STAGING
@@ -1,11 +1,24 @@
 # utl2_video_downloader.py
 
+import copy
 import os
-import sys
+from contextlib import ExitStack
 from pathlib import Path
-import yt_dlp
 
-from utl2_1_format_map import FORMAT_MAP
+from utl2_1_format_map import FORMAT_MAP, fallback_chain
+from utl2_2_ydl_pool import checkout_ydl
+from utl2_3_progress_emitter import default_emitter
+from utl2_4_fragment_tuner import default_fragment_tuner
+from utl2_5_single_flight import default_single_flight
+from utl2_6_player_clients import default_client_strategy
+from utl2_7_stall_watchdog import StallDetected, default_stall_watchdog
+from utl2_8_download_failures import (
+    STAGE_DOWNLOAD, STAGE_FORMAT, STAGE_SETUP, STAGE_VALIDATE, VideoFailure, classify_failure,
+)
+from utl2_9_staging import default_staging, finished_media
+from utl8_job_ledger import video_id_from_url
+from utl9_network_governor import default_governor
+from utl9_1_disk_space import DiskFull, default_disk_guard, estimate_bytes
 
 # ---- ffmpeg のローカル検出（extractor と同じ実装） ----------------------
 REQUIRE_LOCAL_FFMPEG = False  # ← True にすると「ローカルが無ければ即エラー」
@@ -23,72 +36,356 @@ def get_local_ffmpeg_dir():
 def apply_ffmpeg_location_to_env(ffmpeg_dir: str | None):
     if not ffmpeg_dir:
         if REQUIRE_LOCAL_FFMPEG:
-            print("エラー: プロジェクト内に ffmpeg/ffprobe が見つかりません。")
-            sys.exit(1)
+            raise VideoFailure("プロジェクト内に ffmpeg/ffprobe が見つかりません。",
+                               STAGE_SETUP, "ffmpeg_missing", retryable=False)
         return
     os.environ["PATH"] = ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
 
+# ydl_opts にフック設定などを足す（progress_hooks 等のリストは上書きせず後ろに連結）
+def _merge_ydl_opts(ydl_opts, extra):
+    for key, value in extra.items():
+        if isinstance(value, list):
+            ydl_opts[key] = ydl_opts.get(key, []) + value
+        else:
+            ydl_opts[key] = value
+
+# info_dict を取った player_client（ClientStrategy が '_player_client' に入れる）を、フォーマット選択と
+# ダウンロードの extractor_args にも使う（formats の URL は取った client に紐づくため）。
+# info_dict が無い/client が分からない場合は、統計の最も良い client。
+def _player_client(info_dict=None):
+    return (info_dict or {}).get('_player_client') or default_client_strategy().ranked()[0]
+
+def _player_client_args(info_dict=None):
+    return {'youtube': {'player_client': [_player_client(info_dict)]}}
+
+# ------------------------------------------------------------------
+# ダウンロードを伴わずに動画情報だけを取得します（パイプラインの「情報抽出」段）。
+# process=False で取得した未処理の info を返すため、後段の download_video に
+# そのまま渡すとフォーマット選択とダウンロードだけが行われます。
+# 取得に失敗した場合は None を返します。
+# 同じ動画の抽出が同時に走っている場合は、その結果を受け取ります（プロセス内）。
+# player_client は utl2_6_player_clients の既定の方式で、成績の良いものから試します
+# （使った client は info_dict['_player_client']）。
+# ------------------------------------------------------------------
+def extract_video_info(video_url):
+    def extract():
+        return default_client_strategy().extract(lambda client: _extract_video_info(video_url, client))
+
+    video_id = video_id_from_url(video_url)
+    if not video_id:
+        return extract()
+    return default_single_flight().do((video_id, 'info'), extract)
+
+def _extract_video_info(video_url, player_client='tv'):
+    import yt_dlp  # 重い依存なので使う時に読み込む（起動時間対策）
+
+    ffmpeg_dir = get_local_ffmpeg_dir()
+    apply_ffmpeg_location_to_env(ffmpeg_dir)
+
+    ydl_opts = {
+        'quiet': True,
+        'skip_download': True,
+        'noplaylist': True,
+        'ignoreerrors': True,
+        'extractor_args': {
+            'youtube': {
+                # 試す順番は ClientStrategy が決める（既定: tv → web → ios → android）
+                'player_client': [player_client],
+            },
+        },
+    }
+    if ffmpeg_dir:
+        ydl_opts['ffmpeg_location'] = ffmpeg_dir
+
+    try:
+        with default_governor().connection('www.youtube.com'), checkout_ydl(ydl_opts) as ydl:
+            return ydl.extract_info(video_url, download=False, process=False)
+    except yt_dlp.utils.DownloadError as e:
+        print(f"動画情報の取得中にエラーが発生しました: {e}")
+        return None
+
+# ------------------------------------------------------------------
+# ダウンロードはせずに、format_code で選ばれるフォーマットだけを解決した info を返します。
+# info_dict は extract_video_info の結果（未処理）。手元の formats から選ぶだけなので通信はしません。
+# メディアの転送と並行してメタデータ/サムネイルを作るために使います（info_dict 自体は書き換えない）。
+# プリセットが合わなかった場合は代わりのフォーマットで解決し、その内容を 'format_fallback' に入れます。
+# 解決できなかった場合は None を返します。
+# ------------------------------------------------------------------
+def select_formats(info_dict, format_code):
+    resolved = resolve_format(info_dict, format_code)
+    return resolved[2] if resolved else None
+
+# ------------------------------------------------------------------
+# format_code のプリセットを手元の formats に当て、合わなければ utl2_1_format_map.fallback_chain の
+# 順（近い下の画質 → 近い上の画質 → 一体型 mp4 → 音声のみ）に試します。再抽出はしません。
+# Returns:
+#     tuple: (ラベル, フォーマット指定, 解決済みの info)。代わりを使った場合、info の
+#            'format_fallback' に {preset, requested, used, format, format_id} を入れる。
+#     None:  info_dict が無い/どれも合わなかった場合。
+# ------------------------------------------------------------------
+def resolve_format(info_dict, format_code):
+    if not info_dict or format_code not in FORMAT_MAP:
+        return None
+    for label, format_spec in fallback_chain(format_code, info_dict.get('formats')):
+        resolved = _select_with(info_dict, format_spec)
+        if resolved is None:
+            continue
+        if label != 'preset':
+            resolved['format_fallback'] = {
+                'preset': format_code,
+                'requested': FORMAT_MAP[format_code],
+                'used': label,
+                'format': format_spec,
+                'format_id': resolved.get('format_id'),
+            }
+        return label, format_spec, resolved
+    return None
+
+def _select_with(info_dict, format_spec):
+    import yt_dlp  # 重い依存なので使う時に読み込む（起動時間対策）
+
+    ffmpeg_dir = get_local_ffmpeg_dir()
+    apply_ffmpeg_location_to_env(ffmpeg_dir)
+
+    ydl_opts = {
+        'format': format_spec,
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'skip_download': True,
+        # 抽出に勝った player_client のまま選ぶ
+        'extractor_args': _player_client_args(info_dict),
+    }
+    if ffmpeg_dir:
+        ydl_opts['ffmpeg_location'] = ffmpeg_dir
+
+    try:
+        with checkout_ydl(ydl_opts) as ydl:
+            return ydl.process_ie_result(copy.deepcopy(info_dict), download=False)
+    except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError):
+        # このフォーマット指定に合うものが無い（download=False の選択では ExtractorError になる）
+        return None
+
+# 1 本の転送で googlevideo へ同時に張る接続の数。断片に分かれた形式（DASH/HLS）は fragments 本を並列に取り、
+# 通常の https 直リンクは 1 本（映像と音声は順に取る）。フォーマットが未解決なら多い方に見積もる。
+def _media_connections(resolved, fragments):
+    if not resolved:
+        return fragments
+    resolved_info = resolved[2]
+    for f in resolved_info.get('requested_formats') or [resolved_info]:
+        protocol = f.get('protocol') or ''
+        if 'dash' in protocol or 'm3u8' in protocol:
+            return fragments
+    return 1
+
 # ------------------------------------------------------------------
 # 指定されたYouTube動画をダウンロードし、メタデータを生成します。
+# info_dict に extract_video_info の結果を渡すと、再抽出せずにダウンロードします。
+# プリセットが合わない場合は resolve_format の代わりのフォーマットで同じ試行のままダウンロードし、
+# 置き換えた内容を戻り値の 'format_fallback' に入れます（info.json / metadata.sqlite3 に残る）。
+# progress（ProgressEmitter）を渡すと、進捗を JSON Lines で専用チャネルに出します
+# （省略時は環境変数で指定されたチャネル。無ければ出しません）。
+# 断片の同時ダウンロード数は utl2_4_fragment_tuner の既定 tuner が決め、
+# 使った段数と計測したスループットを戻り値の '_download_stats' に入れます。
+# 転送が止まった/絞られた/無応答でタイムアウトした場合は utl2_7_stall_watchdog が試行を打ち切り、
+# URL を取り直し、フォーマットも選び直して .part の続きから再開します（発生した分は戻り値の '_stall_events'）。
+# utl2_9_staging の既定のステージングが設定されていれば、転送と結合はそこで行い、完成したメディアは
+# バックグラウンドで dl/<id>/ へ移します（戻った時点ではまだ移動中のことがある。sync_videos の最後で待つ）。
+# 転送の前に、選んだフォーマットの大きさを utl9_1_disk_space の既定の guard で予約し、空きが足りなければ
+# 他のDLが終わるまで待ちます（他に予約が無いのに足りなければ、再試行しない 'disk_full' の失敗）。
+#
+# 同じ video_id × format_code のダウンロードは 1 回にまとめます（single-flight）。
+# 同じプロセス内で実行中なら、後から来た呼び出しはその結果（info_dict）を受け取り、
+# 別プロセスで実行中なら終わるまで（ステージングを使う場合は dl/<id>/ への移動が終わるまで）待ってから、
+# DL済みのファイルを使って情報だけ取り直します。
+#
+# 失敗した場合は VideoFailure（失敗した段・種類・再試行で直る見込み）を送出します。
+# プロセスは終了しないので、バッチ側でその動画だけを失敗として扱えます。
 # ------------------------------------------------------------------
-def download_video(video_url, download_dir, format_code):
+def download_video(video_url, download_dir, format_code, info_dict=None, progress=None):
+    video_id = (info_dict or {}).get('id') or video_id_from_url(video_url or '')
+    if not video_id:
+        return _download_video(video_url, download_dir, format_code, info_dict, progress)
+    return default_single_flight().do(
+        (video_id, format_code, os.path.abspath(download_dir)),
+        lambda: _download_video(video_url, download_dir, format_code, info_dict, progress),
+        lock_path=os.path.join(download_dir, 'jobs.sqlite3'),
+    )
+
+def _download_video(video_url, download_dir, format_code, info_dict=None, progress=None):
+    import yt_dlp  # 重い依存なので使う時に読み込む（起動時間対策）
+
     if not video_url:
-        print("動画URLの取得に失敗しました。")
-        sys.exit(1)
+        raise VideoFailure("動画URLの取得に失敗しました。", STAGE_VALIDATE, "invalid_url", retryable=False)
     if not ('youtube.com/' in video_url or 'youtu.be/' in video_url):
-        print(f"無効なYoutube URLです: {video_url}")
-        sys.exit(1)
+        raise VideoFailure(f"無効なYoutube URLです: {video_url}", STAGE_VALIDATE, "invalid_url",
+                           retryable=False, video_url=video_url)
 
     # --- ffmpeg の場所を決定（ローカル優先／必要なら必須化） ---
     ffmpeg_dir = get_local_ffmpeg_dir()
     apply_ffmpeg_location_to_env(ffmpeg_dir)
 
     # 1. フォーマット
-    if format_code in FORMAT_MAP:
-        selected_format = FORMAT_MAP[format_code]
-        print(f"Easy setting: 使用フォーマットコード '{format_code}' を選択")
-        print(f"選択されたフォーマット: {selected_format}")
-    else:
-        print(f"無効なフォーマットコードです: {format_code}")
-        sys.exit(1)
+    if format_code not in FORMAT_MAP:
+        raise VideoFailure(f"無効なフォーマットコードです: {format_code}", STAGE_FORMAT, "unknown_format",
+                           retryable=False, video_url=video_url)
+    selected_format = FORMAT_MAP[format_code]
+    print(f"Easy setting: 使用フォーマットコード '{format_code}' を選択")
+    # 抽出済みの formats にプリセットを当て、合わなければ代わりのフォーマットをこの試行で使う
+    # （未抽出なら先に抽出する。抽出に失敗したら従来どおり yt-dlp にプリセットのまま任せる）
+    if info_dict is None:
+        info_dict = extract_video_info(video_url)
+    resolved = resolve_format(info_dict, format_code)
+    fallback = None
+    if resolved:
+        _, selected_format, resolved_info = resolved
+        fallback = resolved_info.get('format_fallback')
+        if fallback:
+            print(f"プリセット '{format_code}' に合うフォーマットが無いため、代わりに {fallback['used']} "
+                  f"({fallback['format_id']}) を使います。")
+    print(f"選択されたフォーマット: {selected_format}")
 
     # 2. ダウンロード
     print("動画のダウンロードを開始します...")
     print(f"\n単一動画のダウンロードを開始します: {video_url}")
 
+    # 転送先: ステージングがあれば速いディスクで転送・結合し、完成したメディアだけを後で dl/<id>/ へ移す
+    # （dl/<id>/ に完成済みのメディアがあれば、yt-dlp が再DLを飛ばせるよう直接書く）
+    video_id = (info_dict or {}).get('id') or video_id_from_url(video_url)
+    staging = default_staging()
+    output_root = download_dir
+    finished = bool(video_id) and bool(finished_media(os.path.join(download_dir, video_id)))
+    if staging is not None and video_id and not finished:
+        staging.admit()  # ステージングが上限なら、移動が進むまで待つ
+        output_root = staging.root
+
+    # ディスク容量: 選んだフォーマットの大きさを共有の台帳（jobs.sqlite3）に予約してから始める
+    # （他のDLの予約と合わせて空きが足りなければ、それらが終わるまで待つ。DLが終わるか失敗したら解放）
+    reservations = ExitStack()
+    final_reservation = None  # ステージングから移す先のディスクの予約（移動が終わったら解放する）
+    if video_id and not finished:
+        disk_guard = default_disk_guard()
+        resolved_info = resolved[2] if resolved else None
+        ledger_path = os.path.join(download_dir, 'jobs.sqlite3')
+        try:
+            reservations.enter_context(disk_guard.reserve(
+                output_root, estimate_bytes(resolved_info), ledger_path, video_id))
+            os.makedirs(download_dir, exist_ok=True)
+            if output_root != download_dir and os.stat(output_root).st_dev != os.stat(download_dir).st_dev:
+                # ステージングから移す先のディスクにも、完成したメディアの分（移動はDLが戻った後なので別に持つ）
+                final_reservation = disk_guard.acquire(
+                    download_dir, estimate_bytes(resolved_info, final_only=True), ledger_path, video_id)
+        except DiskFull as e:
+            reservations.close()
+            raise classify_failure(e, video_url, STAGE_DOWNLOAD) from e
+    if output_root != download_dir:
+        staging.folder_for(video_id, os.path.join(download_dir, video_id))
+
     ydl_opts = {
         'format': selected_format,
-        'outtmpl': os.path.join(download_dir, '%(id)s', 'media.%(ext)s'),
+        'outtmpl': os.path.join(output_root, '%(id)s', 'media.%(ext)s'),
         'quiet': False,
         'no_warnings': False,
         'noplaylist': True,
-        'ignoreerrors': True,
-        'extractor_args': {
-            'youtube': {
-                # tvを優先 web/ios/androidは任意
-                'player_client': ['tv'],
-                # 'player_client': ['tv', 'web', 'ios', 'android'],
-            },
-        }
+        # 失敗の原因（429/403/非公開 等）を DownloadError で受け取って分類するため、握りつぶさない
+        'ignoreerrors': False,
+        # 抽出に勝った player_client のままDLする（未抽出なら統計の最も良い client で取り直す）
+        'extractor_args': _player_client_args(info_dict),
         # 出力拡張子を固定したい場合は有効化（必要なら）
         # 'merge_output_format': 'mp4',
     }
     if ffmpeg_dir:
         ydl_opts['ffmpeg_location'] = ffmpeg_dir
+    # 帯域制限（全ワーカー共有）・断片の同時ダウンロード数・進捗チャネルの設定を足す
+    governor = default_governor()
+    _merge_ydl_opts(ydl_opts, governor.ydl_opts())
+    tuner = default_fragment_tuner()
+    _merge_ydl_opts(ydl_opts, tuner.ydl_opts())
+    # 1 本で googlevideo の接続枠を超えないよう、断片の段数は枠の上限までにする
+    fragments = tuner.current()
+    host_limit = governor.host_limit('googlevideo.com')
+    if host_limit:
+        fragments = min(fragments, host_limit)
+    ydl_opts['concurrent_fragment_downloads'] = fragments
+    progress = progress or default_emitter()
+    if progress:
+        _merge_ydl_opts(ydl_opts, progress.ydl_opts())
+
+    watchdog = default_stall_watchdog()
+    _merge_ydl_opts(ydl_opts, watchdog.ydl_opts())
+    # 帯域制限中は意図して遅いので、低速の判定はしない（停止の判定だけ）
+    check_speed = not governor.limits()['bandwidth']
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(video_url, download=True)
-            if info_dict is None:
-                print(f"動画情報の取得に失敗しました: {video_url}")
-                sys.exit(1)
-            print(f"動画のダウンロードが完了しました: {video_url}")
-            return info_dict
-    except yt_dlp.utils.DownloadError as e:
-        # リクエストしたフォーマットが無い場合のヒントを追加
+        restarts = 0
+        while True:
+            # URL を取り直せる回数が残っている間だけ見張る（最後の試行は遅くても最後まで待つ）
+            if video_id and restarts < watchdog.max_restarts:
+                watchdog.arm(video_id, _player_client(info_dict), check_speed)
+            try:
+                # メディア本体（googlevideo）の同時接続数の枠を、この転送が同時に張る接続の数だけ使う
+                connections = _media_connections(resolved, fragments)
+                with governor.connection('googlevideo.com', connections), checkout_ydl(ydl_opts) as ydl:
+                    if info_dict is not None:
+                        result = ydl.process_ie_result(info_dict, download=True)
+                    else:
+                        result = ydl.extract_info(video_url, download=True)
+            except StallDetected:
+                result = None  # 理由は watchdog.take で受け取る
+            except yt_dlp.utils.DownloadError as e:
+                # hook が呼ばれないまま無応答でタイムアウトした試行も、見張り中なら停止として取り直す
+                if not (video_id and watchdog.trip_on_timeout(video_id, e)):
+                    raise
+                result = None
+            reason = watchdog.take(video_id) if video_id else None
+            if reason is None:
+                break
+            restarts += 1
+            tuner.discard(video_id)  # 打ち切った試行の計測は段数の判断に使わない
+            print(f"転送が{'止まった' if reason == 'stalled' else '絞られた'}ため、URLを取り直して続きから再開します"
+                  f" ({restarts}/{watchdog.max_restarts}): {video_url}")
+            # 新しい URL で同じ出力先に再開する（抽出に失敗したら download 側で URL から取り直す）
+            info_dict = extract_video_info(video_url)
+            ydl_opts['extractor_args'] = _player_client_args(info_dict)
+            # 取り直した formats でフォーマットを選び直す（合わなければ前の試行の指定のまま）
+            resolved = resolve_format(info_dict, format_code)
+            if resolved:
+                _, selected_format, resolved_info = resolved
+                fallback = resolved_info.get('format_fallback')
+                ydl_opts['format'] = selected_format
+        info_dict = result
+        if info_dict is None:
+            raise VideoFailure(f"動画情報の取得に失敗しました: {video_url}", STAGE_DOWNLOAD, "no_info",
+                               retryable=True, video_url=video_url)
+        print(f"動画のダウンロードが完了しました: {video_url}")
+        if output_root != download_dir:
+            # dl/<id>/ への移動はバックグラウンドで。移動先の予約と同じ動画のプロセス間ロックは、移し終えたら
+            # 解放される（別プロセスの同じ動画は移動が終わるまで待ち、dl/<id>/ の完成したメディアを使う）
+            staging.commit(info_dict.get('id'), final_reservation, default_single_flight().detach_lease())
+            final_reservation = None
+        stats = tuner.finish(info_dict.get('id'), fragments)
+        if stats:
+            info_dict['_download_stats'] = stats
+        if fallback:
+            info_dict['format_fallback'] = fallback
+        if restarts:
+            info_dict['_stall_events'] = watchdog.events_for(info_dict.get('id'))[-restarts:]
+        return info_dict
+    except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+        # フォーマットの選択で失敗した場合は DownloadError ではなく ExtractorError が来る
+        if video_id:
+            watchdog.disarm(video_id)
+        tuner.discard(video_id_from_url(video_url))
+        failure = classify_failure(e, video_url, STAGE_DOWNLOAD)
         print(f"ダウンロードエラー: {e}")
-        print("ヒント: 指定のフォーマット枝が存在しない可能性があります。"
-              " 一度 FORMAT_MAP['0'] を "
-              "'best[ext=mp4]' など簡易にして試すか、"
-              " --list-formats 相当で実際の提供フォーマットを確認してみてください。")
-        sys.exit(1)
+        if failure.error_class == "format_unavailable":
+            # リクエストしたフォーマットが無い場合のヒントを追加
+            print("ヒント: 指定のフォーマット枝が存在しない可能性があります。"
+                  " 一度 FORMAT_MAP['0'] を "
+                  "'best[ext=mp4]' など簡易にして試すか、"
+                  " --list-formats 相当で実際の提供フォーマットを確認してみてください。")
+        raise failure from e
+    finally:
+        reservations.close()
+        if final_reservation is not None:
+            final_reservation.release()
@@ -83,6 +83,9 @@ def create_info_json(info_dict, each_video_folder_path):
         "actual_video_quality": actual_video_quality,
         "actual_audio_quality": actual_audio_quality,
 
+        # プリセットが合わず代わりのフォーマットを使った場合の記録（使っていなければ None）
+        "format_fallback": info_dict.get('format_fallback'),
+
         # 幅・高さ
         "video_width": downloaded_video.get('width', '不明') if downloaded_video else '不明',
         "video_height": downloaded_video.get('height', '不明') if downloaded_video else '不明',
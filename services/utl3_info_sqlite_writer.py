@@ -3,7 +3,7 @@ import os
 import json
 import sqlite3
 from datetime import datetime, timedelta
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Tuple
 
 # DBパスは中央集約（dl直下）にしています。必要なら呼び出し側で上書き可。
 DEFAULT_DB_PATH = os.path.join("dl", "metadata.sqlite3")
@@ -39,6 +39,7 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
         highest_audio_quality TEXT,
         actual_video_quality  TEXT,
         actual_audio_quality  TEXT,
+        format_fallback_json  TEXT,
 
         video_width         INTEGER,
         video_height        INTEGER,
@@ -55,6 +56,10 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
         updated_at          TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now'))
     );
     """)
+    # 後から足した列（既存の DB には ALTER で追加）
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(videos)")}
+    if "format_fallback_json" not in columns:
+        conn.execute("ALTER TABLE videos ADD COLUMN format_fallback_json TEXT")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_video_id ON videos(video_id);")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_channel_id ON videos(channel_id);")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_uploader_id ON videos(uploader_id);")
@@ -124,6 +129,8 @@ def upsert_info_sqlite(
         "highest_audio_quality": highest_a,
         "actual_video_quality": f"{dl_v.get('height')}p" if dl_v and dl_v.get("height") else "不明",
         "actual_audio_quality": f"{dl_a.get('abr')}kbps" if dl_a and dl_a.get("abr") else "不明",
+        "format_fallback_json": json.dumps(info_dict["format_fallback"], ensure_ascii=False)
+                                if info_dict.get("format_fallback") else None,
 
         "video_width": (dl_v.get("width") if dl_v else None) or 0,
         "video_height": (dl_v.get("height") if dl_v else None) or 0,
@@ -138,7 +145,8 @@ def upsert_info_sqlite(
     }
 
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    # shard モードでは複数プロセスが同時に書くため、ロック待ちを長めにとる
+    conn = sqlite3.connect(db_path, timeout=30)
     try:
         # 速度/堅牢性チューニング（必要に応じて）
         conn.execute("PRAGMA journal_mode=WAL;")
@@ -162,3 +170,42 @@ def upsert_info_sqlite(
         return data["video_id"], cur.rowcount
     finally:
         conn.close()
+
+def update_columns_sqlite(
+    rows: List[Dict[str, Any]],
+    db_path: str = DEFAULT_DB_PATH
+) -> int:
+    """
+    既存行の一部の列だけをまとめて UPDATE する（メタデータのみの再取得用）。
+    rows の各要素は video_id と更新したい列の dict。値が変わった行だけを書き換える。
+    Returns: 実際に変更された行数
+    """
+    if not rows:
+        return 0
+
+    # 列の組ごとに executemany でまとめる
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        columns = tuple(sorted(k for k in row if k != "video_id"))
+        if columns:
+            groups.setdefault(columns, []).append(row)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        changed = 0
+        with conn:
+            for columns, group in groups.items():
+                sets    = ", ".join(f"{c}=:{c}" for c in columns)
+                differs = " OR ".join(f"{c} IS NOT :{c}" for c in columns)
+                sql = f"""
+                UPDATE videos SET {sets}, updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+                WHERE video_id=:video_id AND ({differs});
+                """
+                before = conn.total_changes
+                conn.executemany(sql, group)
+                changed += conn.total_changes - before
+        return changed
+    finally:
+        conn.close()
@@ -1,14 +1,20 @@
 # utl4_thumbnail_downloader.py  — code2 改良版（高速 + 640x480取りこぼし防止）
 import os
-from typing import Optional, Dict, Any, List, Tuple
-import requests
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple
+
+from utl9_network_governor import default_governor
+
+if TYPE_CHECKING:
+    import requests
 
 # 既知の解像度順（大→小）
 JPG_ORDER = ["maxresdefault", "sddefault", "hqdefault", "mqdefault", "default"]
 ENABLE_WEBP_FALLBACK = True
 BIGGER_THAN_DEFAULT_RATIO = 1.2
 
-def _session() -> requests.Session:
+def _session() -> "requests.Session":
+    import requests  # 重い依存なので使う時に読み込む（起動時間対策）
+
     s = requests.Session()
     s.headers.update({"User-Agent": "Mozilla/5.0 (compatible; ThumbnailFetcher/1.1)"})
     return s
@@ -30,9 +36,12 @@ def _webp_candidates(video_id: str) -> List[str]:
     base = f"https://i.ytimg.com/vi_webp/{video_id}"
     return [f"{base}/{name}.webp" for name in JPG_ORDER]
 
-def _head_len(sess: requests.Session, url: str, timeout: int = 6) -> Optional[int]:
+def _head_len(sess: "requests.Session", url: str, timeout: int = 6) -> Optional[int]:
+    import requests
+
     try:
-        r = sess.head(url, timeout=timeout, allow_redirects=True)
+        with default_governor().connection(url):
+            r = sess.head(url, timeout=timeout, allow_redirects=True)
         if r.status_code == 200:
             cl = r.headers.get("Content-Length")
             return int(cl) if cl and cl.isdigit() else None
@@ -40,9 +49,14 @@ def _head_len(sess: requests.Session, url: str, timeout: int = 6) -> Optional[in
         pass
     return None
 
-def _get_bytes(sess: requests.Session, url: str, timeout: int = 10) -> Optional[bytes]:
+def _get_bytes(sess: "requests.Session", url: str, timeout: int = 10) -> Optional[bytes]:
+    import requests
+
+    governor = default_governor()
     try:
-        r = sess.get(url, timeout=timeout, stream=False)
+        with governor.connection(url):
+            r = sess.get(url, timeout=timeout, stream=False)
+        governor.consume(len(r.content))
         if r.status_code == 200 and r.content:
             return r.content
     except requests.RequestException:
@@ -50,7 +64,7 @@ def _get_bytes(sess: requests.Session, url: str, timeout: int = 10) -> Optional[
     return None
 
 def _try_upgrade_to_sd_or_maxres(
-    sess: requests.Session,
+    sess: "requests.Session",
     vid: str,
     baseline_len: Optional[int],
 ) -> Optional[str]:
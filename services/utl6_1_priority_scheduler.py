@@ -0,0 +1,97 @@
+# utl6_1_priority_scheduler.py
+
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator
+
+# 優先度クラス
+INTERACTIVE = "interactive"  # UI から貼られた単一動画など、ユーザーが待っているもの
+BULK = "bulk"                # チャンネル/再生リストの一括同期
+PRIORITIES = (INTERACTIVE, BULK)
+
+class PriorityScheduler:
+    """
+    動画 1 本ぶんの処理枠（slot）を、interactive と bulk の 2 クラスで配る。
+
+      - interactive は待っている bulk より先に枠をもらう（割り込み）
+      - 枠が全部 bulk で埋まっていても、interactive は burst 本まで定員を超えて借りられる
+        （bulk の実行中の動画は止めずに、次の 1 本を遅らせる）
+      - bulk が待っている間は、bulk_reserved 本ぶんの枠を interactive に使わせない（飢餓防止）
+    同じクラスの中は先着順。capacity などは実行中でも変更できる。
+    """
+
+    def __init__(self, capacity: int = 2, bulk_reserved: int = 1, interactive_burst: int = 1):
+        self._cond = threading.Condition()
+        self.capacity = capacity
+        self.bulk_reserved = bulk_reserved
+        self.interactive_burst = interactive_burst
+        self._active: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._waiting: Dict[str, Deque[int]] = {p: deque() for p in PRIORITIES}
+        self._tickets = itertools.count()
+        self.granted: Dict[str, int] = {p: 0 for p in PRIORITIES}  # 計測用: 配った枠の数
+
+    def configure(self, capacity: int | None = None, bulk_reserved: int | None = None,
+                  interactive_burst: int | None = None) -> None:
+        with self._cond:
+            if capacity is not None:
+                self.capacity = max(1, capacity)
+            if bulk_reserved is not None:
+                self.bulk_reserved = max(0, bulk_reserved)
+            if interactive_burst is not None:
+                self.interactive_burst = max(0, interactive_burst)
+            self._cond.notify_all()
+
+    def _may_start(self, priority: str, ticket: int) -> bool:
+        if self._waiting[priority][0] != ticket:
+            return False  # 同じクラスの先客がいる
+        total = self._active[INTERACTIVE] + self._active[BULK]
+        ceiling = self.capacity + self.interactive_burst
+        bulk_active = self._active[BULK]
+        if priority == INTERACTIVE:
+            reserve = max(0, self.bulk_reserved - bulk_active) if self._waiting[BULK] else 0
+            return total + reserve < ceiling
+        if bulk_active < self.bulk_reserved:
+            return total < ceiling
+        return total < self.capacity and not self._waiting[INTERACTIVE]
+
+    @contextmanager
+    def slot(self, priority: str = BULK) -> Iterator[None]:
+        if priority not in PRIORITIES:
+            raise ValueError(f"無効な優先度です: {priority} (interactive / bulk のいずれか)")
+        with self._cond:
+            ticket = next(self._tickets)
+            self._waiting[priority].append(ticket)
+            try:
+                while not self._may_start(priority, ticket):
+                    self._cond.wait()
+            finally:
+                self._waiting[priority].remove(ticket)
+            self._active[priority] += 1
+            self.granted[priority] += 1
+            self._cond.notify_all()  # 同じクラスの次の先頭を起こす
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[priority] -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "bulk_reserved": self.bulk_reserved,
+                "interactive_burst": self.interactive_burst,
+                "active": dict(self._active),
+                "waiting": {p: len(q) for p, q in self._waiting.items()},
+                "granted": dict(self.granted),
+            }
+
+def with_slot(func: Callable[..., Any], scheduler: PriorityScheduler, priority: str) -> Callable[..., Any]:
+    """func を 1 回呼ぶごとに scheduler の枠を 1 つ使うようにする（スレッド用。pickle はできない）。"""
+    def run(*args, **kwargs):
+        with scheduler.slot(priority):
+            return func(*args, **kwargs)
+    return run
@@ -0,0 +1,182 @@
+# utl6_2_retry_queue.py
+
+import random
+import threading
+import time
+from collections import deque
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utl2_8_download_failures import classify_failure
+
+# 再試行: 本処理を含めた 1 本あたりの試行回数と、再試行の周回ごとの待ち時間（倍々、上限あり）
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY_SEC = 5.0
+DEFAULT_MAX_DELAY_SEC = 300.0
+
+# サーキットブレーカー: window_sec 秒の間に 429/403 が threshold 回あったら、新しい動画の投入を
+# cooldown_sec 秒止める（続けて開いたら倍にする。上限 max_cooldown_sec）
+BREAKER_ERROR_CLASSES = ("http_429", "http_403")
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_WINDOW_SEC = 60.0
+DEFAULT_BREAKER_COOLDOWN_SEC = 120.0
+DEFAULT_BREAKER_MAX_COOLDOWN_SEC = 1800.0
+
+def _url_of(item: Any) -> Optional[str]:
+    if isinstance(item, tuple):
+        return item[0]
+    if isinstance(item, dict):
+        return item.get("video_url")
+    return item if isinstance(item, str) else None
+
+# ------------------------------------------------------------------
+# func(item) を呼び、例外はその動画の失敗 {'video_url', 'failure': VideoFailure.to_dict()} にして返します。
+# プロセスモードでも使えるよう、モジュール直下の関数と dict だけでやり取りします（pickle 可能）。
+# ctrl+c（KeyboardInterrupt）はバッチの中断なので、そのまま送出します。
+# ------------------------------------------------------------------
+def run_isolated(func: Callable[[Any], Any], item: Any) -> Any:
+    try:
+        return func(item)
+    except Exception as e:
+        failure = classify_failure(e, _url_of(item))
+        return {"video_url": failure.video_url, "failure": failure.to_dict()}
+
+def isolated(func: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """run_isolated を通す形にした func（pickle 可能）。"""
+    return partial(run_isolated, func)
+
+def failure_of(result: Any) -> Optional[Dict[str, Any]]:
+    """run_isolated の戻り値が失敗ならその内容、成功なら None。"""
+    return result.get("failure") if isinstance(result, dict) else None
+
+class CircuitBreaker:
+    """
+    429/403 が短時間に続いたら、新しい動画の投入をしばらく止める。
+    実行中の動画はそのまま走らせ、wait() を呼んだ側（投入側）だけが待つ。複数スレッドから共有できる。
+    """
+
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, window_sec: float = DEFAULT_BREAKER_WINDOW_SEC,
+                 cooldown_sec: float = DEFAULT_BREAKER_COOLDOWN_SEC,
+                 max_cooldown_sec: float = DEFAULT_BREAKER_MAX_COOLDOWN_SEC):
+        self.threshold = threshold
+        self.window_sec = window_sec
+        self.cooldown_sec = cooldown_sec
+        self.max_cooldown_sec = max_cooldown_sec
+        self._lock = threading.Lock()
+        self._recent: Deque[float] = deque()
+        self._open_until = 0.0
+        self._trips = 0  # 成功を挟まずに開いた回数（待ち時間の倍率）
+
+    def record(self, failure: Optional[Dict[str, Any]]) -> None:
+        """1 本の結果を記録する（成功なら None）。"""
+        now = time.monotonic()
+        with self._lock:
+            if failure is None:
+                if now >= self._open_until:
+                    self._trips = 0
+                return
+            if failure.get("error_class") not in BREAKER_ERROR_CLASSES:
+                return
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > self.window_sec:
+                self._recent.popleft()
+            if len(self._recent) < self.threshold or now < self._open_until:
+                return
+            cooldown = min(self.max_cooldown_sec, self.cooldown_sec * (2 ** self._trips))
+            self._trips += 1
+            self._open_until = now + cooldown
+            self._recent.clear()
+        print(f"HTTP 429/403 が続いたため、新しい動画の投入を {cooldown:.0f} 秒止めます。")
+
+    def remaining(self) -> float:
+        """投入を再開するまでの秒数（閉じていれば 0）。"""
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic())
+
+    def wait(self, cancel_event: Optional[threading.Event] = None) -> bool:
+        """閉じるまで待つ。待っている間にキャンセルされたら False。"""
+        while True:
+            remaining = self.remaining()
+            if remaining <= 0:
+                return not (cancel_event is not None and cancel_event.is_set())
+            if cancel_event is not None:
+                if cancel_event.wait(remaining):
+                    return False
+            else:
+                time.sleep(remaining)
+
+    def admit(self, items: Iterable[Any], cancel_event: Optional[threading.Event] = None) -> Iterator[Any]:
+        """items を 1 件ずつ、ブレーカーが閉じているときだけ流す（キャンセルされたら打ち切る）。"""
+        for item in items:
+            if not self.wait(cancel_event):
+                return
+            yield item
+
+class RetryQueue:
+    """
+    失敗した動画を本処理の後で再試行するための待ち行列。
+    再試行で直る見込みの無い失敗（非公開・フォーマット無し等）と、試行回数を使い切ったものは given_up に残す。
+    """
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay_sec: float = DEFAULT_BASE_DELAY_SEC,
+                 max_delay_sec: float = DEFAULT_MAX_DELAY_SEC):
+        self.max_attempts = max_attempts
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self._lock = threading.Lock()
+        self._items: List[Tuple[Any, Dict[str, Any], int]] = []
+        self.given_up: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: Any, failure: Dict[str, Any], attempts: int = 1) -> bool:
+        """失敗を記録する。再試行の対象にしたら True。"""
+        with self._lock:
+            if failure.get("retryable") and attempts < self.max_attempts:
+                self._items.append((item, failure, attempts))
+                return True
+            self.given_up.append(dict(failure, attempts=attempts))
+            return False
+
+    def replay(self, func: Callable[[Any], Any], breaker: Optional[CircuitBreaker] = None,
+               cancel_event: Optional[threading.Event] = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        待ち行列を周回ごとに待ち時間を倍にしながら再試行し、成功した (item, result) を返す。
+        再び失敗したものは次の周回へ回し、試行回数を使い切ったら given_up に移す。
+        """
+        rounds = 0
+        while self._items:
+            with self._lock:
+                items, self._items = self._items, []
+            delay = min(self.max_delay_sec, self.base_delay_sec * (2 ** rounds)) * random.uniform(0.8, 1.2)
+            rounds += 1
+            print(f"\n失敗した {len(items)} 本を {delay:.0f} 秒後に再試行します（{rounds} 周目）")
+            if cancel_event is not None:
+                cancelled = cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+                cancelled = False
+            for n, (item, failure, attempts) in enumerate(items):
+                if cancelled or (breaker is not None and not breaker.wait(cancel_event)):
+                    # 中断: 残りは再試行せずに失敗として残す
+                    self.given_up.extend(dict(f, attempts=a) for _, f, a in items[n:])
+                    with self._lock:
+                        self.given_up.extend(dict(f, attempts=a) for _, f, a in self._items)
+                        self._items = []
+                    return
+                result = run_isolated(func, item)
+                failure = failure_of(result)
+                if breaker is not None:
+                    breaker.record(failure)
+                if failure is None:
+                    yield item, result
+                else:
+                    print(f"【FAILED】URL={_url_of(item)} (再試行 {attempts} 回目: {failure['message']})")
+                    self.add(item, failure, attempts + 1)
+
+# プロセス内で共有する既定のブレーカー（429/403 は接続元 IP 単位なので、ジョブをまたいで共有する）
+_DEFAULT_BREAKER = CircuitBreaker()
+
+def default_circuit_breaker() -> CircuitBreaker:
+    return _DEFAULT_BREAKER
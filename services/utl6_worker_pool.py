@@ -0,0 +1,78 @@
+# utl6_worker_pool.py
+
+import concurrent.futures
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+# 実行モード（スレッド or プロセス）
+WORKER_MODES = ("thread", "process")
+
+def _make_executor(workers: int, mode: str, initializer: Optional[Callable[..., Any]] = None,
+                   initargs: Tuple[Any, ...] = ()) -> concurrent.futures.Executor:
+    if mode == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-worker")
+    if mode == "process":
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    raise ValueError(f"無効な実行モードです: {mode} (thread / process のいずれか)")
+
+# ------------------------------------------------------------------
+# items の各要素に func を N 並列で適用し、入力順に (item, result) を返します。
+#
+# Parameters:
+#     func (callable): 1 件分の処理。process モードでは pickle 可能な関数であること。
+#     items (iterable): 処理対象。ジェネレータでもよい（必要な分だけ先読みする）。
+#     workers (int): 同時実行数。1 以下なら従来どおり呼び出し元スレッドで順次実行。
+#     mode (str): 'thread' または 'process'。
+#     max_pending (int): 投入済み・未報告の件数の上限（有界キュー）。既定は workers * 2。
+#     initializer (callable): process モードで、各子プロセスの起動時に initializer(*initargs) を呼ぶ
+#         （親で行った設定は spawn の子には引き継がれないため）。pickle 可能であること。
+#
+# Yields:
+#     tuple: (item, result)。func 内の例外は報告順が来た時点で呼び出し元に再送出される。
+# ------------------------------------------------------------------
+def run_ordered(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    workers: int = 1,
+    mode: str = "thread",
+    max_pending: int | None = None,
+    initializer: Optional[Callable[..., Any]] = None,
+    initargs: Tuple[Any, ...] = (),
+) -> Iterator[Tuple[Any, Any]]:
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    if max_pending is None:
+        max_pending = workers * 2
+    max_pending = max(max_pending, workers)
+
+    executor = _make_executor(workers, mode, initializer, initargs)
+    pending: deque = deque()
+    completed = False
+    try:
+        source = iter(items)
+        exhausted = False
+        while True:
+            # 有界キューが埋まるまで投入（items は遅延評価のまま）
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    item = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, executor.submit(func, item)))
+
+            if not pending:
+                break
+
+            # 完了順ではなく投入順に報告する
+            item, future = pending.popleft()
+            yield item, future.result()
+        completed = True
+    finally:
+        # 中断（ctrl+c や例外）時は未着手の分を捨て、実行中の完了は待たずに戻る
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=completed, cancel_futures=True)
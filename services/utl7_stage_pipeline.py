@@ -0,0 +1,148 @@
+# utl7_stage_pipeline.py
+
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List
+
+# キューの終端を表す番兵
+_END = object()
+# 停止確認の間隔（秒）。put/get をこの単位で区切って stop を確認する
+_POLL_SEC = 0.2
+
+@dataclass
+class Stage:
+    """
+    パイプラインの 1 段。
+    func が None を返した要素は後段に流さない（SKIP 扱い）。
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 4  # この段の入力キューの上限（満杯なら前段がブロック = バックプレッシャー）
+
+class _Failure:
+    def __init__(self, stage_name: str, exc: BaseException):
+        self.stage_name = stage_name
+        self.exc = exc
+
+# ------------------------------------------------------------------
+# 段ごとに独立したキューとワーカー数を持つ producer/consumer パイプライン。
+# 例: 列挙 → 情報抽出(4) → メディアDL(2) → メタデータ/サムネ/タイトル(2)
+# 各段はスレッドで動くため、ネットワーク待ちの段どうしが重なって動き、
+# 全体のスループットは「各段の合計」ではなく「一番遅い段」で決まる。
+# ------------------------------------------------------------------
+class Pipeline:
+    def __init__(self, stages: List[Stage]):
+        if not stages:
+            raise ValueError("stages が空です")
+        self.stages = stages
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SEC)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SEC)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, source: Iterable[Any], q_in: queue.Queue, q_out: queue.Queue) -> None:
+        try:
+            for seq, item in enumerate(source):
+                if not self._put(q_in, (seq, item)):
+                    return
+        except BaseException as e:  # 列挙自体の失敗も呼び出し元へ
+            self._put(q_out, (-1, _Failure("source", e)))
+        finally:
+            self._put(q_in, _END)
+
+    def _work(self, stage: Stage, q_in: queue.Queue, q_next: queue.Queue, q_out: queue.Queue,
+              remaining: List[int], lock: threading.Lock) -> None:
+        try:
+            while True:
+                packet = self._get(q_in)
+                if packet is _END:
+                    # 同じ段の他ワーカーにも終端を伝える
+                    self._put(q_in, _END)
+                    return
+                seq, item = packet
+                try:
+                    result = stage.func(item)
+                except BaseException as e:
+                    self._put(q_out, (seq, _Failure(stage.name, e)))
+                    continue
+                if result is None:
+                    self._put(q_out, (seq, None))
+                    continue
+                self._put(q_next, (seq, result))
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                # この段の最後のワーカーが後段に終端を流す
+                self._put(q_next, _END)
+
+    # ------------------------------------------------------------------
+    # source を流し込み、最終段の結果を返します。
+    #
+    # Yields:
+    #     tuple: (seq, result)。seq は source 内の 0 始まりの位置。
+    #            result が None の要素は途中の段で SKIP されたもの。
+    #     ordered=True なら seq 順に並べ直して返す（並べ直しの待ちは投入済みの件数までで有界）。
+    # Raises:
+    #     各段の func が送出した例外は、その要素の報告時点で再送出される。
+    # ------------------------------------------------------------------
+    def run(self, source: Iterable[Any], ordered: bool = False) -> Iterator[Any]:
+        queues = [queue.Queue(maxsize=max(1, s.queue_size)) for s in self.stages]
+        q_out: queue.Queue = queue.Queue()
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0], q_out),
+                                    name="pipeline-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            q_next = queues[i + 1] if i + 1 < len(self.stages) else q_out
+            remaining = [max(1, stage.workers)]
+            lock = threading.Lock()
+            for n in range(remaining[0]):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], q_next, q_out, remaining, lock),
+                    name=f"pipeline-{stage.name}-{n}", daemon=True))
+        for t in threads:
+            t.start()
+
+        try:
+            next_seq = 0
+            held = {}
+            while True:
+                packet = self._get(q_out)
+                if packet is _END:
+                    break
+                seq, result = packet
+                if isinstance(result, _Failure):
+                    raise result.exc
+                if not ordered:
+                    yield seq, result
+                    continue
+                held[seq] = result
+                while next_seq in held:
+                    yield next_seq, held.pop(next_seq)
+                    next_seq += 1
+            # 途中で SKIP された番号があっても残りは全て返す
+            for seq in sorted(held):
+                yield seq, held[seq]
+        finally:
+            self.stop()
+            for t in threads:
+                t.join(timeout=_POLL_SEC * 2)
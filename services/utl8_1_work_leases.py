@@ -0,0 +1,300 @@
+# utl8_1_work_leases.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utl8_job_ledger import DEFAULT_LEDGER_PATH, video_id_from_url
+
+# リース（作業の借り受け）の有効期限（秒）。ハートビートが途絶えてこれを過ぎると他のワーカーが引き取る
+DEFAULT_LEASE_SEC = 120
+# 1 本あたりの試行回数の上限（ワーカーのクラッシュで引き取られた分も数える）
+MAX_ATTEMPTS = 3
+# 取れる作業が無いときの待ち間隔（秒）
+IDLE_POLL_SEC = 1.0
+
+# 作業の状態
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATES = (DONE, FAILED, CANCELLED)
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS work_sources (
+        source_url   TEXT PRIMARY KEY,
+        closed       INTEGER NOT NULL DEFAULT 0,
+        updated_at   TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now'))
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS work_items (
+        source_url   TEXT NOT NULL,
+        video_id     TEXT NOT NULL,
+        seq          INTEGER NOT NULL,
+        video_url    TEXT NOT NULL,
+        state        TEXT NOT NULL DEFAULT 'pending',
+        owner        TEXT,
+        lease_until  REAL,
+        attempts     INTEGER NOT NULL DEFAULT 0,
+        result_json  TEXT,
+        error        TEXT,
+        updated_at   TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now')),
+        PRIMARY KEY (source_url, video_id)
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_work_items_claim ON work_items(source_url, state, seq);")
+
+class WorkLeaseQueue:
+    """
+    複数のワーカープロセスで 1 つのジョブ（チャンネル等）を分担するための、SQLite 上の作業表。
+
+    ワーカーは claim() で 1 本ずつ期限付きで借り受け（リース）、処理中は heartbeat() で延長する。
+    クラッシュしたワーカーのリースは期限切れになり、他のワーカーの claim() で自動的に引き取られる。
+    claim は BEGIN IMMEDIATE の中で行うため、同じ動画を 2 つのワーカーが同時に処理することは無い。
+    JobLedger と同じ dl/jobs.sqlite3 に表を作る。プロセス間では ledger_path だけ渡せばよい。
+    """
+
+    def __init__(self, ledger_path: str = DEFAULT_LEDGER_PATH, lease_sec: float = DEFAULT_LEASE_SEC,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.ledger_path = ledger_path
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(ledger_path) or ".", exist_ok=True)
+        self._conn()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_local")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: トランザクションは BEGIN IMMEDIATE を明示して張る
+            conn = sqlite3.connect(self.ledger_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            _ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, args: Tuple = ()) -> sqlite3.Cursor:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(sql, args)
+            conn.execute("COMMIT")
+            return cur
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---- 投入（親プロセス） ------------------------------------------------
+    def open_source(self, source_url: str) -> None:
+        """source_url の作業表を作り直す（前回の分は消す）。close_source まで投入中とみなす。"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM work_items WHERE source_url=?", (source_url,))
+            conn.execute("""
+                INSERT INTO work_sources (source_url, closed) VALUES (?, 0)
+                ON CONFLICT(source_url) DO UPDATE SET closed=0,
+                    updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            """, (source_url,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add(self, source_url: str, seq: int, video_url: str) -> Optional[str]:
+        video_id = video_id_from_url(video_url)
+        if not video_id:
+            return None
+        self._write(
+            "INSERT OR IGNORE INTO work_items (source_url, video_id, seq, video_url) VALUES (?, ?, ?, ?)",
+            (source_url, video_id, seq, video_url))
+        return video_id
+
+    def close_source(self, source_url: str) -> None:
+        """投入が終わったことを記録する。以降、作業が尽きたワーカーは終了する。"""
+        self._write("UPDATE work_sources SET closed=1 WHERE source_url=?", (source_url,))
+
+    def cancel_pending(self, source_url: str) -> int:
+        """未着手の作業を取り消す（処理中の分はそのまま最後まで）。"""
+        self.close_source(source_url)
+        cur = self._write("UPDATE work_items SET state=? WHERE source_url=? AND state=?",
+                          (CANCELLED, source_url, PENDING))
+        return cur.rowcount
+
+    # ---- ワーカー ------------------------------------------------------------
+    def claim(self, source_url: str, owner: str) -> Optional[Tuple[str, str]]:
+        """
+        未着手（または期限切れリース）の作業を seq 順に 1 本借りる。(video_id, video_url) を返す。
+        試行回数の上限に達した期限切れの作業は failed にする。取れる作業が無ければ None。
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                UPDATE work_items SET state=?, owner=NULL, error='リース切れ（試行回数の上限）'
+                WHERE source_url=? AND state=? AND lease_until < ? AND attempts >= ?
+            """, (FAILED, source_url, LEASED, now, self.max_attempts))
+            row = conn.execute("""
+                SELECT video_id, video_url, state, owner FROM work_items
+                WHERE source_url=? AND (state=? OR (state=? AND lease_until < ?))
+                ORDER BY seq LIMIT 1
+            """, (source_url, PENDING, LEASED, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            video_id, video_url, state, previous_owner = row
+            conn.execute("""
+                UPDATE work_items SET state=?, owner=?, lease_until=?, attempts=attempts+1,
+                    updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+                WHERE source_url=? AND video_id=?
+            """, (LEASED, owner, now + self.lease_sec, source_url, video_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if state == LEASED:
+            print(f"期限切れのリースを引き取りました: ID={video_id} (前のワーカー: {previous_owner})")
+        return video_id, video_url
+
+    def claim_batch(self, source_url: str, owner: str, limit: int) -> List[Tuple[str, str]]:
+        """owner の借りている件数が limit になるまで claim する（リモートワーカー用）。"""
+        held = self._conn().execute("SELECT COUNT(*) FROM work_items WHERE owner=? AND state=?",
+                                    (owner, LEASED)).fetchone()[0]
+        claimed = []
+        for _ in range(max(0, limit - held)):
+            item = self.claim(source_url, owner)
+            if item is None:
+                break
+            claimed.append(item)
+        return claimed
+
+    def counts(self, source_url: str) -> Dict[str, int]:
+        """状態ごとの件数。"""
+        rows = self._conn().execute(
+            "SELECT state, COUNT(*) FROM work_items WHERE source_url=? GROUP BY state", (source_url,))
+        return dict(rows.fetchall())
+
+    def heartbeat(self, owner: str) -> int:
+        """owner が借りている作業のリースを延長する。延長できた件数を返す。"""
+        cur = self._write("UPDATE work_items SET lease_until=? WHERE owner=? AND state=?",
+                          (time.time() + self.lease_sec, owner, LEASED))
+        return cur.rowcount
+
+    def complete(self, source_url: str, video_id: str, owner: str, result: Any) -> bool:
+        """
+        作業の完了を記録する。リースを失っていた（他のワーカーに引き取られた）場合は False。
+        """
+        cur = self._write("""
+            UPDATE work_items SET state=?, result_json=?, owner=NULL, lease_until=NULL,
+                updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            WHERE source_url=? AND video_id=? AND owner=? AND state=?
+        """, (DONE, json.dumps(result, ensure_ascii=False), source_url, video_id, owner, LEASED))
+        return cur.rowcount == 1
+
+    def fail(self, source_url: str, video_id: str, owner: str, error: str) -> None:
+        self._write("""
+            UPDATE work_items SET state=?, error=?, owner=NULL, lease_until=NULL,
+                updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            WHERE source_url=? AND video_id=? AND owner=? AND state=?
+        """, (FAILED, error, source_url, video_id, owner, LEASED))
+
+    def finished(self, source_url: str) -> bool:
+        """投入が終わり、全作業が終端状態（done/failed/cancelled）なら True。"""
+        conn = self._conn()
+        closed = conn.execute("SELECT closed FROM work_sources WHERE source_url=?", (source_url,)).fetchone()
+        if not closed or not closed[0]:
+            return False
+        placeholders = ", ".join("?" for _ in TERMINAL_STATES)
+        remaining = conn.execute(
+            f"SELECT COUNT(*) FROM work_items WHERE source_url=? AND state NOT IN ({placeholders})",
+            (source_url, *TERMINAL_STATES)).fetchone()[0]
+        return remaining == 0
+
+    # ---- 結果（親プロセス） ------------------------------------------------
+    def results_from(self, source_url: str, seq: int) -> List[Tuple[int, str, str, Optional[Dict[str, Any]], Optional[str]]]:
+        """
+        seq 以降で、途切れずに終端状態になっている作業を seq 順に返す（入力順の報告用）。
+        各要素は (seq, state, video_url, result, error)。
+        """
+        rows = self._conn().execute("""
+            SELECT seq, state, video_url, result_json, error FROM work_items
+            WHERE source_url=? AND seq >= ? ORDER BY seq
+        """, (source_url, seq)).fetchall()
+        ready = []
+        for row_seq, state, video_url, result_json, error in rows:
+            if state not in TERMINAL_STATES:
+                break
+            ready.append((row_seq, state, video_url, json.loads(result_json) if result_json else None, error))
+        return ready
+
+# ------------------------------------------------------------------
+# ワーカープロセス 1 つ分のループ: 借りる → func(video_url) → 完了/失敗を記録、を作業が尽きるまで繰り返す。
+# 処理中は別スレッドで lease_sec / 3 ごとにハートビートを送る。
+# func は pickle 可能で、JSON にできる結果を返すこと。例外はその動画の失敗として記録する。
+# ------------------------------------------------------------------
+def run_lease_worker(queue: WorkLeaseQueue, source_url: str, func: Callable[[str], Any],
+                     owner: Optional[str] = None) -> int:
+    owner = owner or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(queue.lease_sec / 3):
+            queue.heartbeat(owner)
+
+    beater = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+    beater.start()
+    processed = 0
+    try:
+        while True:
+            claimed = queue.claim(source_url, owner)
+            if claimed is None:
+                if queue.finished(source_url):
+                    return processed
+                time.sleep(IDLE_POLL_SEC)  # 投入待ち、または他のワーカーのリース切れ待ち
+                continue
+            video_id, video_url = claimed
+            try:
+                result = func(video_url)
+            except BaseException as e:
+                if isinstance(e, KeyboardInterrupt):
+                    raise  # リースは期限切れで他のワーカーが引き取る
+                queue.fail(source_url, video_id, owner, f"{type(e).__name__}: {e}")
+                continue
+            if not queue.complete(source_url, video_id, owner, result):
+                print(f"リースを失っていたため完了を記録しませんでした: ID={video_id}")
+            processed += 1
+    finally:
+        stop.set()
+
+def iter_lease_results(queue: WorkLeaseQueue, source_url: str, is_done: Callable[[], bool],
+                       poll_sec: float = IDLE_POLL_SEC) -> Iterator[Tuple[int, str, str, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    完了した作業を seq 順に返す（親プロセスでの報告用）。is_done() が True になり、
+    その時点までの結果を出し切ったら終わる。
+    """
+    next_seq = 0
+    while True:
+        finished = is_done()
+        for row in queue.results_from(source_url, next_seq):
+            next_seq = row[0] + 1
+            yield row
+        if finished:
+            return
+        time.sleep(poll_sec)
@@ -0,0 +1,159 @@
+# utl8_2_remote_queue.py
+#
+# 複数マシンで 1 つのダウンロード待ち行列を消化するための、コーディネーターとワーカーの通信部分。
+# TCP 上で 1 行 1 メッセージの JSON-RPC 2.0 を話す（ttl_worker_daemon と同じ形式）。
+#
+#   → {"jsonrpc":"2.0","id":1,"method":"claim","params":{"worker_id":"host-a-1234","limit":4}}
+#   ← {"jsonrpc":"2.0","id":1,"result":{"videos":[{"video_id":"...","video_url":"..."}],"finished":false}}
+#
+# メソッド: claim / heartbeat / complete / fail / status
+# 認証も暗号化も無いので、信頼できるローカルネットワーク内だけで使うこと。
+
+import json
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from utl8_1_work_leases import WorkLeaseQueue
+
+# 既定の待ち受け（同じマシンで試すときはこのまま）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 1 ワーカーに同時に貸し出す動画数の上限
+MAX_BATCH = 8
+
+class RemoteQueueError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                result = self.server.coordinator.dispatch(request.get("method"), request.get("params") or {})
+                response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+            except RemoteQueueError as e:
+                response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+            except Exception as e:
+                response = {"jsonrpc": "2.0", "id": request_id,
+                            "error": {"code": -32603, "message": f"{type(e).__name__}: {e}"}}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Coordinator:
+    """
+    待ち行列（WorkLeaseQueue）とライブラリ索引を持ち、リモートワーカーに動画をまとめて貸し出す。
+    ワーカーから届いたメタデータは on_complete(info_dict) で中央の索引に取り込む。
+    リースの仕組みは shard モードと同じなので、落ちたワーカーの分は期限切れ後に他へ回る。
+    """
+
+    def __init__(self, queue: WorkLeaseQueue, source_url: str,
+                 on_complete: Callable[[Dict[str, Any]], None], max_batch: int = MAX_BATCH):
+        self.queue = queue
+        self.source_url = source_url
+        self.on_complete = on_complete
+        self.max_batch = max_batch
+        self._server: Optional[_Server] = None
+
+    # ---- メソッド --------------------------------------------------------
+    def claim(self, worker_id, limit=1):
+        limit = max(1, min(int(limit), self.max_batch))
+        videos = [{"video_id": video_id, "video_url": video_url}
+                  for video_id, video_url in self.queue.claim_batch(self.source_url, worker_id, limit)]
+        return {"videos": videos, "finished": not videos and self.queue.finished(self.source_url),
+                "lease_sec": self.queue.lease_sec}
+
+    def heartbeat(self, worker_id):
+        return {"extended": self.queue.heartbeat(worker_id)}
+
+    def complete(self, worker_id, video_id, info, result=None):
+        # リースを失っていた（他のワーカーに回った）分は取り込まない
+        if not self.queue.complete(self.source_url, video_id, worker_id, result or {}):
+            return {"accepted": False}
+        self.on_complete(info)
+        return {"accepted": True}
+
+    def fail(self, worker_id, video_id, error):
+        self.queue.fail(self.source_url, video_id, worker_id, error)
+        return {"recorded": True}
+
+    def status(self):
+        return {"source_url": self.source_url, "counts": self.queue.counts(self.source_url),
+                "finished": self.queue.finished(self.source_url)}
+
+    def dispatch(self, method, params):
+        if method not in ("claim", "heartbeat", "complete", "fail", "status"):
+            raise RemoteQueueError(-32601, f"未知のメソッドです: {method}")
+        try:
+            return getattr(self, method)(**params)
+        except TypeError as e:
+            raise RemoteQueueError(-32602, str(e))
+
+    # ---- 待ち受け --------------------------------------------------------
+    def serve_in_background(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        self._server = _Server((host, port), _Handler)
+        self._server.coordinator = self
+        threading.Thread(target=self._server.serve_forever, name="coordinator", daemon=True).start()
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+class CoordinatorClient:
+    """ワーカー側の接続。スレッド間で共有でき（1 リクエストずつ送る）、切断されたら次の呼び出しで繋ぎ直す。"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._seq = 0
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile("rwb")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sock is not None:
+                self._file.close()
+                self._sock.close()
+            self._sock = self._file = None
+
+    def call(self, method: str, **params: Any) -> Any:
+        with self._lock:
+            self._seq += 1
+            message = {"jsonrpc": "2.0", "id": self._seq, "method": method, "params": params}
+            data = (json.dumps(message, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._file.write(data)
+                self._file.flush()
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError("コーディネーターとの接続が切れました")
+            except OSError:
+                if self._sock is not None:
+                    self._sock.close()
+                self._sock = self._file = None
+                raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RemoteQueueError(response["error"]["code"], response["error"]["message"])
+        return response["result"]
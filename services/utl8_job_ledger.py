@@ -0,0 +1,234 @@
+# utl8_job_ledger.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+# metadata.sqlite3 と同じく dl 直下に置く（ライブラリ本体とは別ファイル）
+DEFAULT_LEDGER_PATH = os.path.join("dl", "jobs.sqlite3")
+
+# 1 本の動画が通る段（この順に進む）
+STAGE_ENUMERATED = "enumerated"
+STAGE_DOWNLOADED = "downloaded"
+STAGE_INFO_JSON  = "info_json"
+STAGE_THUMBNAIL  = "thumbnail"
+STAGE_TITLE_FILE = "title_file"
+STAGES = (STAGE_ENUMERATED, STAGE_DOWNLOADED, STAGE_INFO_JSON, STAGE_THUMBNAIL, STAGE_TITLE_FILE)
+
+def video_id_from_url(video_url: str) -> Optional[str]:
+    """watch?v=<id> / youtu.be/<id> から動画IDを取り出す。取れなければ None。"""
+    parsed = urlparse(video_url)
+    if parsed.netloc.endswith("youtu.be"):
+        return parsed.path.lstrip("/") or None
+    return (parse_qs(parsed.query).get("v") or [None])[0]
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS enumerations (
+        source_url   TEXT PRIMARY KEY,
+        completed    INTEGER NOT NULL DEFAULT 0,
+        updated_at   TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now'))
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        video_id     TEXT NOT NULL,
+        source_url   TEXT NOT NULL,
+        seq          INTEGER NOT NULL,
+        video_url    TEXT NOT NULL,
+        PRIMARY KEY (source_url, video_id)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS job_stages (
+        video_id     TEXT NOT NULL,
+        stage        TEXT NOT NULL,
+        path         TEXT,
+        done_at      TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now')),
+        PRIMARY KEY (video_id, stage)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS download_stats (
+        run_id               TEXT NOT NULL,
+        video_id             TEXT NOT NULL,
+        concurrent_fragments INTEGER,
+        fragmented           INTEGER,
+        bytes                INTEGER,
+        seconds              REAL,
+        bytes_per_sec        REAL,
+        recorded_at          TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now')),
+        PRIMARY KEY (run_id, video_id)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS stall_events (
+        run_id         TEXT NOT NULL,
+        video_id       TEXT NOT NULL,
+        player_client  TEXT,
+        format_id      TEXT,
+        reason         TEXT NOT NULL,
+        detail         TEXT,
+        recorded_at    TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S','now'))
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_source_seq ON jobs(source_url, seq);")
+
+class JobLedger:
+    """
+    動画ごと・段ごとの進捗を SQLite に記録する台帳。
+    中断（ctrl+c/クラッシュ）後の再実行で、列挙済みのURL一覧と完了済みの段を引き継ぐ。
+
+    完了済みの段は起動時にメモリへ読み込むため、判定は 1 本あたり O(1)。
+    スレッド間で共有でき、プロセスモードでは pickle されて子プロセス側で接続し直す。
+    """
+
+    def __init__(self, ledger_path: str = DEFAULT_LEDGER_PATH):
+        self.ledger_path = ledger_path
+        self.run_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"  # この実行の識別子
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(ledger_path) or ".", exist_ok=True)
+        conn = self._conn()
+        self._done: Dict[str, Dict[str, Optional[str]]] = {}
+        for video_id, stage, path in conn.execute("SELECT video_id, stage, path FROM job_stages"):
+            self._done.setdefault(video_id, {})[stage] = path
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_local")
+        state.pop("_lock")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ledger_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            _ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    # ---- 列挙 ------------------------------------------------------------
+    def enumerated_urls(self, source_url: str) -> Optional[List[str]]:
+        """source_url の列挙が完了済みなら、前回の動画URL一覧を返す。未完了なら None。"""
+        conn = self._conn()
+        row = conn.execute("SELECT completed FROM enumerations WHERE source_url=?", (source_url,)).fetchone()
+        if not row or not row[0]:
+            return None
+        rows = conn.execute("SELECT video_url FROM jobs WHERE source_url=? ORDER BY seq", (source_url,))
+        return [r[0] for r in rows]
+
+    def begin_enumeration(self, source_url: str) -> None:
+        """source_url の列挙をやり直す（前回の一覧を消し、未完了にする）。"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM jobs WHERE source_url=?", (source_url,))
+            conn.execute("""
+                INSERT INTO enumerations (source_url, completed) VALUES (?, 0)
+                ON CONFLICT(source_url) DO UPDATE SET completed=0,
+                    updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            """, (source_url,))
+
+    def add_enumerated(self, source_url: str, seq: int, video_url: str) -> Optional[str]:
+        """列挙中に見つかった動画を 1 件記録し、enumerated 段とする。video_id を返す。"""
+        video_id = video_id_from_url(video_url)
+        if not video_id:
+            return None
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (video_id, source_url, seq, video_url) VALUES (?, ?, ?, ?)",
+                (video_id, source_url, seq, video_url))
+            conn.execute(
+                "INSERT OR IGNORE INTO job_stages (video_id, stage) VALUES (?, ?)",
+                (video_id, STAGE_ENUMERATED))
+        with self._lock:
+            self._done.setdefault(video_id, {}).setdefault(STAGE_ENUMERATED, None)
+        return video_id
+
+    def complete_enumeration(self, source_url: str) -> None:
+        """列挙が最後まで終わったことを記録する（次回の再開時は一覧を再利用する）。"""
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                UPDATE enumerations SET completed=1,
+                    updated_at=strftime('%Y-%m-%d %H:%M:%S','now')
+                WHERE source_url=?
+            """, (source_url,))
+
+    def record_enumeration(self, source_url: str, video_urls: List[str]) -> None:
+        """列挙結果をまとめて保存する。"""
+        self.begin_enumeration(source_url)
+        for seq, video_url in enumerate(video_urls):
+            self.add_enumerated(source_url, seq, video_url)
+        self.complete_enumeration(source_url)
+
+    def forget_enumeration(self, source_url: str) -> None:
+        """次回は source_url を列挙し直す（新着動画を拾いたいとき）。段の記録は残す。"""
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE enumerations SET completed=0 WHERE source_url=?", (source_url,))
+
+    # ---- 段 --------------------------------------------------------------
+    def is_done(self, video_id: Optional[str], stage: str) -> bool:
+        return bool(video_id) and stage in self._done.get(video_id, {})
+
+    def is_complete(self, video_id: Optional[str]) -> bool:
+        """enumerated 以外の全段が完了していれば True。"""
+        done = self._done.get(video_id or "", {})
+        return all(stage in done for stage in STAGES[1:])
+
+    def stage_path(self, video_id: str, stage: str) -> Optional[str]:
+        """段の完了時に記録した成果物のパス。"""
+        return self._done.get(video_id, {}).get(stage)
+
+    def mark_done(self, video_id: str, stage: str, path: Optional[str] = None) -> None:
+        if stage not in STAGES:
+            raise ValueError(f"未知の段です: {stage}")
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO job_stages (video_id, stage, path) VALUES (?, ?, ?)
+                ON CONFLICT(video_id, stage) DO UPDATE SET path=excluded.path,
+                    done_at=strftime('%Y-%m-%d %H:%M:%S','now')
+            """, (video_id, stage, path))
+        with self._lock:
+            self._done.setdefault(video_id, {})[stage] = path
+
+    def done_stages(self, video_id: str) -> Set[str]:
+        return set(self._done.get(video_id, {}))
+
+    # ---- 計測 ------------------------------------------------------------
+    def record_download_stats(self, stats: Optional[Dict[str, Any]]) -> None:
+        """メディアDLで使った断片の同時ダウンロード数と、計測したスループットを記録する。"""
+        if not stats:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO download_stats
+                    (run_id, video_id, concurrent_fragments, fragmented, bytes, seconds, bytes_per_sec)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (self.run_id, stats["video_id"], stats["concurrent_fragments"], int(stats["fragmented"]),
+                  stats["bytes"], stats["seconds"], stats["bytes_per_sec"]))
+
+    def record_stall_events(self, video_id: Optional[str], events: Optional[List[Dict[str, Any]]]) -> None:
+        """転送の停止/絞り込みで URL を取り直した記録（player_client・フォーマット・理由）を残す。"""
+        if not video_id or not events:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT INTO stall_events (run_id, video_id, player_client, format_id, reason, detail)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(self.run_id, video_id, e["player_client"], e["format_id"], e["reason"], e["detail"])
+                  for e in events])
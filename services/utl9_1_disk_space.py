@@ -0,0 +1,169 @@
+# utl9_1_disk_space.py
+
+import errno
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# 予約を足しても残しておく空き容量（バイト）
+DEFAULT_MIN_FREE_BYTES = 1024 * 1024 * 1024
+# 大きさが分からない動画の見積もり（バイト）
+UNKNOWN_ESTIMATE_BYTES = 512 * 1024 * 1024
+# 映像と音声を結合する場合、結合中は元の 2 本と結合後の 1 本が同時にある
+MERGE_FACTOR = 2
+# 予約の有効期限（秒）。プロセスが落ちても、この時間が過ぎれば他のプロセスの計算から外れる
+DEFAULT_LEASE_SEC = 6 * 60 * 60
+# 空き待ちで確認する間隔（秒）
+POLL_SEC = 5.0
+
+def estimate_bytes(resolved: Optional[Dict[str, Any]], final_only: bool = False) -> int:
+    """
+    フォーマット選択済みの info（select_formats の結果）から、DLで使うディスク容量を見積もる。
+    filesize → filesize_approx → tbr × duration の順に使い、どれも無ければ UNKNOWN_ESTIMATE_BYTES。
+    final_only=True なら結合中の分を含めない（完成したメディアだけの大きさ）。
+    """
+    if not resolved:
+        return UNKNOWN_ESTIMATE_BYTES
+    requested = resolved.get('requested_formats') or [resolved]
+    duration = resolved.get('duration') or 0
+    total = 0
+    for f in requested:
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = f['tbr'] * 1000 / 8 * duration  # tbr は kbit/s
+        if not size:
+            return UNKNOWN_ESTIMATE_BYTES
+        total += size
+    return int(total * (MERGE_FACTOR if len(requested) > 1 and not final_only else 1))
+
+class DiskFull(OSError):
+    """他のDLが終わっても見積もりが空き容量に収まらない（errno は ENOSPC なので、再試行しない disk_full 扱いになる）。"""
+
+    def __init__(self, nbytes: int, free: int, min_free: int):
+        super().__init__(errno.ENOSPC, f"空き容量が足りません（見積もり {nbytes / 1024 ** 2:.0f} MiB"
+                                       f" / 空き {free / 1024 ** 2:.0f} MiB / 残す容量 {min_free / 1024 ** 2:.0f} MiB）")
+
+class DiskSpaceGuard:
+    """
+    DLを始める前に、見積もった容量を共有の台帳（dl/jobs.sqlite3 の disk_reservations）に予約する。
+    空き容量 - 他の予約 - 今回の見積もり が min_free_bytes を下回るなら、他のDLが終わって
+    予約が減るまで待つ（同じ台帳を使う全プロセス・全スレッドで共有）。
+    他に予約が無いのに足りない場合は待っても空かないので、DiskFull を送出する。
+
+    空き容量は DL が進むにつれて減るが、予約は終わるまで満額のまま数えるため、見積もりは安全側に寄る。
+    """
+
+    def __init__(self, min_free_bytes: int = DEFAULT_MIN_FREE_BYTES, lease_sec: float = DEFAULT_LEASE_SEC,
+                 enabled: bool = True):
+        self.min_free_bytes = min_free_bytes
+        self.lease_sec = lease_sec
+        self.enabled = enabled
+
+    @staticmethod
+    def _connect(ledger_path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(ledger_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(ledger_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS disk_reservations (
+            key          TEXT PRIMARY KEY,
+            device       INTEGER NOT NULL,
+            bytes        INTEGER NOT NULL,
+            lease_until  REAL NOT NULL
+        );
+        """)
+        return conn
+
+    def _try_reserve(self, conn: sqlite3.Connection, key: str, device: int, path: str,
+                     nbytes: int) -> Optional[Dict[str, int]]:
+        """予約できたら None、できなければ判断に使った値を返す。"""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM disk_reservations WHERE lease_until < ?", (now,))
+            (reserved,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM disk_reservations WHERE device=?",
+                                       (device,)).fetchone()
+            free = shutil.disk_usage(path).free
+            if free - reserved - nbytes < self.min_free_bytes:
+                conn.execute("ROLLBACK")
+                return {"free": free, "reserved": reserved}
+            conn.execute("INSERT INTO disk_reservations (key, device, bytes, lease_until) VALUES (?, ?, ?, ?)",
+                         (key, device, nbytes, now + self.lease_sec))
+            conn.execute("COMMIT")
+            return None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, path: str, nbytes: int, ledger_path: str, label: str = "") -> Optional["Reservation"]:
+        """
+        path（DL先のフォルダ）のあるディスクに nbytes を予約する（足りなければ待つ）。
+        解放は戻り値の release() で行う（別スレッドからでもよい）。確認しない設定なら None。
+        """
+        if not self.enabled or nbytes <= 0:
+            return None
+        os.makedirs(path, exist_ok=True)
+        device = os.stat(path).st_dev
+        key = f"{label}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        conn = self._connect(ledger_path)
+        try:
+            announced = False
+            while True:
+                shortage = self._try_reserve(conn, key, device, path, nbytes)
+                if shortage is None:
+                    return Reservation(ledger_path, key)
+                if not shortage["reserved"]:
+                    raise DiskFull(nbytes, shortage["free"], self.min_free_bytes)
+                if not announced:
+                    print(f"空き容量が足りないため、他のダウンロードが終わるまで待ちます: {label} "
+                          f"(見積もり {nbytes / 1024 ** 2:.0f} MiB / 空き {shortage['free'] / 1024 ** 2:.0f} MiB"
+                          f" / 予約済み {shortage['reserved'] / 1024 ** 2:.0f} MiB)")
+                    announced = True
+                time.sleep(POLL_SEC)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def reserve(self, path: str, nbytes: int, ledger_path: str, label: str = "") -> Iterator[None]:
+        """acquire() した予約を、抜けるときに解放する。"""
+        reservation = self.acquire(path, nbytes, ledger_path, label)
+        try:
+            yield
+        finally:
+            if reservation is not None:
+                reservation.release()
+
+class Reservation:
+    """台帳の 1 件の予約。release() は何度呼んでもよい。"""
+
+    def __init__(self, ledger_path: str, key: str):
+        self.ledger_path = ledger_path
+        self.key = key
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        # 予約したスレッドとは別のスレッド（ステージングの移動）から呼ばれることがあるので、接続は都度開く
+        conn = DiskSpaceGuard._connect(self.ledger_path)
+        try:
+            conn.execute("DELETE FROM disk_reservations WHERE key=?", (self.key,))
+        finally:
+            conn.close()
+
+# プロセス内で共有する既定の guard
+_DEFAULT_GUARD = DiskSpaceGuard()
+
+def default_disk_guard() -> DiskSpaceGuard:
+    return _DEFAULT_GUARD
+
+def configure_disk_guard(min_free_bytes: Optional[int] = DEFAULT_MIN_FREE_BYTES) -> DiskSpaceGuard:
+    """既定の guard の残す容量を変える（None で容量の確認をしない）。"""
+    _DEFAULT_GUARD.enabled = min_free_bytes is not None
+    _DEFAULT_GUARD.min_free_bytes = min_free_bytes or 0
+    return _DEFAULT_GUARD
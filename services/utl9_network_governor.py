@@ -0,0 +1,205 @@
+# utl9_network_governor.py
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限。
+    rate は 1 秒あたりの補充量（リクエスト数 or バイト数）、burst はためておける上限。
+    rate が None / 0 以下なら無制限。複数スレッドから共有できる。
+    """
+
+    def __init__(self, rate: float | None, burst: float | None = None):
+        self._lock = threading.Lock()
+        self._rate = None
+        self._burst = 0.0
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float | None, burst: float | None = None) -> None:
+        """実行中でも変更できる。burst 省略時は 1 秒分。"""
+        with self._lock:
+            self._refill()
+            self._rate = rate if rate and rate > 0 else None
+            self._burst = float(burst if burst else (rate or 0))
+            self._tokens = min(self._tokens, self._burst)
+
+    @property
+    def rate(self) -> float | None:
+        return self._rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate:
+            self._tokens = min(self._burst, self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """amount 分のトークンが貯まるまで待つ。待った秒数を返す。"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                if not self._rate:
+                    return waited
+                self._refill()
+                # burst より大きい要求は、バケットを空にした上で不足分を待つ（借り越し）
+                if self._tokens >= min(amount, self._burst):
+                    self._tokens -= amount
+                    return waited
+                shortage = min(amount, self._burst) - self._tokens
+                delay = shortage / self._rate
+            time.sleep(delay)
+            waited += delay
+
+class HostLimiter:
+    """
+    同時接続数の上限つきセマフォ。limit は実行中でも変更でき、
+    下げた場合は使用中の接続が返るまで新しい接続を待たせる。limit が None なら無制限。
+    """
+
+    def __init__(self, limit: int | None):
+        self._cond = threading.Condition()
+        self._limit = limit
+        self.active = 0
+
+    @property
+    def limit(self) -> int | None:
+        return self._limit
+
+    def set_limit(self, limit: int | None) -> None:
+        with self._cond:
+            self._limit = limit if limit and limit > 0 else None
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, count: int = 1) -> Iterator[None]:
+        """接続枠を count 個まとめて借りる（上限より多い分は上限まで減らす。待っても空かないため）。"""
+        with self._cond:
+            while True:
+                taken = min(count, self._limit) if self._limit is not None else count
+                if self._limit is None or self.active + taken <= self._limit:
+                    break
+                self._cond.wait()
+            self.active += taken
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= taken
+                self._cond.notify_all()
+
+# ホスト（末尾一致）ごとの同時接続数の既定値。ここに無いホストは無制限
+DEFAULT_HOST_LIMITS: Dict[str, int | None] = {
+    "googlevideo.com": 4,   # メディア本体
+    "www.youtube.com": 4,   # 情報抽出（watch ページ / innertube API）
+    "img.youtube.com": 8,   # サムネイル（jpg）
+    "i.ytimg.com": 8,       # サムネイル（webp / info_dict の thumbnails）
+}
+
+class NetworkGovernor:
+    """
+    プロセス内のネットワーク利用をまとめて制御する。
+      - 帯域: 全ワーカー共有のトークンバケット（バイト/秒）。None で無制限
+      - 接続: ホストごとの同時接続数の上限
+    yt-dlp の転送は progress_hooks で受け取ったバイト数ぶんトークンを消費させ
+    （フックはダウンロードしているスレッドで呼ばれるので、そこで待たせると転送が絞られる）、
+    サムネイルの HTTP は connection() と consume() を直接使う。
+    上限は set_bandwidth / set_host_limit で実行中に変更できる。
+    プロセスモードのワーカーでは子プロセスごとに別の governor になる点に注意。
+    """
+
+    def __init__(self, bandwidth: float | None = None,
+                 host_limits: Optional[Dict[str, int | None]] = None):
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(None)
+        self._hosts: Dict[str, HostLimiter] = {}
+        self._seen_bytes: Dict[str, int] = {}
+        self.set_bandwidth(bandwidth)
+        for host, limit in (DEFAULT_HOST_LIMITS if host_limits is None else host_limits).items():
+            self.set_host_limit(host, limit)
+
+    # ---- 設定 -----------------------------------------------------------
+    def set_bandwidth(self, bytes_per_sec: float | None) -> None:
+        # burst は 0.25 秒分（最低 64KiB）: 大きすぎると制限の効きが粗くなる
+        burst = max(64 * 1024, bytes_per_sec / 4) if bytes_per_sec else None
+        self._bucket.set_rate(bytes_per_sec, burst)
+
+    def set_host_limit(self, host: str, limit: int | None) -> None:
+        with self._lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                self._hosts[host] = HostLimiter(None)
+                limiter = self._hosts[host]
+        limiter.set_limit(limit)
+
+    def limits(self) -> Dict[str, Any]:
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {
+            "bandwidth": self._bucket.rate,
+            "hosts": {host: {"limit": limiter.limit, "active": limiter.active}
+                      for host, limiter in hosts.items()},
+        }
+
+    # ---- 接続 -----------------------------------------------------------
+    def _limiter_for(self, url_or_host: str) -> Optional[HostLimiter]:
+        host = urlparse(url_or_host).hostname if "://" in url_or_host else url_or_host
+        if not host:
+            return None
+        with self._lock:
+            for suffix, limiter in self._hosts.items():
+                if host == suffix or host.endswith("." + suffix):
+                    return limiter
+        return None
+
+    def host_limit(self, url_or_host: str) -> int | None:
+        """url（またはホスト名）の同時接続数の上限。無制限なら None。"""
+        limiter = self._limiter_for(url_or_host)
+        return limiter.limit if limiter is not None else None
+
+    @contextmanager
+    def connection(self, url_or_host: str, count: int = 1) -> Iterator[None]:
+        """
+        url（またはホスト名）の接続枠を count 個借りる（断片を並列に取る転送は段数ぶん）。
+        上限の無いホストはそのまま通す。
+        """
+        limiter = self._limiter_for(url_or_host)
+        if limiter is None:
+            yield
+            return
+        with limiter.slot(count):
+            yield
+
+    def consume(self, nbytes: int) -> float:
+        """転送したバイト数ぶんの帯域を消費する（足りなければ待つ）。待った秒数を返す。"""
+        if nbytes <= 0:
+            return 0.0
+        return self._bucket.acquire(nbytes)
+
+    # ---- yt-dlp ---------------------------------------------------------
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        info = d.get("info_dict") or {}
+        key = f"{info.get('id')}:{info.get('format_id')}"
+        downloaded = d.get("downloaded_bytes") or 0
+        with self._lock:
+            if d.get("status") != "downloading":
+                self._seen_bytes.pop(key, None)
+                return
+            delta = downloaded - self._seen_bytes.get(key, 0)
+            self._seen_bytes[key] = downloaded
+        self.consume(delta)
+
+    def ydl_opts(self) -> Dict[str, Any]:
+        """ydl_opts に足すフック設定。"""
+        return {"progress_hooks": [self.progress_hook]}
+
+# プロセス内で共有する既定の governor
+_DEFAULT_GOVERNOR = NetworkGovernor()
+
+def default_governor() -> NetworkGovernor:
+    return _DEFAULT_GOVERNOR